@@ -0,0 +1,93 @@
+# complete ioc@NAME.service for systemctl from the procServ name cache
+# Generated by: python3 -m procServUtils.complete bash-systemctl
+#
+# Completion scripts are loaded on demand for their own command, so this
+# can not be part of the manage-procs one.  Source it explicitly, eg. from
+# ~/.bashrc after bash-completion:
+#
+#   . /usr/share/procServUtils/procserv-systemctl.bash
+#
+# Other words are deferred to the regular systemctl completion, loaded on
+# the first <TAB> after "systemctl".  Without bash-completion installed,
+# only instance units are completed.
+
+# print cached instance names of one scope
+_procserv_names()
+{
+    local file=/run/procServ.names
+    [[ $1 == user ]] && file=${XDG_RUNTIME_DIR:-/run/user/$UID}/procServ.names
+    if [[ -r $file ]]; then
+        printf '%s\n' "$(<"$file")"
+    else
+        python3 -m procServUtils.complete names --$1 2>/dev/null
+    fi
+}
+
+# the scope selected by --user/--system, defaulting as the tools do
+_procserv_scope()
+{
+    local w scope=user
+    [[ $EUID -eq 0 ]] && scope=system
+    for w in "${COMP_WORDS[@]}"; do
+        case $w in
+        --user) scope=user;;
+        --system) scope=system;;
+        esac
+    done
+    echo $scope
+}
+
+# complete the word under the cursor from a list, allowing for names
+# split at COMP_WORDBREAKS (eg. the @ in ioc@NAME)
+_procserv_compgen()
+{
+    local line=${COMP_LINE:0:COMP_POINT}
+    local word=${line##*[[:space:]]}
+    local brk=${word%"${word##*[@:]}"}
+    COMPREPLY=($(compgen -P "$2" -S "$3" -W "$1" -- "${word#"$2"}"))
+    if [[ -n $brk && $COMP_WORDBREAKS == *"${brk: -1}"* ]]; then
+        COMPREPLY=("${COMPREPLY[@]#"$brk"}")
+    fi
+}
+
+# complete an option value.  Returns 1 if prev is not an option taking one.
+# Each spec is "OPTIONS=CHOICES", or just "OPTIONS" for a path
+_procserv_optvalue()
+{
+    local prev=$1; shift
+    local spec
+    for spec in "$@"; do
+        [[ " ${spec%%=*} " == *" $prev "* ]] || continue
+        if [[ $spec == *=* ]]; then
+            COMPREPLY=($(compgen -W "${spec#*=}" -- "$cur"))
+        else
+            compopt -o default 2>/dev/null
+            COMPREPLY=()
+        fi
+        return 0
+    done
+    return 1
+}
+
+
+_procserv_systemctl()
+{
+    local line=${COMP_LINE:0:COMP_POINT}
+    local word=${line##*[[:space:]]}
+    if [[ $word == ioc@* ]]; then
+        local scope=system
+        [[ " ${COMP_WORDS[*]} " == *" --user "* ]] && scope=user
+        _procserv_compgen "$(_procserv_names $scope)" ioc@ .service
+        return
+    fi
+    if [[ -z ${_procserv_systemctl_orig+x} ]]; then
+        _procserv_systemctl_orig=
+        complete -r systemctl
+        declare -F _completion_loader >/dev/null && _completion_loader systemctl
+        local spec=$(complete -p systemctl 2>/dev/null)
+        [[ $spec == *" -F "* ]] && spec=${spec#* -F } && _procserv_systemctl_orig=${spec%% *}
+        complete -F _procserv_systemctl systemctl
+    fi
+    [[ -n $_procserv_systemctl_orig ]] && "$_procserv_systemctl_orig" "$@"
+}
+complete -F _procserv_systemctl systemctl
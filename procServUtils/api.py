@@ -0,0 +1,288 @@
+"""Python API for procServ instances
+
+    from procServUtils.api import Fleet
+    F = Fleet(user=True)
+    for I in F:
+        print(I.name, I.argv)
+    F.add('myioc', ['./st.cmd'], chdir='/path/to/ioc', port='2001', publish=False)
+    F.publish()
+
+One Fleet loads the configuration once and keeps it up to date as
+instances are added or removed, so bulk operations don't re-parse.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno
+from collections import namedtuple
+
+from .conf import getconf, getgendir
+
+try:
+    import shlex
+except ImportError:
+    from . import shlex
+
+class Instance(object):
+    """One configured procServ instance
+    """
+    __slots__ = ('name', 'argv', 'chdir', 'port', 'user', 'group', 'host', 'site')
+
+    def __init__(self, name, argv, chdir='/', port='0', user='nobody', group='nogroup',
+                 host=None, site=None):
+        self.name, self.argv, self.chdir, self.port = name, argv, chdir, port
+        self.user, self.group, self.host, self.site = user, group, host, site
+
+    @classmethod
+    def fromconf(cls, conf, name):
+        opt = lambda K:conf.get(name, K) if conf.has_option(name, K) else None
+        cmd = opt('command')
+        return cls(name, shlex.split(cmd) if cmd else [],
+                   chdir=conf.get(name, 'chdir'), port=conf.get(name, 'port'),
+                   user=conf.get(name, 'user'), group=conf.get(name, 'group'),
+                   host=opt('host'), site=opt('site'))
+
+    @property
+    def command(self):
+        """The command= string
+        """
+        return ' '.join(map(shlex.quote, self.argv))
+
+    @property
+    def unit(self):
+        return 'ioc@%s.service'%self.name
+
+    def __eq__(self, other):
+        return isinstance(other, Instance) and all(getattr(self, K)==getattr(other, K) for K in self.__slots__)
+
+    def __ne__(self, other):
+        return not self==other
+
+    def __repr__(self):
+        return 'Instance(%s)'%', '.join('%s=%r'%(K, getattr(self, K)) for K in self.__slots__)
+
+Status = namedtuple('Status', ['name', 'state', 'pid', 'ports'])
+Status.__doc__ = """Runtime state of one instance
+
+state is 'Running', 'Dead' or 'Stopped'.
+"""
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno==errno.ESRCH:
+            return False
+        elif e.errno!=errno.EPERM:
+            _log.exception("Testing PID %s", pid)
+    return True
+
+class Fleet(object):
+    """The procServ instances of one scope (system or user)
+
+    conf may be a ConfigParser as from getconf(), otherwise
+    the configuration is loaded on first use.
+    """
+    def __init__(self, user=False, conf=None):
+        self.user = user
+        self._conf = conf
+        self._gen = None # last queued change not yet published
+
+    @property
+    def conf(self):
+        if self._conf is None:
+            self._conf = getconf(user=self.user)
+        return self._conf
+
+    def reload(self):
+        """Discard the loaded configuration
+        """
+        self._conf = None
+
+    def names(self):
+        C = self.conf
+        return [N for N in C.sections() if C.getboolean(N, 'instance')]
+
+    def __iter__(self):
+        C = self.conf
+        for N in C.sections():
+            if C.getboolean(N, 'instance'):
+                yield Instance.fromconf(C, N)
+
+    def __contains__(self, name):
+        C = self.conf
+        return C.has_section(name) and C.getboolean(name, 'instance')
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return Instance.fromconf(self.conf, name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def status(self, names=None):
+        """Iterate Status of the named (default all) instances
+        """
+        from .registry import scan, readinfo
+        reg = dict((E.name, E) for E in scan(user=self.user))
+
+        for name in names or self.names():
+            ent = reg.get(name)
+            if ent is not None:
+                pid, ports = ent.pid, list(ent.ports)
+            else:
+                # not started since the registry was introduced
+                pid, ports = readinfo(name, user=self.user)
+            ports = tuple(P.split(':', 1)[1] if ':' in P else P for P in ports)
+
+            if pid is not None:
+                _log.debug('Test PID %s', pid)
+                state = 'Running' if _alive(pid) else 'Dead'
+            elif ent is not None and ent.state=='failed':
+                state = 'Dead'
+            else:
+                state = 'Stopped'
+            yield Status(name, state, pid, ports if state=='Running' else ())
+
+    def _args(self, **kws):
+        from argparse import Namespace
+        from .publish import systemd_dir
+        opts = {
+            'user':self.user,
+            'writeconf':True,
+            'writesysd':True,
+            'outsysd':systemd_dir,
+            'reload':False,
+        }
+        opts.update(kws)
+        return Namespace(**opts)
+
+    def add(self, name, argv, chdir='/', port=None, user=None, group=None, host=None,
+            site=None, force=False, publish=True, port_range=None, **kws):
+        """Write the config file for a new instance.
+
+        With no port, and a port_range of 'FIRST-LAST', the first free port
+        of the range is taken while the config is locked.
+
+        With publish=False the conserver config and systemd units are not
+        regenerated until publish() is called, which allows many changes
+        to share one regeneration.  Other keyword arguments are passed
+        to publish().
+        Returns the new Instance.
+        """
+        from .lock import Lock, lockfile
+        from .publish import request
+        from .check import freeport
+
+        args = self._args(**kws)
+        outdir = getgendir(user=self.user)
+        cfile = os.path.join(outdir, '%s.conf'%name)
+        I = Instance(name, list(argv), chdir=chdir, port=port or '0',
+                     user=user or 'nobody', group=group or 'nogroup', host=host, site=site)
+
+        try:
+            os.makedirs(outdir)
+        except OSError as e:
+            if e.errno!=errno.EEXIST:
+                raise
+
+        with Lock(lockfile('config', user=self.user)):
+            if (os.path.exists(cfile) or name in self) and not force:
+                raise ValueError("Instance '%s' already exists"%name)
+
+            if port is None and port_range:
+                port = I.port = freeport(getconf(user=self.user), port_range)
+                if port is None:
+                    raise ValueError('No free port in %s'%port_range)
+
+            opts = [('command', I.command), ('chdir', chdir)]
+            opts.extend((K, V) for K, V in (('user', user), ('group', group), ('host', host),
+                                            ('site', site), ('port', port)) if V)
+
+            tmpfile = '%s.%d.tmp'%(cfile, os.getpid())
+            with open(tmpfile, 'w') as F:
+                F.write('\n[%s]\n'%name)
+                for K, V in opts:
+                    F.write('%s = %s\n'%(K, V.replace('%', '%%')))
+            os.rename(tmpfile, cfile)
+            self._gen = request(args)
+
+        C = self.conf
+        if not C.has_section(name):
+            C.add_section(name)
+        for K, V in opts:
+            C.set(name, K, V.replace('%', '%%'))
+
+        if publish:
+            self.publish(**kws)
+        return I
+
+    def remove(self, name, publish=True, **kws):
+        """Remove an instance from the config files.
+
+        Returns the list of files changed.  Raises ValueError if no file
+        defines the instance, eg. a member of an instance set.
+        """
+        from .lock import Lock, lockfile
+        from .publish import request
+        from .conf import findsections, _notfound
+
+        args = self._args(**kws)
+        changed = []
+        with Lock(lockfile('config', user=self.user)):
+            for cfile, C in findsections(name, user=self.user):
+                if len(C.defaults())==1 and len(C.sections())==1:
+                    _log.info('Removing empty file %s', cfile)
+                    os.remove(cfile)
+                else:
+                    C.remove_section(name)
+                    C.remove_option('DEFAULT', 'instance')
+                    tmpfile = '%s.%d.tmp'%(cfile, os.getpid())
+                    with open(tmpfile, 'w') as F:
+                        C.write(F)
+                    os.rename(tmpfile, cfile)
+                changed.append(cfile)
+            if not changed:
+                raise ValueError(_notfound(self.conf, name))
+            self._gen = request(args)
+
+        if self._conf is not None:
+            self._conf.remove_section(name)
+        if publish:
+            self.publish(**kws)
+        return changed
+
+    def publish(self, **kws):
+        """Regenerate conserver config and systemd units and reload systemd,
+        once for all changes since the last publish().
+
+        Keyword arguments (writeconf, writesysd, outsysd, reload) apply
+        when nothing was queued by add() or remove(), which take the same.
+        """
+        from .lock import Lock, lockfile
+        from .publish import request, publish
+        args = self._args(**kws)
+        gen = self._gen
+        if gen is None:
+            with Lock(lockfile('config', user=self.user)):
+                gen = request(args)
+        publish(args, gen)
+        self._gen = None
+
+    def generate(self, outdir):
+        """Write systemd units for every instance into outdir
+        """
+        from .generator import run
+        run(outdir, user=self.user, conf=self.conf)
+
+    def check(self, jobs=None):
+        """Validate the configuration.  Returns a list of procServUtils.check.Problem
+        """
+        from .conf import getconffiles
+        from .check import check
+        return check(self.conf, user=self.user, files=getconffiles(user=self.user), jobs=jobs)
@@ -0,0 +1,193 @@
+"""Console broker
+
+Keeps one connection open to the control port of each instance and
+shares it with any number of local clients, each connecting to a UNIX
+socket per instance.  Recent output is kept in a fixed size ring buffer
+so that a new client is shown the scrollback straight away.
+
+All consoles are served by a single asyncio event loop.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import sys, os, errno
+
+from .conf import getrundir
+
+def getbrokerdir(user=False):
+    """Return the directory holding the client sockets
+    """
+    return os.path.join(getrundir(user=user), 'procServ-broker')
+
+class Scrollback(object):
+    """Fixed size byte ring buffer
+    """
+    def __init__(self, size=64*1024):
+        self.buf = bytearray(size)
+        self.size = size
+        self.pos = 0    # next write offset
+        self.full = False
+
+    def append(self, data):
+        N = len(data)
+        if N>=self.size:
+            self.buf[:] = data[-self.size:]
+            self.pos, self.full = 0, True
+            return
+        end = self.pos+N
+        if end<=self.size:
+            self.buf[self.pos:end] = data
+        else:
+            first = self.size-self.pos
+            self.buf[self.pos:] = data[:first]
+            self.buf[:N-first] = data[first:]
+        if end>=self.size:
+            self.full = True
+        self.pos = end%self.size
+
+    def get(self):
+        if not self.full:
+            return bytes(self.buf[:self.pos])
+        return bytes(self.buf[self.pos:]+self.buf[:self.pos])
+
+class Console(object):
+    """One instance console, shared with local clients
+
+    getendpoint is called before each (re)connect and returns an endpoint
+    as from procServUtils.probe.endpoint(), or None if not running.
+    """
+    # drop clients with this much output queued
+    max_queued = 256*1024
+    # seconds between reconnect attempts, doubled up to max_retry
+    min_retry, max_retry = 1.0, 30.0
+
+    def __init__(self, name, getendpoint, scrollback=64*1024, readonly=False):
+        self.name = name
+        self.getendpoint = getendpoint
+        self.scrollback = Scrollback(scrollback)
+        self.readonly = readonly
+        self.clients = set()
+        self.upstream = None
+
+    def _broadcast(self, data):
+        self.scrollback.append(data)
+        for W in list(self.clients):
+            if W.transport.get_write_buffer_size()>self.max_queued:
+                _log.warning('%s: dropping slow client', self.name)
+                self.clients.discard(W)
+                W.close()
+            else:
+                W.write(data)
+
+    async def run(self):
+        """Maintain the upstream connection, forever
+        """
+        import asyncio
+        retry = self.min_retry
+        while True:
+            ep = self.getendpoint()
+            try:
+                if ep is None:
+                    raise OSError(errno.ENOENT, 'not running')
+                elif ep[0]=='unix':
+                    R, W = await asyncio.open_unix_connection(ep[1])
+                else:
+                    R, W = await asyncio.open_connection(ep[1], ep[2])
+            except OSError as e:
+                _log.debug('%s: %s', self.name, e)
+                await asyncio.sleep(retry)
+                retry = min(retry*2, self.max_retry)
+                continue
+
+            _log.info('%s: connected', self.name)
+            retry = self.min_retry
+            self.upstream = W
+            try:
+                while True:
+                    data = await R.read(4096)
+                    if not data:
+                        break
+                    self._broadcast(data)
+            except OSError as e:
+                _log.debug('%s: %s', self.name, e)
+            finally:
+                self.upstream = None
+                W.close()
+            self._broadcast(b'\r\n@@@ broker: lost connection to procServ\r\n')
+            await asyncio.sleep(retry)
+
+    async def client(self, R, W):
+        """Serve one local client
+        """
+        W.write(self.scrollback.get())
+        self.clients.add(W)
+        try:
+            while True:
+                data = await R.read(4096)
+                if not data:
+                    break
+                if not self.readonly and self.upstream is not None:
+                    self.upstream.write(data)
+        except OSError:
+            pass
+        finally:
+            self.clients.discard(W)
+            W.close()
+
+class Broker(object):
+    """Serve a set of Consoles on UNIX sockets in sockdir
+    """
+    def __init__(self, sockdir):
+        self.sockdir = sockdir
+        self.consoles = {}
+
+    def add(self, console):
+        self.consoles[console.name] = console
+
+    async def serve(self):
+        import asyncio
+        try:
+            os.makedirs(self.sockdir)
+        except OSError as e:
+            if e.errno!=errno.EEXIST:
+                raise
+
+        servers, tasks = [], []
+        for name, C in self.consoles.items():
+            path = os.path.join(self.sockdir, name)
+            try:
+                os.unlink(path)
+            except OSError as e:
+                if e.errno!=errno.ENOENT:
+                    raise
+            servers.append(await asyncio.start_unix_server(C.client, path))
+            tasks.append(asyncio.ensure_future(C.run()))
+        _log.info('Serving %d consoles in %s', len(servers), self.sockdir)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for S in servers:
+                S.close()
+
+def attach(path):
+    """Connect the terminal to a broker socket until either side closes
+    """
+    import socket, selectors
+    S = socket.socket(socket.AF_UNIX)
+    S.connect(path)
+    sel = selectors.DefaultSelector()
+    sel.register(S, selectors.EVENT_READ)
+    sel.register(sys.stdin.fileno(), selectors.EVENT_READ)
+    while True:
+        for key, _mask in sel.select():
+            if key.fileobj is S:
+                data = S.recv(4096)
+                if not data:
+                    return
+                os.write(sys.stdout.fileno(), data)
+            else:
+                data = os.read(sys.stdin.fileno(), 4096)
+                if not data:
+                    return
+                S.sendall(data)
@@ -0,0 +1,141 @@
+"""Resource usage of the whole ioc@ fleet from the cgroup v2 tree
+
+Each ioc@NAME.service unit has its own cgroup inside the slice systemd
+creates for the template, so one pass over that slice directory covers
+every instance, including any children the IOC has spawned.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno, time
+from collections import namedtuple
+
+cgroup_root = '/sys/fs/cgroup'
+
+Sample = namedtuple('Sample', ['name', 'time', 'cpu_usec', 'user_usec', 'system_usec',
+                               'mem_current', 'mem_peak', 'pids', 'io_rbytes', 'io_wbytes'])
+Sample.__doc__ = """Counters of one instance cgroup at one time
+
+Any counter the kernel does not provide is None.
+"""
+
+Usage = namedtuple('Usage', ['name', 'cpu', 'mem', 'peak', 'pids', 'read', 'write'])
+Usage.__doc__ = """Resource usage of one instance between two Samples
+
+cpu is in percent of one CPU, mem and peak in bytes, read and write in bytes/second.
+"""
+
+def getslicedirs(user=False, root=None):
+    """Return the candidate cgroup directories holding the ioc@ units
+    """
+    root = root or cgroup_root
+    if not user:
+        return [os.path.join(root, 'system.slice', 'system-ioc.slice')]
+    uid = os.getuid()
+    base = os.path.join(root, 'user.slice', 'user-%d.slice'%uid, 'user@%d.service'%uid)
+    return [
+        os.path.join(base, 'app.slice', 'app-ioc.slice'),
+        os.path.join(base, 'ioc.slice'),
+    ]
+
+def _readint(D, fname):
+    try:
+        with open(os.path.join(D, fname)) as F:
+            V = F.read().strip()
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.ENOENT, errno.ENODEV, errno.EACCES):
+            raise
+        return None
+    return None if V=='max' else int(V)
+
+def _readkeys(D, fname):
+    """Parse a flat keyed file like cpu.stat
+    """
+    ret = {}
+    try:
+        with open(os.path.join(D, fname)) as F:
+            for L in F:
+                K, _sep, V = L.partition(' ')
+                ret[K] = int(V)
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.ENOENT, errno.ENODEV, errno.EACCES):
+            raise
+    return ret
+
+def _readio(D):
+    """Sum the rbytes= and wbytes= counters of all devices in io.stat
+    """
+    R = W = 0
+    try:
+        with open(os.path.join(D, 'io.stat')) as F:
+            for L in F:
+                for KV in L.split()[1:]:
+                    K, _sep, V = KV.partition('=')
+                    if K=='rbytes':
+                        R += int(V)
+                    elif K=='wbytes':
+                        W += int(V)
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.ENOENT, errno.ENODEV, errno.EACCES):
+            raise
+        return None, None
+    return R, W
+
+def sample(user=False, root=None, aliases=None):
+    """Read the counters of every instance cgroup.
+
+    aliases maps the name in a unit to the instance running in it,
+    as from procServUtils.registry.aliases().
+    Returns a dict of instance name to Sample.
+    """
+    aliases = aliases or {}
+    ret = {}
+    for S in getslicedirs(user=user, root=root):
+        try:
+            entries = list(os.scandir(S))
+        except OSError as e:
+            if e.errno!=errno.ENOENT:
+                raise
+            continue
+        _log.debug('Scan %s', S)
+
+        for E in entries:
+            if not (E.name.startswith('ioc@') and E.name.endswith('.service')) or not E.is_dir():
+                continue
+            D = E.path
+            cpu = _readkeys(D, 'cpu.stat')
+            R, W = _readio(D)
+            name = E.name[4:-8]
+            name = aliases.get(name, name)
+            ret[name] = Sample(name=name, time=time.monotonic(),
+                               cpu_usec=cpu.get('usage_usec'),
+                               user_usec=cpu.get('user_usec'),
+                               system_usec=cpu.get('system_usec'),
+                               mem_current=_readint(D, 'memory.current'),
+                               mem_peak=_readint(D, 'memory.peak'),
+                               pids=_readint(D, 'pids.current'),
+                               io_rbytes=R, io_wbytes=W)
+        break # only the first slice which exists
+    return ret
+
+def _rate(A, B, dT, scale=1.0):
+    if A is None or B is None or dT<=0:
+        return None
+    return max(0, B-A)*scale/dT
+
+def usage(prev, cur):
+    """Compute Usage for each instance present in both sample dicts
+    """
+    ret = {}
+    for name, B in cur.items():
+        A = prev.get(name)
+        if A is None:
+            continue
+        dT = B.time-A.time
+        ret[name] = Usage(name=name,
+                          cpu=_rate(A.cpu_usec, B.cpu_usec, dT, 1e-4), # usec/sec -> %
+                          mem=B.mem_current, peak=B.mem_peak, pids=B.pids,
+                          read=_rate(A.io_rbytes, B.io_rbytes, dT),
+                          write=_rate(A.io_wbytes, B.io_wbytes, dT))
+    return ret
@@ -0,0 +1,248 @@
+"""Validation of the instance configuration
+
+Every instance is checked concurrently, and the control endpoints are
+collected into one index so collisions are found in a single pass.
+Problems are collected and reported together instead of stopping at
+the first.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, re
+from collections import namedtuple
+from functools import lru_cache
+from configparser import Error as ConfigError
+
+Problem = namedtuple('Problem', ['name', 'level', 'message'])
+Problem.__doc__ = """One configuration problem
+
+level is 'error' or 'warning'.  name is an instance name, or a file
+name for problems not specific to one instance.
+"""
+
+# ConditionHost= takes a host name or a machine ID
+_hostname = re.compile(r'^!?[A-Za-z0-9*?]([A-Za-z0-9*?._-]{0,251}[A-Za-z0-9*?])?$')
+_machineid = re.compile(r'^!?[0-9a-fA-F]{32}$')
+_section = re.compile(r'^\[([^\]]+)\]', re.M)
+
+def parseport(port):
+    """Parse a port= value.
+
+    Returns ('tcp', iface, number), ('unix', path), or None for
+    a dynamic (0) port.  Raises ValueError if not understood.
+    """
+    port = port.strip()
+    if port.startswith('unix:'):
+        if not port[5:]:
+            raise ValueError('empty unix socket path')
+        return ('unix', port[5:])
+    if port.startswith('tcp:'):
+        port = port[4:]
+    iface, _sep, num = port.rpartition(':')
+    if not num.isdigit():
+        raise ValueError('invalid port "%s"'%port)
+    num = int(num)
+    if num==0:
+        return None
+    if num>65535:
+        raise ValueError('port %d out of range'%num)
+    return ('tcp', iface or '0.0.0.0', num)
+
+class PortIndex(object):
+    """Index of claimed control endpoints
+    """
+    def __init__(self):
+        self.tcp = {}   # number -> [(name, iface)]
+        self.unix = {}  # path -> [name]
+
+    def add(self, name, ep):
+        if ep is None:
+            pass
+        elif ep[0]=='unix':
+            self.unix.setdefault(os.path.normpath(ep[1]), []).append(name)
+        else:
+            self.tcp.setdefault(ep[2], []).append((name, ep[1]))
+
+    def conflicts(self):
+        """Iterate (endpoint description, [names]) for endpoints claimed more than once
+        """
+        for num in sorted(self.tcp):
+            users = self.tcp[num]
+            if len(users)<2:
+                continue
+            # instances on different specific interfaces may share a port number
+            ifaces = set(I for _N, I in users)
+            if len(ifaces)==len(users) and '0.0.0.0' not in ifaces:
+                continue
+            yield 'tcp port %d'%num, sorted(N for N, _I in users)
+        for path in sorted(self.unix):
+            if len(self.unix[path])>1:
+                yield 'unix socket %s'%path, sorted(self.unix[path])
+
+    def nextport(self, first, last):
+        """Return the lowest unclaimed TCP port in [first, last], or None
+        """
+        for num in range(first, last+1):
+            if num not in self.tcp:
+                return num
+        return None
+
+def buildindex(conf):
+    """Return a PortIndex of every instance in conf.  Invalid ports are skipped.
+    """
+    idx = PortIndex()
+    for name in conf.sections():
+        if not conf.getboolean(name, 'instance'):
+            continue
+        try:
+            idx.add(name, parseport(conf.get(name, 'port')))
+        except (ValueError, ConfigError):
+            pass
+    return idx
+
+def freeport(conf, port_range):
+    """Return the first port of 'FIRST-LAST' not used by conf, or None
+
+    When adding an instance, call with the config lock held and conf read under it.
+    """
+    first, _sep, last = port_range.partition('-')
+    port = buildindex(conf).nextport(int(first), int(last or first))
+    return None if port is None else str(port)
+
+@lru_cache(maxsize=None)
+def _user(name):
+    import pwd
+    try:
+        return pwd.getpwnam(name)
+    except KeyError:
+        return None
+
+@lru_cache(maxsize=None)
+def _group(name):
+    import grp
+    try:
+        return grp.getgrnam(name)
+    except KeyError:
+        return None
+
+@lru_cache(maxsize=None)
+def _isdir(path):
+    return os.path.isdir(path)
+
+def _which(exe, chdir):
+    import shutil
+    if '/' in exe:
+        path = os.path.join(chdir, exe)
+        return path if os.path.isfile(path) and os.access(path, os.X_OK) else None
+    return shutil.which(exe)
+
+def checkone(conf, name, user=False):
+    """Return a list of Problems with one instance
+    """
+    import shlex
+    P = []
+    def err(msg, *args):
+        P.append(Problem(name, 'error', msg%args))
+    def warn(msg, *args):
+        P.append(Problem(name, 'warning', msg%args))
+    def get(option):
+        # None, and an error, if the value can not be interpolated
+        try:
+            return conf.get(name, option)
+        except ConfigError as e:
+            err('%s=: %s', option, e)
+            return None
+
+    chdir = get('chdir')
+    if chdir is None:
+        pass
+    elif not os.path.isabs(chdir):
+        err('chdir=%s is not an absolute path', chdir)
+    elif not _isdir(chdir):
+        err('chdir=%s does not exist', chdir)
+
+    if not conf.has_option(name, 'command'):
+        err('missing command=')
+    else:
+        command = get('command')
+        try:
+            argv = None if command is None else shlex.split(command)
+        except ValueError as e:
+            argv = None
+            err('command= can not be parsed: %s', e)
+        if argv==[]:
+            err('command= is empty')
+        elif argv and chdir is not None and _isdir(chdir) and _which(argv[0], chdir) is None:
+            if conf.has_option(name, 'site'):
+                # the site wrapper (eg. iocsh) runs the command
+                if not os.path.isfile(os.path.join(chdir, argv[0])):
+                    err('command %s not found in %s', argv[0], chdir)
+            else:
+                err('command %s not found or not executable', argv[0])
+
+    port = get('port')
+    try:
+        if port is not None:
+            parseport(port)
+    except ValueError as e:
+        err('port=: %s', e)
+
+    if not user:
+        # User=/Group= only apply to system units
+        uname, gname = get('user'), get('group')
+        if uname is not None and _user(uname) is None:
+            err('unknown user=%s', uname)
+        if gname is not None and _group(gname) is None:
+            err('unknown group=%s', gname)
+
+    host = get('host') if conf.has_option(name, 'host') else None
+    if host is not None:
+        host = host.strip()
+        if not (_hostname.match(host) or _machineid.match(host)):
+            err('host=%s is not a valid host name or machine ID', host)
+        elif host=='localhost':
+            warn('host=localhost only matches a machine named "localhost"')
+
+    return P
+
+def _duplicates(files):
+    """Find sections defined in more than one config file.
+    ConfigParser silently merges these.
+    """
+    seen = {}
+    for fname in files:
+        try:
+            with open(fname) as F:
+                for sect in _section.findall(F.read()):
+                    seen.setdefault(sect.strip(), []).append(fname)
+        except (IOError, OSError) as e:
+            yield Problem(fname, 'error', "can't read: %s"%e)
+    for sect in sorted(seen):
+        if len(seen[sect])>1:
+            yield Problem(sect, 'warning', 'defined in several files, which are merged: %s'%', '.join(seen[sect]))
+
+def check(conf, user=False, files=(), jobs=None):
+    """Validate every instance in conf.  Returns a list of Problems.
+
+    files are the config files conf was read from, checked for
+    sections defined more than once.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = [N for N in conf.sections() if conf.getboolean(N, 'instance')]
+
+    P = list(_duplicates(files))
+
+    # mostly waiting on stat() and NSS, which release the GIL
+    with ThreadPoolExecutor(max_workers=jobs or min(32, (os.cpu_count() or 1)*4)) as X:
+        for R in X.map(lambda N:checkone(conf, N, user=user), names):
+            P.extend(R)
+
+    idx = buildindex(conf)
+    for desc, users in idx.conflicts():
+        for N in users:
+            P.append(Problem(N, 'error', '%s also used by %s'%(desc, ', '.join(U for U in users if U!=N))))
+
+    P.sort(key=lambda X:(X.name, X.level, X.message))
+    return P
@@ -0,0 +1,372 @@
+"""Shell completion support
+
+Instance names are kept in a small cache file, one per line, which is
+rewritten whenever units are generated.  The completion scripts read it
+directly, so completing a name costs no more than reading one file.
+
+    python3 -m procServUtils.complete names [--user|--system]
+    python3 -m procServUtils.complete bash|zsh
+    python3 -m procServUtils.complete bash-systemctl
+
+The second form prints a completion script for manage-procs and
+procServ-telnet, generated from their argument parsers.  The third prints
+a bash hook completing ioc@NAME.service for systemctl, which has to be
+sourced explicitly as bash loads completions for systemctl on its own.
+"""
+
+import sys, os, errno
+
+from .conf import getrundir
+
+def getnamesfile(user=False):
+    return os.path.join(getrundir(user=user), 'procServ.names')
+
+def readnames(user=False):
+    """Return the cached instance names, or None if there is no cache
+    """
+    try:
+        with open(getnamesfile(user=user)) as F:
+            return F.read().split()
+    except (IOError, OSError) as e:
+        if e.errno!=errno.ENOENT:
+            raise
+        return None
+
+def writenames(names, user=False):
+    """Replace the cached instance names
+    """
+    fname = getnamesfile(user=user)
+    content = ''.join('%s\n'%N for N in sorted(names))
+    try:
+        with open(fname) as F:
+            if F.read()==content:
+                return
+    except (IOError, OSError) as e:
+        if e.errno!=errno.ENOENT:
+            raise
+    tmpfile = '%s.%d.tmp'%(fname, os.getpid())
+    with open(tmpfile, 'w') as F:
+        F.write(content)
+    os.rename(tmpfile, fname)
+
+def confnames(conf):
+    return [N for N in conf.sections() if conf.getboolean(N, 'instance')]
+
+# Positional arguments with these names are instances, except for
+# sub-commands which create one.
+_instargs = ('name', 'names', 'proc')
+_creates = ('add',)
+# Options whose value is a file or directory
+_pathargs = ('chdir', 'outsysd', 'out', 'dir', 'inventory', 'procserv')
+
+def _help(A):
+    if not A.help:
+        return ''
+    try:
+        return A.help%dict(vars(A), prog='')
+    except (KeyError, TypeError, ValueError):
+        return A.help
+
+def _describe(P, cmd=None):
+    """Return (options, positionals, subcommands) of an ArgumentParser.
+
+    options are (option strings, help, dest, takes value, choices),
+    positionals (dest, nargs, is instance) and subcommands (name, help, parser).
+    """
+    import argparse
+    opts, pos, subs = [], [], []
+    for A in P._actions:
+        if isinstance(A, argparse._SubParsersAction):
+            helps = dict((C.dest, C.help) for C in A._choices_actions)
+            for name, S in A.choices.items():
+                subs.append((name, helps.get(name) or '', S))
+        elif A.option_strings:
+            opts.append((A.option_strings, _help(A), A.dest, A.nargs!=0,
+                         [str(C) for C in A.choices] if A.choices else None))
+        else:
+            pos.append((A.dest, A.nargs, A.dest in _instargs and cmd not in _creates))
+    return opts, pos, subs
+
+_bash_head = r'''# bash completion for manage-procs and procServ-telnet
+# Generated by: python3 -m procServUtils.complete bash
+'''
+
+# shared by the completion script and the systemctl hook
+_bash_funcs = r'''
+# print cached instance names of one scope
+_procserv_names()
+{
+    local file=/run/procServ.names
+    [[ $1 == user ]] && file=${XDG_RUNTIME_DIR:-/run/user/$UID}/procServ.names
+    if [[ -r $file ]]; then
+        printf '%s\n' "$(<"$file")"
+    else
+        python3 -m procServUtils.complete names --$1 2>/dev/null
+    fi
+}
+
+# the scope selected by --user/--system, defaulting as the tools do
+_procserv_scope()
+{
+    local w scope=user
+    [[ $EUID -eq 0 ]] && scope=system
+    for w in "${COMP_WORDS[@]}"; do
+        case $w in
+        --user) scope=user;;
+        --system) scope=system;;
+        esac
+    done
+    echo $scope
+}
+
+# complete the word under the cursor from a list, allowing for names
+# split at COMP_WORDBREAKS (eg. the @ in ioc@NAME)
+_procserv_compgen()
+{
+    local line=${COMP_LINE:0:COMP_POINT}
+    local word=${line##*[[:space:]]}
+    local brk=${word%"${word##*[@:]}"}
+    COMPREPLY=($(compgen -P "$2" -S "$3" -W "$1" -- "${word#"$2"}"))
+    if [[ -n $brk && $COMP_WORDBREAKS == *"${brk: -1}"* ]]; then
+        COMPREPLY=("${COMPREPLY[@]#"$brk"}")
+    fi
+}
+
+# complete an option value.  Returns 1 if prev is not an option taking one.
+# Each spec is "OPTIONS=CHOICES", or just "OPTIONS" for a path
+_procserv_optvalue()
+{
+    local prev=$1; shift
+    local spec
+    for spec in "$@"; do
+        [[ " ${spec%%=*} " == *" $prev "* ]] || continue
+        if [[ $spec == *=* ]]; then
+            COMPREPLY=($(compgen -W "${spec#*=}" -- "$cur"))
+        else
+            compopt -o default 2>/dev/null
+            COMPREPLY=()
+        fi
+        return 0
+    done
+    return 1
+}
+
+'''
+
+_bash_systemctl_head = r'''# complete ioc@NAME.service for systemctl from the procServ name cache
+# Generated by: python3 -m procServUtils.complete bash-systemctl
+#
+# Completion scripts are loaded on demand for their own command, so this
+# can not be part of the manage-procs one.  Source it explicitly, eg. from
+# ~/.bashrc after bash-completion:
+#
+#   . /usr/share/procServUtils/procserv-systemctl.bash
+#
+# Other words are deferred to the regular systemctl completion, loaded on
+# the first <TAB> after "systemctl".  Without bash-completion installed,
+# only instance units are completed.
+'''
+
+_bash_systemctl = r'''
+_procserv_systemctl()
+{
+    local line=${COMP_LINE:0:COMP_POINT}
+    local word=${line##*[[:space:]]}
+    if [[ $word == ioc@* ]]; then
+        local scope=system
+        [[ " ${COMP_WORDS[*]} " == *" --user "* ]] && scope=user
+        _procserv_compgen "$(_procserv_names $scope)" ioc@ .service
+        return
+    fi
+    if [[ -z ${_procserv_systemctl_orig+x} ]]; then
+        _procserv_systemctl_orig=
+        complete -r systemctl
+        declare -F _completion_loader >/dev/null && _completion_loader systemctl
+        local spec=$(complete -p systemctl 2>/dev/null)
+        [[ $spec == *" -F "* ]] && spec=${spec#* -F } && _procserv_systemctl_orig=${spec%% *}
+        complete -F _procserv_systemctl systemctl
+    fi
+    [[ -n $_procserv_systemctl_orig ]] && "$_procserv_systemctl_orig" "$@"
+}
+complete -F _procserv_systemctl systemctl
+'''
+
+def _bash_words(opts):
+    return ' '.join(O for strs, _h, _d, _v, _c in opts for O in strs)
+
+def _bash_values(opts):
+    specs = []
+    for strs, _h, dest, value, choices in opts:
+        if choices:
+            specs.append("'%s=%s'"%(' '.join(strs), ' '.join(choices)))
+        elif value:
+            specs.append("'%s%s'"%(' '.join(strs), '' if dest in _pathargs else '='))
+    return ' '.join(specs)
+
+def _bash_func(P, cmd=None, indent='    '):
+    opts, pos, _subs = _describe(P, cmd)
+    L = []
+    specs = _bash_values(opts)
+    if specs:
+        L.append('_procserv_optvalue "$prev" %s && return'%specs)
+    L.append('if [[ $cur == -* ]]; then')
+    L.append("    COMPREPLY=($(compgen -W '%s' -- \"$cur\"))"%_bash_words(opts))
+    if any(inst for _d, _n, inst in pos):
+        L.append('else')
+        L.append('    _procserv_compgen "$(_procserv_names $(_procserv_scope))"')
+    L.append('fi')
+    return [indent+X for X in L]
+
+def bash(manage, telnet):
+    """Return a bash completion script for the given ArgumentParsers
+    """
+    opts, _pos, subs = _describe(manage)
+    L = [(_bash_head+_bash_funcs).rstrip('\n'), '', '_manage_procs()', '{']
+    L.append('    local cur=${COMP_WORDS[COMP_CWORD]} prev=${COMP_WORDS[COMP_CWORD-1]}')
+    L.append('    local i cmd=')
+    L.append('    for ((i=1; i<COMP_CWORD; i++)); do')
+    L.append('        [[ ${COMP_WORDS[i]} == -* ]] || { cmd=${COMP_WORDS[i]}; break; }')
+    L.append('    done')
+    L.append('    case $cmd in')
+    L.append("    '')")
+    L.append("        COMPREPLY=($(compgen -W '%s %s' -- \"$cur\"))"%(_bash_words(opts),
+                                                                   ' '.join(N for N, _h, _S in subs)))
+    L.append('        ;;')
+    for name, _h, S in subs:
+        L.append('    %s)'%name)
+        L.extend(_bash_func(S, name, indent='        '))
+        L.append('        ;;')
+    L.append('    esac')
+    L.append('}')
+    L.append('complete -F _manage_procs manage-procs')
+    L.append('')
+    L.append('_procserv_telnet()')
+    L.append('{')
+    L.append('    local cur=${COMP_WORDS[COMP_CWORD]} prev=${COMP_WORDS[COMP_CWORD-1]}')
+    L.extend(_bash_func(telnet))
+    L.append('}')
+    L.append('complete -F _procserv_telnet procServ-telnet')
+    L.append('')
+    return '\n'.join(L)
+
+def bash_systemctl():
+    """Return the bash hook completing instance units for systemctl
+    """
+    return _bash_systemctl_head+_bash_funcs+_bash_systemctl
+
+_zsh_head = r'''#compdef manage-procs procServ-telnet
+# zsh completion for manage-procs and procServ-telnet
+# Generated by: python3 -m procServUtils.complete zsh
+
+_procserv_names() {
+  local scope=user file
+  (( EUID == 0 )) && scope=system
+  (( ${words[(I)--system]} )) && scope=system
+  (( ${words[(I)--user]} )) && scope=user
+  file=/run/procServ.names
+  [[ $scope == user ]] && file=${XDG_RUNTIME_DIR:-/run/user/$UID}/procServ.names
+  local -a names
+  if [[ -r $file ]]; then
+    names=(${(f)"$(<$file)"})
+  else
+    names=(${(f)"$(python3 -m procServUtils.complete names --$scope 2>/dev/null)"})
+  fi
+  _wanted instances expl 'procServ instance' compadd -a names
+}
+'''
+
+def _zsh_quote(S):
+    return S.replace("'", "'\\''").replace('[', '\\[').replace(']', '\\]')
+
+def _zsh_specs(P, cmd=None):
+    opts, pos, _subs = _describe(P, cmd)
+    specs = []
+    for strs, help, dest, value, choices in opts:
+        excl = '(%s)'%' '.join(strs) if len(strs)>1 else ''
+        if strs==['-v', '--verbose']:
+            excl = '*'
+        for O in strs:
+            spec = '%s%s[%s]'%(excl, O, _zsh_quote(help))
+            if choices:
+                spec += ':%s:(%s)'%(dest, ' '.join(choices))
+            elif value:
+                spec += ':%s:%s'%(dest, '_files' if dest in _pathargs else ' ')
+            specs.append(spec)
+    for dest, nargs, inst in pos:
+        action = '_procserv_names' if inst else ' '
+        specs.append('%s:%s:%s'%('*' if nargs in ('*', '+') else '', dest, action))
+    return ["'%s'"%S for S in specs]
+
+def zsh(manage, telnet):
+    """Return a zsh completion script for the given ArgumentParsers
+    """
+    _opts, _pos, subs = _describe(manage)
+    L = [_zsh_head.rstrip('\n'), '', '_procserv_manage() {',
+         '  local curcontext=$curcontext state line',
+         '  typeset -A opt_args',
+         '  _arguments -C \\']
+    for S in _zsh_specs(manage)+["':command:->command'", "'*::arg:->args'"]:
+        L.append('    %s \\'%S)
+    L[-1] = L[-1][:-2]
+    L.append('  case $state in')
+    L.append('  command)')
+    L.append('    local -a cmds')
+    L.append('    cmds=(')
+    for name, help, _S in subs:
+        L.append("      '%s:%s'"%(name, _zsh_quote(help).replace(':', '\\:')))
+    L.append('    )')
+    L.append("    _describe -t commands 'manage-procs command' cmds")
+    L.append('    ;;')
+    L.append('  args)')
+    L.append('    case $line[1] in')
+    for name, _h, S in subs:
+        L.append('    %s)'%name)
+        L.append('      _arguments \\')
+        for X in _zsh_specs(S, name):
+            L.append('        %s \\'%X)
+        L[-1] = L[-1][:-2]
+        L.append('      ;;')
+    L.append('    esac')
+    L.append('    ;;')
+    L.append('  esac')
+    L.append('}')
+    L.append('')
+    L.append('_procserv_telnet() {')
+    L.append('  _arguments \\')
+    for X in _zsh_specs(telnet):
+        L.append('    %s \\'%X)
+    L[-1] = L[-1][:-2]
+    L.append('}')
+    L.append('')
+    L.append('case $service in')
+    L.append('manage-procs) _procserv_manage "$@";;')
+    L.append('procServ-telnet) _procserv_telnet "$@";;')
+    L.append('esac')
+    L.append('')
+    return '\n'.join(L)
+
+def main(argv):
+    if argv[:1]==['names']:
+        user = os.geteuid()!=0
+        if '--user' in argv:
+            user = True
+        elif '--system' in argv:
+            user = False
+        names = readnames(user=user)
+        if names is None:
+            # no cache yet, eg. before the first boot with the generator
+            from .conf import getconf
+            names = confnames(getconf(user=user))
+        sys.stdout.write(''.join('%s\n'%N for N in names))
+    elif argv[:1]==['bash-systemctl']:
+        sys.stdout.write(bash_systemctl())
+    elif argv[:1]==['bash'] or argv[:1]==['zsh']:
+        from . import manage, telnet
+        gen = bash if argv[0]=='bash' else zsh
+        sys.stdout.write(gen(manage.getparser(), telnet.getparser()))
+    else:
+        sys.stderr.write('Usage: python3 -m %s names [--user|--system] | bash | bash-systemctl | zsh\n'%__name__)
+        sys.exit(1)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -1,5 +1,5 @@
 
-import os
+import os, re
 from functools import reduce
 from glob import glob
 
@@ -20,6 +20,22 @@ def getrundir(user=False):
     else:
         return '/run'
 
+def getstatedir(user=False):
+    """Return the directory for persistent state (eg. history)
+    """
+    if user:
+        return os.path.join(os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'),
+                            'procServ')
+    else:
+        return '/var/lib/procServ'
+
+def getinfofile(name, user=False):
+    """Return the procServ --info-file path for an instance
+
+    This is inside the RuntimeDirectory= of the ioc@ unit.
+    """
+    return os.path.join(getrundir(user=user), 'ioc@%s'%name, 'info')
+
 def getconffiles(user=False):
     """Return a list of config file names
     
@@ -49,12 +65,148 @@ _defaults = {
     'instance':'1',
 }
 
+# [name{first..last}suffix]
+_template = re.compile(r'^(.*)\{(\d+)\.\.(\d+)\}(.*)$')
+
+class InstanceConfig(ConfigParser):
+    """ConfigParser which also understands instance set sections.
+
+    A section named like [bpm@{01..96}] defines instances bpm@01 through
+    bpm@96.  Their options come from the set section, with %(index)s
+    interpolating to the index (zero padded as written) and %(setname)s
+    to the section name without the range.  eg.
+
+        [bpm@{01..96}]
+        command = ./st.cmd
+        chdir = /iocs/bpm%(index)s
+        port = 20%(index)s
+
+    Instances are resolved on demand, so looking up one member does not
+    expand the whole set.  A plain section with the same name as a member
+    replaces it entirely.
+    """
+    def _templates(self):
+        T = self.__dict__.get('_tmpl')
+        if T is None:
+            T = self._tmpl = []
+            for sect in self._sections:
+                M = _template.match(sect)
+                if M is None:
+                    continue
+                prefix, first, last, suffix = M.groups()
+                # as bash, pad only if a bound is written with leading zeros: {0..10} is not padded
+                padded = (len(first)>1 and first[0]=='0') or (len(last)>1 and last[0]=='0')
+                width = max(len(first), len(last)) if padded else 0
+                T.append((sect, prefix, suffix, int(first), int(last), width))
+        return T
+
+    # anything changing the set of sections drops the cached templates
+    def _read(self, *args, **kws):
+        self._tmpl = None
+        return ConfigParser._read(self, *args, **kws)
+
+    def add_section(self, section):
+        self._tmpl = None
+        return ConfigParser.add_section(self, section)
+
+    def remove_section(self, section):
+        self._tmpl = None
+        return ConfigParser.remove_section(self, section)
+
+    def _member(self, name):
+        """Return (set section, index string) if name is a member of an instance set
+        """
+        for sect, prefix, suffix, first, last, width in self._templates():
+            if not name.startswith(prefix) or not name.endswith(suffix):
+                continue
+            idx = name[len(prefix):len(name)-len(suffix)]
+            if not idx.isdigit() or not first<=int(idx)<=last:
+                continue
+            if idx!='%0*d'%(width, int(idx)):
+                continue    # only the spelling _expand() gives, eg. not b@01 for {1..3}
+            return sect, idx
+        return None
+
+    def _expand(self, sect):
+        for S, prefix, suffix, first, last, width in self._templates():
+            if S==sect:
+                return ['%s%0*d%s'%(prefix, width, N, suffix) for N in range(first, last+1)]
+        return [sect]
+
+    def sections(self):
+        ret = []
+        for sect in ConfigParser.sections(self):
+            for name in self._expand(sect):
+                if name==sect or not ConfigParser.has_section(self, name):
+                    ret.append(name)
+        return ret
+
+    def has_section(self, section):
+        return ConfigParser.has_section(self, section) or self._member(section) is not None
+
+    def __getitem__(self, key):
+        if not ConfigParser.has_section(self, key) and self._member(key) is not None:
+            from configparser import SectionProxy
+            return SectionProxy(self, key)
+        return ConfigParser.__getitem__(self, key)
+
+    def _vars(self, section, vars):
+        M = None if ConfigParser.has_section(self, section) else self._member(section)
+        if M is None:
+            return section, vars
+        sect, idx = M
+        V = {'index':idx, 'setname':_template.match(sect).group(1)}
+        V.update(vars or {})
+        return sect, V
+
+    def get(self, section, option, **kws):
+        section, kws['vars'] = self._vars(section, kws.get('vars'))
+        return ConfigParser.get(self, section, option, **kws)
+
+    def has_option(self, section, option):
+        section, V = self._vars(section, None)
+        return ConfigParser.has_option(self, section, option) or option in (V or {})
+
+    def options(self, section):
+        section, V = self._vars(section, None)
+        return ConfigParser.options(self, section)+list(V or {})
+
+    def items(self, section=None, **kws):
+        if section is None:
+            return ConfigParser.items(self, **kws)
+        section, kws['vars'] = self._vars(section, kws.get('vars'))
+        return ConfigParser.items(self, section, **kws)
+
+def findsections(name, user=False):
+    """Iterate (file name, ConfigParser) of config files defining the named instance
+
+    Each file is read on its own, without instance sets.
+    """
+    for cfile in getconffiles(user=user):
+        with open(cfile) as F:
+            C = ConfigParser({'instance':'1'})
+            C.read_file(F)
+
+        if not C.has_section(name):
+            continue
+        if not C.getboolean(name, 'instance'):
+            continue
+        yield cfile, C
+
+def _notfound(conf, name):
+    """Explain why no config file has a section to remove for name
+    """
+    M = conf._member(name)
+    if M is not None:
+        return "'%s' is a member of instance set [%s], edit that section instead"%(name, M[0])
+    return "No instance '%s'"%name
+
 def getconf(user=False):
     """Return a ConfigParser with one section per procServ instance
     """
     from glob import glob
 
-    C = ConfigParser(_defaults)
+    C = InstanceConfig(_defaults)
 
     C.read(getconffiles(user=user))
 
@@ -0,0 +1,308 @@
+"""Push notification of instance state changes
+
+Watches the run directory with inotify, so changes to the runtime registry
+and to procServ info files are seen as they happen, and holds a pidfd for
+each running instance to see a process exit without waiting for systemd.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno, struct, time, select
+from collections import namedtuple
+
+from .conf import getrundir
+from . import registry
+
+Event = namedtuple('Event', ['time', 'name', 'event', 'pid', 'ports'])
+Event.__doc__ = """An instance state change
+
+event is one of:
+  'started' - instance registered as running
+  'exited'  - the process has gone (reported before systemd has noticed)
+  'stopped' - stopped cleanly
+  'crashed' - stopped with a failure, or exited without being stopped
+  'port'    - a running procServ has (re)written its info file with new ports
+"""
+
+# from <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = 0o2000000
+
+_inotify_event = struct.Struct('iIII')
+
+class Inotify(object):
+    """Minimal ctypes wrapper around the Linux inotify API
+    """
+    def __init__(self):
+        import ctypes, ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK|IN_CLOEXEC)
+        if self.fd<0:
+            E = ctypes.get_errno()
+            raise OSError(E, os.strerror(E))
+        self._ctypes = ctypes
+
+    def close(self):
+        if self.fd>=0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd<0:
+            E = self._ctypes.get_errno()
+            raise OSError(E, os.strerror(E), path)
+        return wd
+
+    def read(self):
+        """Return a list of pending (wd, mask, name) tuples
+        """
+        ret = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64*1024)
+            except OSError as e:
+                if e.errno==errno.EAGAIN:
+                    return ret
+                raise
+            off = 0
+            while off<len(buf):
+                wd, mask, _cookie, nlen = _inotify_event.unpack_from(buf, off)
+                off += _inotify_event.size
+                name = buf[off:off+nlen].rstrip(b'\0').decode('utf-8', 'replace')
+                off += nlen
+                ret.append((wd, mask, name))
+
+def _pidfd(pid):
+    """Return a pollable fd which becomes readable when pid exits,
+    None if pid has already exited,
+    or False if pidfd is not available.
+    """
+    try:
+        return os.pidfd_open(pid)
+    except AttributeError:
+        return False
+    except OSError as e:
+        if e.errno==errno.ESRCH:
+            return None
+        elif e.errno in (errno.ENOSYS, errno.EPERM):
+            return False
+        raise
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno!=errno.ESRCH
+    return True
+
+class Watcher(object):
+    """Generate Events for the instances of one scope.
+
+    grace is how long (in seconds) to wait after a process exits for
+    systemd to record the outcome before reporting a crash.
+    """
+    # pids without a pidfd are polled at this period
+    poll_period = 0.5
+
+    def __init__(self, user=False, grace=2.0):
+        self.user = user
+        self.grace = grace
+        self.rundir = getrundir(user=user)
+        self.regname = os.path.basename(registry.getregistry(user=user))
+
+        self.ino = Inotify()
+        self.ino.add_watch(self.rundir, IN_CREATE|IN_MOVED_TO|IN_MODIFY|IN_CLOSE_WRITE|IN_DELETE)
+        self._dirs = {} # wd -> instance name
+        for name in os.listdir(self.rundir):
+            if name.startswith('ioc@'):
+                self._watchdir(name)
+
+        self.poll = select.poll()
+        self.poll.register(self.ino.fd, select.POLLIN)
+        self._pidfds = {}  # fd -> (name, pid)
+        self._polled = {}  # name -> pid, when pidfd is not available
+        self._pending = {} # name -> deadline for crash report
+        self._ports = {}   # name -> ports last read from info file
+        self._dead = {}    # name -> pid reported crashed, but still registered as running
+
+        self.snap = {}
+        for E in registry.scan(user=user):
+            self.snap[E.name] = E
+            if E.state=='running' and E.pid:
+                self._track(E.name, E.pid)
+
+    def close(self):
+        for fd in list(self._pidfds):
+            os.close(fd)
+        self._pidfds.clear()
+        self.ino.close()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def _watchdir(self, dname):
+        try:
+            wd = self.ino.add_watch(os.path.join(self.rundir, dname),
+                                    IN_CLOSE_WRITE|IN_MOVED_TO)
+            self._dirs[wd] = dname[4:]
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.EACCES):
+                raise
+
+    def _track(self, name, pid):
+        fd = _pidfd(pid)
+        if fd is False:
+            self._polled[name] = pid
+        elif fd is None:
+            return False
+        else:
+            self._pidfds[fd] = (name, pid)
+            self.poll.register(fd, select.POLLIN)
+        return True
+
+    def _untrack(self, name):
+        self._polled.pop(name, None)
+        for fd, (N, _pid) in list(self._pidfds.items()):
+            if N==name:
+                self.poll.unregister(fd)
+                os.close(fd)
+                del self._pidfds[fd]
+
+    def _event(self, ent, event, **kws):
+        return Event(time=time.time(), name=ent.name, event=event,
+                     pid=kws.get('pid', ent.pid), ports=ent.ports)
+
+    def _exited(self, name, pid):
+        self._untrack(name)
+        E = self.snap.get(name)
+        if E is None or E.pid!=pid or E.state!='running':
+            return []
+        self._pending[name] = time.monotonic()+self.grace
+        return [self._event(E, 'exited')]
+
+    def _rescan(self):
+        evts = []
+        new = dict((E.name, E) for E in registry.scan(user=self.user))
+        for name, E in list(new.items()):
+            O = self.snap.get(name)
+            wasrunning = O is not None and O.state=='running'
+
+            if E.state=='running' and self._dead.get(name)==E.pid:
+                new[name] = O
+                continue
+            self._dead.pop(name, None)
+            self.snap[name] = E
+
+            if E.state=='running' and (not wasrunning or O.pid!=E.pid):
+                if wasrunning:
+                    self._untrack(name)
+                self._pending.pop(name, None)
+                evts.append(self._event(E, 'started'))
+                self._ports.pop(name, None)
+                if E.pid and not self._track(name, E.pid):
+                    evts.extend(self._exited(name, E.pid))
+                else:
+                    # procServ may have written its info file already
+                    evts.extend(self._info(name))
+
+            elif E.state!='running' and wasrunning:
+                self._untrack(name)
+                self._pending.pop(name, None)
+                evts.append(self._event(E, 'stopped' if E.state=='stopped' else 'crashed', pid=O.pid))
+                self._ports.pop(name, None)
+
+        self.snap = new
+        return evts
+
+    def _info(self, name):
+        E = self.snap.get(name)
+        if E is None or E.state!='running':
+            return []
+        _pid, ports = registry.readinfo(name, user=self.user)
+        ports = tuple(ports)
+        if not ports or ports==self._ports.get(name):
+            return []
+        self._ports[name] = ports
+        return [Event(time=time.time(), name=name, event='port', pid=E.pid, ports=ports)]
+
+    def _timeout(self):
+        T = []
+        if self._pending:
+            T.append(min(self._pending.values())-time.monotonic())
+        if self._polled:
+            T.append(self.poll_period)
+        if not T:
+            return None
+        return max(0, int(min(T)*1000))
+
+    def wait(self, timeout=None):
+        """Block until some Events are available, or timeout (in seconds) expires.
+
+        Returns a list of Events, which may be empty.
+        """
+        T = self._timeout()
+        if timeout is not None:
+            T = int(timeout*1000) if T is None else min(T, int(timeout*1000))
+
+        evts = []
+        rescan = False
+        for fd, _mask in self.poll.poll(T):
+            if fd==self.ino.fd:
+                for wd, mask, fname in self.ino.read():
+                    if wd in self._dirs:
+                        if mask&IN_IGNORED:
+                            del self._dirs[wd]
+                        elif fname=='info':
+                            evts.extend(self._info(self._dirs[wd]))
+                    elif fname==self.regname:
+                        rescan = True
+                    elif fname.startswith('ioc@') and mask&IN_CREATE and mask&IN_ISDIR:
+                        self._watchdir(fname)
+
+            elif fd in self._pidfds:
+                name, pid = self._pidfds[fd]
+                evts.extend(self._exited(name, pid))
+
+        for name, pid in list(self._polled.items()):
+            if not _alive(pid):
+                evts.extend(self._exited(name, pid))
+
+        if rescan:
+            evts.extend(self._rescan())
+
+        now = time.monotonic()
+        for name, deadline in list(self._pending.items()):
+            if deadline>now:
+                continue
+            del self._pending[name]
+            # systemd has not recorded a result, so nobody stopped it
+            E = self.snap[name]
+            self._dead[name] = E.pid
+            self.snap[name] = E._replace(state='failed', pid=None)
+            evts.append(self._event(E, 'crashed'))
+
+        return evts
+
+    def __iter__(self):
+        while True:
+            for E in self.wait():
+                yield E
+
+def watch(user=False, grace=2.0):
+    """Iterate Events for the instances of one scope, forever.
+    """
+    with Watcher(user=user, grace=grace) as W:
+        for E in W:
+            yield E
@@ -1,8 +1,22 @@
 
 import sys, os, errno, glob
-from .conf import getconf
-
-def write_service(F, conf, sect, user=False):
+from .conf import getconf, getinfofile
+
+def _logger():
+    # logging is only needed on errors, and costs ~8ms to import at boot
+    import logging
+    return logging.getLogger(__name__)
+
+def write_service(F, conf, sect, user=False, python=None, rundir=None):
+    """Write the ioc@ unit of one instance.
+
+    python and rundir default to those of this host, pass them
+    when writing units for another.
+    """
+    if rundir is None:
+        info = getinfofile(sect, user=user)
+    else:
+        info = os.path.join(rundir, 'ioc@%s'%sect, 'info')
     opts = {
         'name':sect,
         'user':conf.get(sect, 'user'),
@@ -11,12 +25,12 @@ def write_service(F, conf, sect, user=False):
         'command':conf.get(sect, 'command'),
         'port':conf.get(sect, 'port'),
         'userarg':'--user' if user else '--system',
+        'python':python or sys.executable,
+        'info':info,
     }
 
     if 'tcp:' in opts['port']:
-        print(opts['port'])
         opts['port'] = opts['port'].split(':')[1]
-        print(opts['port'])
 
     # Set default value for iocsh command
     opts['iocsh_cmd'] = ""
@@ -44,10 +58,19 @@ ConditionPathIsDirectory={chdir}
     F.write("""
 [Service]
 Type=simple
-ExecStart=/usr/bin/procServ \\
+""")
+
+    if conf.has_option(sect, 'swapped'):
+        # 'manage-procs swap' left the current process running under this unit.
+        # '+' as stopping another unit needs privileges User= may not have.
+        from .publish import systemctl
+        F.write('ExecStartPre=-+%s %s stop ioc@%s.service\n'%(systemctl, opts['userarg'],
+                                                             conf.get(sect, 'swapped')))
+
+    F.write("""ExecStart=/usr/bin/procServ \\
                     --foreground \\
                     --logfile=/var/log/procServ/out-{name} \\
-                    --info-file=/run/ioc@{name}/info \\
+                    --info-file={info} \\
                     --ignore=^C^D \\
                     --chdir={chdir} \\
                     --name={name} \\
@@ -62,6 +85,8 @@ ExecStart=/usr/bin/procServ \\
 SyslogIdentifier=ioc@{name}
 RuntimeDirectory=ioc@{name}
 RuntimeDirectoryMode=0755
+ExecStartPost=-+{python} -m procServUtils.launch {userarg} --record=start {name}
+ExecStopPost=-+{python} -m procServUtils.launch {userarg} --record=stop {name}
 """.format(**opts))
 
     if not user:
@@ -75,8 +100,9 @@ Group={group}
 WantedBy=multi-user.target
 """)
 
-def run(outdir, user=False):
-    conf = getconf(user=user)
+def run(outdir, user=False, conf=None):
+    if conf is None:
+        conf = getconf(user=user)
     service_name_template = 'ioc@%s.service'
 
     wantsdir = os.path.join(outdir, 'multi-user.target.wants')
@@ -84,7 +110,7 @@ def run(outdir, user=False):
         os.makedirs(wantsdir)
     except OSError as e:
         if e.errno!=errno.EEXIST:
-            _log.exception('Creating directory "%s"', wantsdir)
+            _logger().exception('Creating directory "%s"', wantsdir)
             raise
 
     # Cleanup of the *.service files at first
@@ -93,7 +119,7 @@ def run(outdir, user=False):
         try:
             os.remove(serviceFile)
         except:
-            _log.debug("Error while trying to delete a service file: %s" % serviceFile)
+            _logger().debug("Error while trying to delete a service file: %s" % serviceFile)
 
     # Create new service files according to configured procedures
     for sect in conf.sections():
@@ -101,13 +127,21 @@ def run(outdir, user=False):
             continue
         service = service_name_template % sect
         ofile = os.path.join(outdir, service)
-        with open(ofile+'.tmp', 'w') as F:
+        tmpfile = '%s.%d.tmp'%(ofile, os.getpid())
+        with open(tmpfile, 'w') as F:
             write_service(F, conf, sect, user=user)
 
-        os.rename(ofile+'.tmp', ofile)
+        os.rename(tmpfile, ofile)
         
         try:
             os.symlink(ofile,
                     os.path.join(wantsdir, service))
         except FileExistsError:
             continue
+
+    # names for shell completion
+    from .complete import writenames, confnames
+    try:
+        writenames(confnames(conf), user=user)
+    except (KeyError, IOError, OSError) as e:
+        _logger().debug('Not updating completion names: %s', e)
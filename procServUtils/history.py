@@ -0,0 +1,179 @@
+"""On-disk history of instance state transitions
+
+A fixed size ring of fixed size records in one mmap()'d file per host
+and scope.  Appending overwrites the oldest record once the ring is full,
+so the file never grows and queries never need to parse the journal.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno, struct, time
+from collections import namedtuple
+
+from .conf import getstatedir
+
+START, STOP, CRASH = 1, 2, 3
+_events = {START:'start', STOP:'stop', CRASH:'crash'}
+
+# magic, version, capacity, total number of records ever appended
+_header = struct.Struct('<4sIIQ')
+# time, event, pid, name
+_record = struct.Struct('<dB3xI48s')
+assert _record.size==64, _record.size
+
+_magic = b'PSHI'
+_version = 1
+_capacity = 65536
+
+Transition = namedtuple('Transition', ['time', 'name', 'event', 'pid'])
+
+Availability = namedtuple('Availability', ['name', 'begin', 'end', 'uptime', 'starts',
+                                           'restarts', 'crashes', 'mtbf'])
+Availability.__doc__ = """Summary of one instance over [begin, end]
+
+uptime is the fraction of the interval spent running.
+mtbf is the mean running time between crashes in seconds,
+or None if there were no crashes.
+"""
+
+def gethistory(user=False):
+    """Return the history file name for this scope
+    """
+    return os.path.join(getstatedir(user=user), 'history')
+
+def _encname(name):
+    # longer names are truncated, and compared truncated
+    return name.encode('utf-8')[:48]
+
+class History(object):
+    """A mmap()'d view of the history ring
+    """
+    def __init__(self, fname, write=False, capacity=_capacity):
+        import mmap
+        self.fname = fname
+        if write:
+            D = os.path.dirname(fname)
+            if not os.path.isdir(D):
+                os.makedirs(D)
+            self.fd = os.open(fname, os.O_RDWR|os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size==0:
+                import fcntl
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(self.fd).st_size==0:
+                        os.ftruncate(self.fd, _header.size+capacity*_record.size)
+                        os.pwrite(self.fd, _header.pack(_magic, _version, capacity, 0), 0)
+                finally:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.map = mmap.mmap(self.fd, 0)
+        else:
+            self.fd = os.open(fname, os.O_RDONLY)
+            self.map = mmap.mmap(self.fd, 0, prot=mmap.PROT_READ)
+
+        magic, version, self.capacity, _total = _header.unpack_from(self.map, 0)
+        if magic!=_magic or version!=_version:
+            raise RuntimeError('%s is not a procServ history file'%fname)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def append(self, name, event, pid=None, T=None):
+        import fcntl
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            magic, version, cap, total = _header.unpack_from(self.map, 0)
+            _record.pack_into(self.map, _header.size+(total%cap)*_record.size,
+                              time.time() if T is None else T, event, pid or 0, _encname(name))
+            # publish the record only once it is complete
+            _header.pack_into(self.map, 0, magic, version, cap, total+1)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def __iter__(self):
+        """Iterate Transitions, oldest first
+        """
+        _magic, _version, cap, total = _header.unpack_from(self.map, 0)
+        for n in range(max(0, total-cap), total):
+            T, event, pid, name = _record.unpack_from(self.map, _header.size+(n%cap)*_record.size)
+            yield Transition(time=T, name=name.rstrip(b'\0').decode('utf-8', 'replace'),
+                             event=_events.get(event, 'unknown'), pid=pid or None)
+
+def record(name, event, pid=None, user=False):
+    """Append one transition to the history of this scope
+    """
+    with History(gethistory(user=user), write=True) as H:
+        H.append(name, event, pid=pid)
+
+def transitions(name=None, user=False):
+    """Iterate recorded Transitions, oldest first, optionally for one instance
+    """
+    try:
+        H = History(gethistory(user=user))
+    except OSError as e:
+        if e.errno!=errno.ENOENT:
+            raise
+        return
+    with H:
+        match = None if name is None else _encname(name).decode('utf-8', 'replace')
+        for T in H:
+            if match is None or T.name==match:
+                yield T
+
+def availability(name, since=None, now=None, user=False):
+    """Compute an Availability summary for one instance from its history.
+
+    The interval begins at since, or at the oldest known transition
+    if that is later.  Returns None if nothing is known.
+    """
+    now = time.time() if now is None else now
+    up = None       # start time of the current run, or None when down
+    seen = False    # any transition before the interval?
+    begin = None
+    uptime = 0.0
+    starts = restarts = crashes = 0
+
+    for T in transitions(name, user=user):
+        if since is not None and T.time<since:
+            # replay state up to the start of the interval
+            up = since if T.event=='start' else None
+            seen = True
+            continue
+        if begin is None:
+            begin = since if seen else T.time
+
+        if T.event=='start':
+            if up is not None:
+                # start without a recorded stop, so we missed the end of the last run
+                uptime += T.time-up
+            starts += 1
+            if seen:
+                restarts += 1
+            up = T.time
+        else:
+            if up is not None:
+                uptime += T.time-up
+            up = None
+            if T.event=='crash':
+                crashes += 1
+        seen = True
+
+    if begin is None:
+        if not seen:
+            return None
+        # no transitions inside the interval
+        begin = since
+    if up is not None:
+        uptime += now-max(up, begin)
+
+    span = now-begin
+    return Availability(name=name, begin=begin, end=now,
+                        uptime=uptime/span if span>0 else (1.0 if up is not None else 0.0),
+                        starts=starts, restarts=restarts, crashes=crashes,
+                        mtbf=uptime/crashes if crashes else None)
@@ -1,6 +1,6 @@
 
 import sys, os
-from .conf import getconf, getrundir
+from .conf import getconf, getinfofile
 
 try:
     import shlex
@@ -18,31 +18,37 @@ def getargs():
     A.add_argument('--system', dest='user', action='store_false',
                    help='Consider system config')
     A.add_argument('-d','--debug', action='count', default=0)
+    A.add_argument('--record', choices=['start', 'stop'],
+                   help='Only update the runtime registry (from ExecStartPost=/ExecStopPost=)')
     return A.parse_args()
 
-def main(args):
-    conf = getconf(user=args.user)
-
-    name, user = args.name, args.user
-
-    if not conf.has_section(name):
-        sys.stderr.write("Instance '%s' not found"%name)
-        sys.exit(1)
-
-    if not conf.getboolean(name, 'instance'):
-        sys.stderr.write("'%s' not an instance"%name)
-        sys.exit(1)
-
-    if not conf.has_option(name, 'command'):
-        sys.stderr.write("instance '%s' missing command="%name)
-        sys.exit(1)
-
+def record(args):
+    from . import registry, history
+    if args.record=='start':
+        pid = int(os.environ.get('MAINPID', '0'))
+        registry.record_start(None, args.name, pid, user=args.user)
+        history.record(args.name, history.START, pid=pid, user=args.user)
+    else:
+        result = os.environ.get('SERVICE_RESULT', 'success')
+        # the process may have been swapped in for another instance
+        names = [args.name]
+        alias = registry.aliases(user=args.user).get(args.name)
+        if alias is not None:
+            names.append(alias)
+        for name in names:
+            registry.record_stop(None, name, result, user=args.user)
+            history.record(name, history.STOP if result=='success' else history.CRASH,
+                           user=args.user)
+
+def getcommand(conf, name, user=False, debug=0, procserv=None, info=None, opts=()):
+    """Return (chdir, argv, env) to run the named instance under procServ
+
+    opts are extra procServ arguments.
+    """
     chdir = conf.get(name, 'chdir')
     cmd   = conf.get(name, 'command')
     port  = conf.get(name, 'port')
 
-    rundir = getrundir(user=user)
-
     env = {
         'PROCSERV_NAME':name,
         'IOCNAME':name,
@@ -50,26 +56,67 @@ def main(args):
     env.update(os.environ)
 
     toexec = [
-        procServ,
+        procserv or procServ,
         '--foreground',
         '--logfile', '-',
         '--name', name,
         #'--ignore','^D^C^]',
         '--chdir',chdir,
-        '--info-file',os.path.join(rundir, 'procserv-%s'%name, 'info'), #/run/procserv-$NAME/info
-	'--port', port,
+        '--info-file',info or getinfofile(name, user=user), #/run/ioc@$NAME/info
+        '--port', port,
         #'--port', 'unix:%s/procserv-%s/control'%(rundir,name),
     ]
 
-    if args.debug>1:
+    if debug>1:
         toexec.append('--debug')
+    toexec.extend(opts)
 
     #toexec.append(port)
     toexec.extend(shlex.split(cmd))
 
+    return chdir, toexec, env
+
+def main(args):
+    if args.record:
+        # run on every start and stop, so don't parse the config unless needed.
+        # also called for instances which have just been removed
+        record(args)
+        return
+
+    conf = getconf(user=args.user)
+
+    name, user = args.name, args.user
+
+    if not conf.has_section(name):
+        sys.stderr.write("Instance '%s' not found"%name)
+        sys.exit(1)
+
+    if not conf.getboolean(name, 'instance'):
+        sys.stderr.write("'%s' not an instance"%name)
+        sys.exit(1)
+
+    if not conf.has_option(name, 'command'):
+        sys.stderr.write("instance '%s' missing command="%name)
+        sys.exit(1)
+
+    chdir, toexec, env = getcommand(conf, name, user=user, debug=args.debug)
+
     if args.debug>0:
         sys.stderr.write('in %s exec: %s\n'%(chdir, ' '.join(map(shlex.quote, toexec))))
 
+    # exec() keeps our PID
+    try:
+        from . import registry, history
+        registry.record_start(conf, name, os.getpid(), user=user)
+        history.record(name, history.START, pid=os.getpid(), user=user)
+    except (OSError, ValueError):
+        if args.debug>0:
+            import traceback
+            traceback.print_exc()
+
     os.chdir(chdir)
     os.execve(toexec[0], toexec, env)
     sys.exit(2) # never reached
+
+if __name__=='__main__':
+    main(getargs())
@@ -0,0 +1,34 @@
+"""Advisory file locks
+"""
+
+import os
+
+class Lock(object):
+    """Hold an exclusive flock() on fname for the duration of a with block.
+
+    The lock file is created if necessary, and never removed.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.fd = None
+
+    def __enter__(self):
+        import fcntl
+        self.fd = os.open(self.fname, os.O_RDWR|os.O_CREAT|os.O_CLOEXEC, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except:
+            os.close(self.fd)
+            raise
+        return self
+
+    def __exit__(self, A, B, C):
+        # closing releases the lock
+        os.close(self.fd)
+        self.fd = None
+
+def lockfile(which, user=False):
+    """Return the lock file name of this scope, eg. for which='config'
+    """
+    from .conf import getrundir
+    return os.path.join(getrundir(user=user), 'procServ-%s.lock'%which)
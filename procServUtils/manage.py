@@ -3,13 +3,13 @@ import logging
 _log = logging.getLogger(__name__)
 
 import sys, os, errno
-import pwd, grp
-import subprocess as SP
 
 from .conf import getconf, getrundir, getgendir
-from .generator import run as genrun
 
-from pkg_resources import resource_filename
+# Keep module level imports to a minimum.  'status' and the systemd
+# generators are on the boot path, so anything only needed by a single
+# sub-command (subprocess, pwd/grp, the unit generator, ...) is imported
+# where it is used.
 
 try:
     import shlex
@@ -25,65 +25,76 @@ _levels = [
 # -----------------------------------------------------------------------------
 # Default parameters
 # -----------------------------------------------------------------------------
-systemctl       = '/bin/systemctl'
-conserver_conf  = '/etc/conserver/procs.cf'
-systemd_dir     = '/etc/systemd/system'
+from .publish import systemctl, conserver_conf, systemd_dir
 
-def status(conf, args, fp=None):
-    rundir=getrundir(user=args.user)
+def _systemctl(args, *cmd):
+    from .publish import runsystemctl
+    runsystemctl(args.user, *cmd)
+
+def _siteconfdir():
+    """Return the directory holding the site default config files
+    """
+    try:
+        from importlib.resources import files
+    except ImportError:
+        return os.path.join(os.path.dirname(__file__), 'conf')
+    return str(files(__package__).joinpath('conf'))
+
+def _bytes(N):
+    if N is None:
+        return '-'
+    for U in ('', 'K', 'M', 'G'):
+        if abs(N)<1024:
+            break
+        N /= 1024.0
+    return '%.0f%s'%(N, U) if U=='' else '%.1f%s'%(N, U)
+
+def resources(conf, args, fp=None):
+    import time
+    from .cgroup import sample, usage
+    from .registry import aliases
     fp = fp or sys.stdout
 
+    alias = aliases(user=args.user)
+    A = sample(user=args.user, aliases=alias)
+    time.sleep(args.interval)
+    U = usage(A, sample(user=args.user, aliases=alias))
+
+    rows = []
     for name in conf.sections():
         if not conf.getboolean(name, 'instance'):
             continue
-        fp.write('%s '%name)
+        rows.append(U.get(name) or (name,)+(None,)*6)
 
-        pid = None
-        ports = []
-        infoname = os.path.join(rundir, 'ioc@%s'%name, 'info')
-        try:
-            with open(infoname) as F:
-                _log.debug('Read %s', F.name)
-                for line in map(str.strip, F):
-                    if line.startswith('pid:'):
-                        pid = int(line[4:])
-                    elif line.startswith('tcp:'):
-                        ports.append(line[4:])
-                    elif line.startswith('unix:'):
-                        ports.append(line[5:])
-        except Exception as e:
-            _log.debug('No info file %s', infoname)
-            if getattr(e, 'errno',0)!=errno.ENOENT:
-                _log.exception('oops')
-
-        if pid is not None:
-            _log.debug('Test PID %s', pid)
-            # Can we say if the process is actually running?
-            running = True
-            try:
-                os.kill(pid, 0)
-                _log.debug('PID exists')
-            except OSError as e:
-                if e.errno==errno.ESRCH:
-                    running = False
-                    _log.debug('PID does not exist')
-                elif e.errno==errno.EPERM:
-                    _log.debug("Can't say if PID exists or not")
-                else:
-                    _log.exception("Testing PID %s", pid)
-            fp.write('Running' if running else 'Dead')
+    col = ['name', 'cpu', 'mem', 'peak', 'pids', 'read', 'write'].index(args.sort)
+    if col==0:
+        rows.sort(key=lambda R:R[0])
+    else:
+        # largest first, unknown last
+        rows.sort(key=lambda R:(R[col] is None, -(R[col] or 0), R[0]))
 
-            if running:
-                fp.write('\t'+' '.join(ports))
-        else:
-            fp.write('Stopped')
+    fp.write('%-20s %6s %8s %8s %5s %8s %8s\n'%('NAME', 'CPU%', 'MEM', 'PEAK', 'PIDS', 'READ/s', 'WRITE/s'))
+    for name, cpu, mem, peak, pids, read, write in rows:
+        fp.write('%-20s %6s %8s %8s %5s %8s %8s\n'%(name,
+                 '-' if cpu is None else '%.1f'%cpu,
+                 _bytes(mem), _bytes(peak),
+                 '-' if pids is None else pids,
+                 _bytes(read), _bytes(write)))
+
+def status(conf, args, fp=None):
+    from .api import Fleet
+    if getattr(args, 'resources', False):
+        return resources(conf, args, fp=fp)
+    fp = fp or sys.stdout
 
+    for S in Fleet(user=args.user, conf=conf).status():
+        fp.write('%s %s'%(S.name, S.state))
+        if S.state=='Running':
+            fp.write('\t'+' '.join(S.ports))
         fp.write('\n')
 
 def syslist(conf, args):
-    SP.check_call([systemctl,
-                    '--user' if args.user else '--system',
-                    'list-units', 'ioc@*'])
+    _systemctl(args, 'list-units', 'ioc@*')
 
 def addproc(conf, args):
     import socket
@@ -115,7 +126,7 @@ def addproc(conf, args):
     if args.site is not None:
         try:
             # Firstly try to access a config file in the dist-packages (when installed)
-            conf_path = resource_filename(__name__, 'conf')
+            conf_path = _siteconfdir()
             if not os.path.exists(conf_path):
                 # Whether it doesn't exist, try to access in the current directory
                 conf_path = os.path.join(os.getcwd(), 'conf')
@@ -155,7 +166,7 @@ def addproc(conf, args):
             except OSError:
                 pass
             try:
-
+                import pwd, grp
                 uid = pwd.getpwnam(args.username).pw_uid
                 gid = grp.getgrnam(args.group).gr_gid
                 os.chown(os.path.join(getrundir(), port_dir), uid, gid)
@@ -172,67 +183,55 @@ def addproc(conf, args):
         'chdir':args.chdir,
     }
 
-    with open(cfile+'.tmp', 'w') as F:
-        F.write("""
+    from .lock import Lock, lockfile
+    from .publish import request, publish
+    from .check import freeport
+    with Lock(lockfile('config', user=args.user)):
+        if os.path.exists(cfile) and not args.force:
+            _log.error("Instance already exists @ %s", cfile)
+            sys.exit(1)
+
+        if args.next_port:
+            # re-read, another addproc may have taken a port since
+            args.port = freeport(getconf(user=args.user), args.port_range)
+            if args.port is None:
+                _log.error('No free port in %s', args.port_range)
+                sys.exit(1)
+            _log.info('Using port %s', args.port)
+
+        tmpfile = '%s.%d.tmp'%(cfile, os.getpid())
+        with open(tmpfile, 'w') as F:
+            F.write("""
 [%(name)s]
 command = %(command)s
 chdir = %(chdir)s
 """%opts)
 
-        if args.username: F.write("user = %s\n"%args.username)
-        if args.group: F.write("group = %s\n"%args.group)
-        if args.host: F.write("host = %s\n"%args.host)
-        if args.site: F.write("site = %s\n"%args.site)
-        if args.port: F.write("port = %s\n"%args.port)
-
-    os.rename(cfile+'.tmp', cfile)
-
-    # Check if should to re-write Conserver coniguration file
-    if args.writeconf:
-        _log.info('Trying to update conserver configuration...')
-        # Updating conserver config file due the previous procedures
-        conf = getconf(user=args.user)
-        # Adding writeconf default parameters
-        #   - where to save configuration file of conserver;
-        #   - whether should automatically reload the service;
-        args.out = conserver_conf
-        writeprocs(conf, args)
-
-    # Check if should to re-write systemd service files
-    if args.writesysd:
-        _log.info('Trying to update systemd service files...')
-        genrun(outdir=args.outsysd, user=args.user)
-
-    # Daemon reloading
-    _log.info('Trigger systemd reload')
-    SP.check_call([systemctl,
-                   '--user' if args.user else '--system',
-                   'daemon-reload'], shell=False)
+            if args.username: F.write("user = %s\n"%args.username)
+            if args.group: F.write("group = %s\n"%args.group)
+            if args.host: F.write("host = %s\n"%args.host)
+            if args.site: F.write("site = %s\n"%args.site)
+            if args.port: F.write("port = %s\n"%args.port)
+
+        os.rename(tmpfile, cfile)
+        gen = request(args)
+
+    # Re-write Conserver configuration and systemd service files, and reload systemd
+    publish(args, gen)
 
     # procServ restarting
     if args.autostart:
         _log.info("Starting the service: ioc@%s.service" % args.name)
-        SP.check_call([systemctl,
-                       '--user' if args.user else '--system',
-                       'start', 'ioc@%s.service' % args.name])
+        _systemctl(args, 'start', 'ioc@%s.service' % args.name)
     else:
         sys.stdout.write("# systemctl start ioc@%s.service\n"%args.name)
 
 def delproc(conf, args):
-    from .conf import getconffiles, ConfigParser
-    for cfile in getconffiles(user=args.user):
-        _log.debug('Process %s', cfile)
-
-        with open(cfile) as F:
-            C = ConfigParser({'instance':'1'})
-            C.readfp(F)
-
-        if not C.has_section(args.name):
-            continue
-        if not C.getboolean(args.name, 'instance'):
-            continue
-
-        if not args.force and sys.stdin.isatty():
+    from .lock import Lock, lockfile
+    from .publish import request, publish
+    from .conf import findsections, _notfound
+    if not args.force and sys.stdin.isatty():
+        for cfile, _C in findsections(args.name, user=args.user):
             while True:
                 sys.stdout.write("Remove section '%s' from %s ? [yN]"%(args.name, cfile))
                 sys.stdout.flush()
@@ -244,93 +243,468 @@ def delproc(conf, args):
                 else:
                     sys.stdout.write('\n')
 
-        if len(C.defaults())==1 and len(C.sections())==1:
-            _log.info('Removing empty file %s', cfile)
-            os.remove(cfile)
-        else:
-            C.remove_section(args.name)
-            C.remove_option('DEFAULT', 'instance')
-            _log.info("Removing section '%s' from file %s", args.name, cfile)
-            with open(cfile+'.tmp', 'w') as F:
-                C.write(F)
-            os.rename(cfile+'.tmp', cfile)
-
-    # Check if should to re-write Conserver coniguration file
-    if args.writeconf:
-        _log.info('Trying to update Conserver configuration file...')
-        # Updating conserver config file due the previous procedures
-        conf = getconf(user=args.user)
-        # Adding writeconf default parameters
-        #   - where to save configuration file of conserver;
-        #   - whether should automatically reload the service;
-        args.out = conserver_conf
-        writeprocs(conf, args)
-
-    # Check if should to re-write systemd service files
-    if args.writesysd:
-        _log.info('Trying to update systemd service files...')
-        genrun(outdir=args.outsysd, user=args.user)
-
-    # Daemon reloading
-    _log.info('Trigger systemd reload')
-    SP.check_call([systemctl,
-                   '--user' if args.user else '--system',
-                   'daemon-reload'], shell=False)
+    with Lock(lockfile('config', user=args.user)):
+        # re-read now that no one else is changing config
+        found = False
+        for cfile, C in findsections(args.name, user=args.user):
+            found = True
+            if len(C.defaults())==1 and len(C.sections())==1:
+                _log.info('Removing empty file %s', cfile)
+                os.remove(cfile)
+            else:
+                C.remove_section(args.name)
+                C.remove_option('DEFAULT', 'instance')
+                _log.info("Removing section '%s' from file %s", args.name, cfile)
+                tmpfile = '%s.%d.tmp'%(cfile, os.getpid())
+                with open(tmpfile, 'w') as F:
+                    C.write(F)
+                os.rename(tmpfile, cfile)
+        if not found:
+            _log.error('%s', _notfound(conf, args.name))
+            sys.exit(1)
+        gen = request(args)
+
+    # Re-write Conserver configuration and systemd service files, and reload systemd
+    publish(args, gen)
 
     sys.stdout.write("# systemctl stop ioc@%s.service\n"%args.name)
+    if conf.has_option(args.name, 'swapped'):
+        sys.stdout.write("# systemctl stop ioc@%s.service\n"%conf.get(args.name, 'swapped'))
+
+def _waitready(port, args):
+    """Wait until the console on port answers with a prompt.  Returns True if it did.
+    """
+    import asyncio, time
+    from .probe import endpoint, probe_one
+    ep = endpoint([port])
+    if ep is None:
+        _log.error('Can not probe port %s', port)
+        return False
+    deadline = time.monotonic()+args.timeout
+    while True:
+        remaining = deadline-time.monotonic()
+        if remaining<=0:
+            return False
+        try:
+            L = asyncio.run(probe_one(ep, command=args.ready.encode(), prompt=args.prompt.encode(),
+                                      timeout=min(5.0, remaining)))
+            if L is not None:
+                return True
+        except OSError as e:
+            _log.debug('Not ready: %s', e)
+        time.sleep(min(0.5, max(0, deadline-time.monotonic())))
+
+def _setopts(args, name, conf, opts):
+    """Change options of an instance in the file defining it.
+
+    Must be called with the 'config' lock held.  A member of an instance
+    set is given a section of its own, which overrides the set.
+    """
+    from .conf import findsections
+    found = False
+    for cfile, C in findsections(name, user=args.user):
+        for K, V in opts.items():
+            C.set(name, K, V.replace('%', '%%'))
+        C.remove_option('DEFAULT', 'instance')
+        _log.info("Updating section '%s' in %s", name, cfile)
+        tmpfile = '%s.%d.tmp'%(cfile, os.getpid())
+        with open(tmpfile, 'w') as F:
+            C.write(F)
+        os.rename(tmpfile, cfile)
+        found = True
+
+    if not found:
+        cfile = os.path.join(getgendir(user=args.user), '%s.conf'%name)
+        _log.info('Writing %s', cfile)
+        items = dict(conf.items(name))
+        items.pop('instance', None)
+        items.update(opts)
+        tmpfile = '%s.%d.tmp'%(cfile, os.getpid())
+        with open(tmpfile, 'w') as F:
+            F.write('\n[%s]\n'%name)
+            for K in sorted(items):
+                F.write('%s = %s\n'%(K, items[K].replace('%', '%%')))
+        os.rename(tmpfile, cfile)
+
+def _swapnames(name, unit):
+    """Return (unit to stop, temporary instance name) to swap an instance
+    whose process runs in unit.
+
+    Alternates between two temporary names, as the process may run under one.
+    """
+    unit = unit or 'ioc@%s.service'%name
+    tmpname = '%s-green'%name if unit=='ioc@%s-blue.service'%name else '%s-blue'%name
+    return unit, tmpname
+
+def swapproc(conf, args):
+    """Replace the command of a running instance with little downtime.
+
+    The new command is started as a temporary instance on another port.
+    Once its console answers, the instance config, conserver entry and
+    registry are pointed at it, and only then is the old process stopped.
+
+    The new process keeps running under the temporary unit, which is
+    recorded as swapped= so that the next start of ioc@NAME stops it first.
+    """
+    import time
+    from .lock import Lock, lockfile
+    from .publish import request, publish
+    from .api import Fleet
+    from . import registry, history
+
+    name = args.name
+    F = Fleet(user=args.user, conf=conf)
+    if name not in F:
+        _log.error("No instance '%s'", name)
+        sys.exit(1)
+    I = F[name]
+
+    # swapped= stays in the config after a plain restart, the registry knows
+    # which unit the current process runs in
+    ent = registry.lookup(name, user=args.user)
+    live, tmpname = _swapnames(name, ent.unit if ent is not None else None)
+    if tmpname in F:
+        _log.error("Instance '%s' already exists, left over from a failed swap?", tmpname)
+        sys.exit(1)
+
+    opts = dict(outsysd=args.outsysd, reload=args.reload)
+    try:
+        # with no --port, one is chosen under the config lock
+        port = F.add(tmpname, shlex.split(args.command), chdir=args.chdir or I.chdir,
+                     port=args.port, port_range=args.port_range, user=I.user, group=I.group,
+                     host=I.host, site=I.site, **opts).port
+    except ValueError as e:
+        _log.error('%s', e)
+        sys.exit(1)
+    _log.info('Started %s on port %s', tmpname, port)
+    tmpunit = 'ioc@%s.service'%tmpname
+    _systemctl(args, 'start', tmpunit)
+
+    if not _waitready(port, args):
+        _log.error('%s not ready after %s seconds, keeping the old process', tmpname, args.timeout)
+        _systemctl(args, 'stop', tmpunit)
+        F.remove(tmpname, **opts)
+        sys.exit(1)
+
+    T0 = time.time()
+    new = {'command':args.command, 'port':port, 'swapped':tmpname}
+    if args.chdir:
+        new['chdir'] = args.chdir
+    with Lock(lockfile('config', user=args.user)):
+        _setopts(args, name, conf, new)
+        os.remove(os.path.join(getgendir(user=args.user), '%s.conf'%tmpname))
+        gen = request(args)
+
+    # conserver and units now refer to the new process.  The temporary unit
+    # loses its unit file, but stays active until stopped.
+    publish(args, gen)
+
+    _log.info('Stopping old process')
+    _systemctl(args, 'stop', live)
+
+    ent = registry.lookup(tmpname, user=args.user)
+    pid = ent.pid if ent is not None else registry.readinfo(tmpname, user=args.user)[0]
+    registry.update(name, user=args.user, unit=tmpunit, pid=pid, started=time.time(),
+                    ports=('tcp:%s'%port if port.isdigit() else port,), state='running')
+    # stopping ioc@NAME recorded a stop
+    history.record(name, history.START, pid=pid, user=args.user)
+    sys.stdout.write('%s now running under %s on port %s, switched over in %.1f seconds\n'%(
+                     name, tmpunit, port, time.time()-T0))
 
 def writeprocs(conf, args):
-    opts = {
-        'rundir':getrundir(user=args.user),
-    }
-    _log.debug('Writing %s', args.out)
-    with open(args.out+'.tmp', 'w') as F:
-        for name in conf.sections():
-            _log.debug('name =  %s', name)
-            opts['name'] = name
-            # Delete any existing tcp_port dict entry
-            if 'tcp_port' in opts.keys():
-                del opts['tcp_port']
-            _log.debug('port_string =  %s', port_string)
-            port_string = conf.get(name, 'port')
-            if 'tcp:' in port_string:
-                opts['tcp_port'] = port_string.split(':')[1]
-            if port_string.isdigit():
-                opts['tcp_port'] = port_string
+    from .publish import writeconserver
+    writeconserver(conf, args.out, user=args.user, reload=args.reload)
 
-            F.write("""
-console %(name)s {
-    master localhost;
-"""%opts)
+def watchevents(conf, args, fp=None):
+    import time
+    from .events import watch
+    fp = fp or sys.stdout
+    hooks = []
 
-            if 'tcp_port' in opts.keys():
-                F.write("""    type host;
-    host localhost;
-    port %(tcp_port)s;
-}
-"""%opts)
-            else:
-                _log.debug('writing uds port')
-                F.write("""    type uds;
-    uds %(rundir)s/ioc@%(name)s/control;
-}
-"""%opts)
+    for E in watch(user=args.user, grace=args.grace):
+        if args.json:
+            import json
+            fp.write(json.dumps(E._asdict())+'\n')
+        else:
+            fp.write('%s %s %s %s %s\n'%(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(E.time)),
+                                         E.name, E.event, E.pid or '-', ' '.join(E.ports)))
+        fp.flush()
+
+        if args.exec_:
+            import subprocess
+            # reap hooks run for earlier events
+            hooks = [H for H in hooks if H.poll() is None]
+            env = dict(os.environ)
+            env.update({
+                'PROCSERV_NAME':E.name,
+                'PROCSERV_EVENT':E.event,
+                'PROCSERV_PID':str(E.pid or ''),
+                'PROCSERV_PORTS':' '.join(E.ports),
+            })
+            _log.debug('Run hook for %s %s', E.name, E.event)
+            hooks.append(subprocess.Popen(shlex.split(args.exec_), env=env))
+
+def _parsetime(S):
+    """Parse an absolute time (YYYY-MM-DD[THH:MM[:SS]])
+    or an age (eg. 30m, 12h, 7d, 2w) into seconds since the epoch.
+    """
+    import time
+    units = {'s':1, 'm':60, 'h':3600, 'd':86400, 'w':7*86400}
+    if S[-1:] in units and S[:-1].replace('.', '', 1).isdigit():
+        return time.time()-float(S[:-1])*units[S[-1]]
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(S, fmt))
+        except ValueError:
+            pass
+    raise ValueError('Unable to parse time "%s"'%S)
+
+def _duration(T):
+    if T is None:
+        return '-'
+    T = int(T)
+    D, T = divmod(T, 86400)
+    H, T = divmod(T, 3600)
+    M, T = divmod(T, 60)
+    if D:
+        return '%dd %dh'%(D, H)
+    elif H:
+        return '%dh %dm'%(H, M)
+    else:
+        return '%dm %ds'%(M, T)
+
+def showhistory(conf, args, fp=None):
+    import time
+    from .history import availability, transitions
+    fp = fp or sys.stdout
+    try:
+        since = None if args.since is None else _parsetime(args.since)
+    except ValueError as e:
+        _log.error('%s', e)
+        sys.exit(1)
 
-    os.rename(args.out+'.tmp', args.out)
+    if args.transitions:
+        for T in transitions(args.name, user=args.user):
+            if since is None or T.time>=since:
+                fp.write('%s %s %s\n'%(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(T.time)),
+                                       T.event, T.pid or '-'))
+        return
 
-    # Reloading conserver-server
-    if args.reload:
-        _log.debug('Reloading conserver-server')
-        SP.check_call([systemctl,
-                    '--user' if args.user else '--system',
-                    'restart', 'conserver'], shell=False)
+    A = availability(args.name, since=since, user=args.user)
+    if A is None:
+        _log.error('No history for %s', args.name)
+        sys.exit(1)
+
+    fp.write('%s\n'%A.name)
+    fp.write('  from     %s\n'%time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(A.begin)))
+    fp.write('  uptime   %.2f%%\n'%(A.uptime*100))
+    fp.write('  starts   %d\n'%A.starts)
+    fp.write('  restarts %d\n'%A.restarts)
+    fp.write('  crashes  %d\n'%A.crashes)
+    fp.write('  MTBF     %s\n'%_duration(A.mtbf))
+
+def probe(conf, args, fp=None):
+    from .registry import scan
+    from .probe import Prober, endpoint
+    fp = fp or sys.stdout
+
+    reg = dict((E.name, E) for E in scan(user=args.user))
+    targets = {}
+    for name in args.names or conf.sections():
+        if not conf.has_section(name) or not conf.getboolean(name, 'instance'):
+            _log.warning('%s is not an instance', name)
+            continue
+        ent = reg.get(name)
+        if ent is not None and ent.state!='running':
+            _log.info('%s is not running', name)
+            continue
+        ep = endpoint(ent.ports if ent is not None else [conf.get(name, 'port')])
+        if ep is None:
+            _log.warning('%s has no control port to probe', name)
+            continue
+        targets[name] = ep
+
+    P = Prober(targets, command=args.command.encode(), prompt=args.prompt.encode(),
+               timeout=args.timeout, threshold=args.threshold,
+               rate=args.rate, concurrency=args.concurrency)
+
+    def show(results):
+        for R in results:
+            fp.write('%s %s %s\n'%(R.name, R.state,
+                                   '-' if R.latency is None else '%.3f'%R.latency))
+            if R.state=='hung' and args.restart and P.strikes[R.name]>=args.strikes:
+                _log.warning('Restarting hung instance %s', R.name)
+                P.strikes[R.name] = 0
+                _systemctl(args, 'restart', 'ioc@%s.service'%R.name)
+        fp.flush()
+
+    P.run(count=args.count, interval=args.interval, cb=show)
+
+    if args.histogram:
+        for name in sorted(P.hist):
+            H = P.hist[name]
+            fp.write('%s n=%d timeouts=%d'%(name, H.n, H.timeouts))
+            if H.n:
+                fp.write(' mean=%.3f p50<=%.3f p99<=%.3f max=%.3f'%(H.mean, H.percentile(50),
+                                                                     H.percentile(99), H.max))
+            fp.write('\n')
+            for edge, C in H.buckets():
+                if C:
+                    fp.write('  %s\t%d\n'%('<=%g'%edge if edge is not None else '>', C))
+
+def runbroker(conf, args):
+    import asyncio
+    from . import registry
+    from .probe import endpoint
+    from .broker import Broker, Console, getbrokerdir
+
+    def getendpoint(name):
+        ent = registry.lookup(name, user=args.user)
+        if ent is not None:
+            return endpoint(ent.ports) if ent.state=='running' else None
+        return endpoint([conf.get(name, 'port')])
+
+    B = Broker(args.dir or getbrokerdir(user=args.user))
+    for name in args.names or conf.sections():
+        if not conf.has_section(name) or not conf.getboolean(name, 'instance'):
+            _log.warning('%s is not an instance', name)
+            continue
+        B.add(Console(name, lambda name=name:getendpoint(name),
+                      scrollback=args.scrollback, readonly=args.read_only))
+
+    try:
+        asyncio.run(B.serve())
+    except KeyboardInterrupt:
+        pass
+
+def attach(conf, args):
+    from . import broker
+    path = os.path.join(args.dir or broker.getbrokerdir(user=args.user), args.name)
+    try:
+        broker.attach(path)
+    except OSError as e:
+        _log.error('Unable to attach to %s through the broker: %s', args.name, e)
+        sys.exit(1)
+
+def stress(conf, args, fp=None):
+    from .stress import run
+    fp = fp or sys.stdout
+
+    R = run(rate=args.rate, size=args.size, duration=args.duration,
+            readers=args.readers, slow=args.slow, procserv=args.procserv,
+            opts=args.opt)
+
+    if args.json:
+        import json
+        json.dump(R, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+        return
+
+    def _num(V, fmt='%.1f'):
+        return '-' if V is None else fmt%V
+
+    fp.write('procServ  %s (%s)\n'%(R['procserv'], R['version'] or 'unknown version'))
+    fp.write('options   %s\n'%' '.join(R['options']))
+    fp.write('load      %g lines/s of %d bytes for %gs\n'%(R['rate'], R['size'], R['duration']))
+    fp.write('sent      %s lines, blocked %ss, longest write %ss\n'%(R['sent'], _num(R['blocked'], '%.3f'),
+                                                                   _num(R['longest_write'], '%.3f')))
+    fp.write('%-3s %-4s %9s %9s %9s %11s %9s %9s %9s\n'%('#', 'SLOW', 'LINES', 'LOST', 'UNDELIV',
+                                                        'BYTES/s', 'P50(ms)', 'P99(ms)', 'MAX(ms)'))
+    for i, S in enumerate(R['readers']):
+        fp.write('%-3d %-4s %9d %9d %9s %11s %9s %9s %9s\n'%(i, 'yes' if S['slow'] else 'no',
+                 S['lines'], S['lost'], _num(S['undelivered'], '%d'), _bytes(S['bytes_per_sec']),
+                 _num(S['latency_p50'] and S['latency_p50']*1e3),
+                 _num(S['latency_p99'] and S['latency_p99']*1e3),
+                 _num(S['latency_max'] and S['latency_max']*1e3)))
+
+def runsampler(conf, args):
+    import time
+    from .metrics import sample
+    n = 0
+    while True:
+        T0 = time.monotonic()
+        _log.debug('Sampled %d instances', sample(user=args.user))
+        n += 1
+        if args.count and n>=args.count:
+            break
+        time.sleep(max(0, args.interval-(time.monotonic()-T0)))
+
+def report(conf, args, fp=None):
+    from .metrics import analyze, leaks
+    fp = fp or sys.stdout
+    try:
+        since = None if args.since is None else _parsetime(args.since)
+    except ValueError as e:
+        _log.error('%s', e)
+        sys.exit(1)
+
+    stats = analyze(since=since, user=args.user)
+    suspects = leaks(stats, top=args.top)
+
+    if args.json:
+        import json
+        json.dump({'instances':[S._asdict() for S in stats],
+                   'leaks':[S.name for S in suspects]}, fp, indent=1)
+        fp.write('\n')
+        return
+
+    if args.sort!='name':
+        # largest first, unknown last
+        stats.sort(key=lambda S:(getattr(S, args.sort) is None, -(getattr(S, args.sort) or 0), S.name))
+    if args.limit:
+        stats = stats[:args.limit]
+
+    pct = lambda V:'-' if V is None else '%.1f'%V
+    fp.write('%-20s %7s %6s %6s %8s %8s %8s %9s %4s %8s\n'%('NAME', 'SAMPLES', 'CPU50', 'CPU95',
+             'MEM50', 'MEM95', 'MEMMAX', 'GROWTH/d', 'RST', 'LOADCORR'))
+    for S in stats:
+        fp.write('%-20s %7d %6s %6s %8s %8s %8s %9s %4d %8s\n'%(S.name, S.samples,
+                 pct(S.cpu_p50), pct(S.cpu_p95), _bytes(S.mem_p50), _bytes(S.mem_p95),
+                 _bytes(S.mem_max), _bytes(S.growth), S.restarts,
+                 '-' if S.load_corr is None else '%.2f'%S.load_corr))
+
+    if suspects:
+        fp.write('\nLeak suspects\n')
+        for S in suspects:
+            fp.write('  %-20s %9s/day  R^2=%.2f\n'%(S.name, _bytes(S.growth), S.fit))
+
+def checkconf(conf, args, fp=None):
+    from .conf import getconffiles
+    from .check import check
+    fp = fp or sys.stdout
+
+    P = check(conf, user=args.user, files=getconffiles(user=args.user), jobs=args.jobs)
+
+    if args.json:
+        import json
+        json.dump([X._asdict() for X in P], fp, indent=1)
+        fp.write('\n')
     else:
-        sys.stdout.write('# systemctl restart conserver\n')
+        for X in P:
+            fp.write('%s: %s: %s\n'%(X.name, X.level, X.message))
 
-def getargs():
+    if any(X.level=='error' for X in P):
+        sys.exit(1)
+
+def renderbundles(conf, args, fp=None):
+    from .render import render
+    fp = fp or sys.stdout
+    if args.user_units and not args.rundir:
+        _log.error('--user-units needs the --rundir of the target hosts')
+        sys.exit(1)
+    try:
+        R = render(args.inventory, args.out, hosts=args.host, user=args.user_units,
+                   jobs=args.jobs, python=args.python, rundir=args.rundir or '/run')
+    except ValueError as e:
+        _log.error('%s', e)
+        sys.exit(1)
+    for host, digest, changed in R:
+        fp.write('%s %s%s\n'%(digest, host, '' if changed else ' (unchanged)'))
+
+def getparser():
     from argparse import ArgumentParser
 
-    P = ArgumentParser()
+    P = ArgumentParser(prog='manage-procs')
     P.add_argument('--user', action='store_true', default=os.geteuid()!=0,
                    help='Consider user config')
     P.add_argument('--system', dest='user', action='store_false',
@@ -340,6 +714,13 @@ def getargs():
     SP = P.add_subparsers()
 
     S = SP.add_parser('status', help='List procServ instance state')
+    S.add_argument('-r', '--resources', action='store_true', default=False,
+                    help='Show CPU, memory, process and I/O usage of each instance from its cgroup')
+    S.add_argument('-s', '--sort', default='name',
+                    choices=['name', 'cpu', 'mem', 'peak', 'pids', 'read', 'write'],
+                    help='Column to sort --resources by (default: %(default)s)')
+    S.add_argument('-i', '--interval', type=float, default=1.0,
+                    help='Seconds between the two --resources samples (default: %(default)s)')
     S.set_defaults(func=status)
 
     S = SP.add_parser('list', help='List procServ instances')
@@ -348,6 +729,10 @@ def getargs():
     S = SP.add_parser('add', help='Create a new procServ instance')
     S.add_argument('-C', '--chdir', default=os.getcwd(), help='Run directory for instance')
     S.add_argument('-P', '--port', help='telnet port')
+    S.add_argument('-N', '--next-port', action='store_true', default=False,
+                    help='Use the lowest telnet port in --port-range not used by another instance')
+    S.add_argument('--port-range', default='2000-2999',
+                    help='Range searched by --next-port (default: %(default)s)')
     S.add_argument('-U', '--user', dest='username')
     S.add_argument('-G', '--group')
     S.add_argument('-H', '--host', help='Target IOC hostname', default='localhost')
@@ -379,12 +764,155 @@ def getargs():
     S.add_argument('name', help='Instance name')
     S.set_defaults(func=delproc)
 
+    S = SP.add_parser('swap', help='Switch a running instance to a new command with little downtime')
+    S.add_argument('--command', required=True, help='New command line')
+    S.add_argument('-C', '--chdir', help='New run directory (default: unchanged)')
+    S.add_argument('-P', '--port', help='Port for the new process (default: the first free in --port-range)')
+    S.add_argument('--port-range', default='2000-2999',
+                    help='Range searched for a free port (default: %(default)s)')
+    S.add_argument('-t', '--timeout', type=float, default=60.0,
+                    help='Seconds to wait for the new process to be ready (default: %(default)s)')
+    S.add_argument('-c', '--ready', default='',
+                    help='Line sent to check that the new process is ready (default: empty line)')
+    S.add_argument('-p', '--prompt', default='> *$',
+                    help='Regular expression matching the prompt (default: "%(default)s")')
+    S.add_argument('-D', '--outsysd', default=systemd_dir)
+    S.add_argument('-R', '--reload', action='store_true', default=False,
+                    help='Restart conserver-server')
+    S.add_argument('name', help='Instance name')
+    S.set_defaults(func=swapproc, writeconf=True, writesysd=True)
+
+    S = SP.add_parser('events', help='Print instance state changes as they happen')
+    S.add_argument('-j', '--json', action='store_true', default=False,
+                    help='Print one JSON object per event')
+    S.add_argument('-x', '--exec', dest='exec_', metavar='CMD',
+                    help='Run CMD for each event with $PROCSERV_NAME, $PROCSERV_EVENT, $PROCSERV_PID and $PROCSERV_PORTS set')
+    S.add_argument('--grace', type=float, default=2.0,
+                    help='Seconds to wait for systemd after a process exits before reporting a crash')
+    S.set_defaults(func=watchevents)
+
+    S = SP.add_parser('history', help='Show uptime and restarts of an instance')
+    S.add_argument('-s', '--since', metavar='TIME',
+                    help='Start of interval.  Date (YYYY-MM-DD[THH:MM[:SS]]) or age (eg. 12h, 7d)')
+    S.add_argument('-t', '--transitions', action='store_true', default=False,
+                    help='List recorded transitions instead of a summary')
+    S.add_argument('name', help='Instance name')
+    S.set_defaults(func=showhistory)
+
+    S = SP.add_parser('probe', help='Check that instance consoles respond')
+    S.add_argument('-c', '--command', default='',
+                    help='Line to send (default: empty line)')
+    S.add_argument('-p', '--prompt', default='> *$',
+                    help='Regular expression matching the prompt (default: "%(default)s")')
+    S.add_argument('-t', '--timeout', type=float, default=5.0,
+                    help='Seconds to wait for a prompt (default: %(default)s)')
+    S.add_argument('-T', '--threshold', type=float, default=2.0,
+                    help='Latency in seconds above which an instance is hung (default: %(default)s)')
+    S.add_argument('-n', '--count', type=int, default=1,
+                    help='Number of rounds, 0 to run forever (default: %(default)s)')
+    S.add_argument('-i', '--interval', type=float, default=30.0,
+                    help='Seconds between rounds (default: %(default)s)')
+    S.add_argument('--rate', type=float, default=10.0,
+                    help='Maximum probes started per second (default: %(default)s)')
+    S.add_argument('--concurrency', type=int, default=8,
+                    help='Maximum probes in progress (default: %(default)s)')
+    S.add_argument('-H', '--histogram', action='store_true', default=False,
+                    help='Print latency histograms at exit')
+    S.add_argument('--restart', action='store_true', default=False,
+                    help='Restart hung instances through systemd')
+    S.add_argument('--strikes', type=int, default=2,
+                    help='Consecutive hung probes before restarting (default: %(default)s)')
+    S.add_argument('names', nargs='*', help='Instances to probe (default: all)')
+    S.set_defaults(func=probe)
+
+    S = SP.add_parser('broker', help='Share instance consoles with local clients')
+    S.add_argument('--dir', help='Directory for client sockets')
+    S.add_argument('-b', '--scrollback', type=int, default=64*1024,
+                    help='Bytes of output kept per instance (default: %(default)s)')
+    S.add_argument('--read-only', action='store_true', default=False,
+                    help='Do not pass client input to instances')
+    S.add_argument('names', nargs='*', help='Instances to serve (default: all)')
+    S.set_defaults(func=runbroker)
+
+    S = SP.add_parser('attach', help='Attach to an instance console through the broker')
+    S.add_argument('--dir', help='Directory of client sockets')
+    S.add_argument('name', help='Instance name')
+    S.set_defaults(func=attach)
+
+    S = SP.add_parser('stress', help='Measure console throughput and latency of procServ')
+    S.add_argument('-r', '--rate', type=float, default=1000.0,
+                    help='Lines per second written (default: %(default)s)')
+    S.add_argument('-s', '--size', type=int, default=80,
+                    help='Bytes per line (default: %(default)s)')
+    S.add_argument('-t', '--duration', type=float, default=10.0,
+                    help='Seconds to write for (default: %(default)s)')
+    S.add_argument('-n', '--readers', type=int, default=4,
+                    help='Number of clients attached (default: %(default)s)')
+    S.add_argument('--slow', type=int, default=0,
+                    help='How many of the clients read slowly (default: %(default)s)')
+    S.add_argument('--procserv', help='procServ executable to test')
+    S.add_argument('--opt', action='append', default=[],
+                    help='Extra procServ argument (may be repeated)')
+    S.add_argument('-j', '--json', action='store_true', default=False,
+                    help='Print the report as JSON')
+    S.set_defaults(func=stress)
+
+    S = SP.add_parser('sample', help='Record resource usage of running instances for report')
+    S.add_argument('-n', '--count', type=int, default=1,
+                    help='Number of samples, 0 to run forever (default: %(default)s)')
+    S.add_argument('-i', '--interval', type=float, default=300.0,
+                    help='Seconds between samples (default: %(default)s)')
+    S.set_defaults(func=runsampler)
+
+    S = SP.add_parser('report', help='Summarize recorded resource usage and rank leak suspects')
+    S.add_argument('-s', '--since', metavar='TIME', default='7d',
+                    help='Start of interval.  Date (YYYY-MM-DD[THH:MM[:SS]]) or age (default: %(default)s)')
+    S.add_argument('--sort', default='name',
+                    choices=['name', 'samples', 'cpu_p50', 'cpu_p95', 'mem_p50', 'mem_p95', 'mem_max',
+                             'growth', 'restarts', 'load_corr'],
+                    help='Column to sort by (default: %(default)s)')
+    S.add_argument('-l', '--limit', type=int, default=0,
+                    help='Show only this many instances')
+    S.add_argument('-n', '--top', type=int, default=10,
+                    help='Number of leak suspects listed (default: %(default)s)')
+    S.add_argument('-j', '--json', action='store_true', default=False,
+                    help='Print the report as JSON')
+    S.set_defaults(func=report)
+
+    S = SP.add_parser('check', help='Validate the configuration of all instances')
+    S.add_argument('-j', '--json', action='store_true', default=False,
+                    help='Print problems as JSON')
+    S.add_argument('--jobs', type=int,
+                    help='Number of concurrent checks')
+    S.set_defaults(func=checkconf)
+
+    S = SP.add_parser('render', help='Render per-host unit and conserver bundles from an inventory')
+    S.add_argument('-i', '--inventory', required=True, metavar='DIR',
+                    help='Directory of instance config files for all hosts')
+    S.add_argument('-o', '--out', required=True, metavar='DIR',
+                    help='Directory to write one bundle per host into')
+    S.add_argument('-H', '--host', action='append',
+                    help='Host to render (may be repeated, default: every host= in the inventory)')
+    S.add_argument('--jobs', type=int,
+                    help='Number of hosts rendered concurrently')
+    S.add_argument('--user-units', action='store_true',
+                    help='Render user units (default: system units)')
+    S.add_argument('--python', default='/usr/bin/python3',
+                    help='Python interpreter on the target hosts (default: %(default)s)')
+    S.add_argument('--rundir', metavar='DIR',
+                    help='Run directory on the target hosts (default: /run)')
+    S.set_defaults(func=renderbundles)
+
     S = SP.add_parser('write-procs-cf', help='Write conserver config')
     S.add_argument('-f', '--out', default=conserver_conf)
     S.add_argument('-R', '--reload', action='store_true', default=False,
                     help='Restart conserver-server')
     S.set_defaults(func=writeprocs)
 
+    return P
+
+def getargs():
+    P = getparser()
     A = P.parse_args()
     if not hasattr(A, 'func'):
         P.print_help()
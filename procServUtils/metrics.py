@@ -0,0 +1,357 @@
+"""Sampled resource usage history, and fleet wide analysis of it
+
+Samples of every running instance are stored column by column in one
+fixed size, mmap()'d ring file per host and scope.  Each column is a
+plain little endian array, read with a single numpy.frombuffer() and
+analysed for all instances at once.  NumPy is optional; without it the
+same analysis runs in pure Python, just more slowly.
+
+Counters are stored as read (eg. CPU time in usec) and turned into
+rates when analysed, so any interval can be chosen afterwards.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno, struct, time, math
+from collections import namedtuple
+
+from .conf import getstatedir
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# magic, version, capacity (rows), name table size, names used, total rows ever appended
+_header = struct.Struct('<4sIIII4xQ')
+_magic = b'PSMT'
+_version = 1
+_namesize = 48
+
+# name, struct/NumPy type code
+_columns = [
+    ('time', 'd'),      # seconds since the epoch
+    ('inst', 'I'),      # index into the name table
+    ('cpu_usec', 'd'),  # CPU time used by the cgroup
+    ('mem', 'd'),       # bytes
+    ('peak', 'd'),      # bytes
+    ('pids', 'f'),
+    ('started', 'd'),   # start time of the running process, changes on restart
+    ('load', 'f'),      # host 1 minute load average
+]
+
+# about four weeks of 5 minute samples of 500 instances, ~200MB (sparse until used)
+_capacity = 1<<22
+_maxnames = 4096
+
+Stats = namedtuple('Stats', ['name', 'samples', 'cpu_p50', 'cpu_p95', 'mem_p50', 'mem_p95',
+                             'mem_max', 'growth', 'fit', 'restarts', 'load_corr'])
+Stats.__doc__ = """Summary of one instance over the analysed interval
+
+cpu_* are in percent of one CPU, mem_* in bytes.  growth is the trend of
+memory use since the last restart in bytes/day, fit the R^2 of that
+trend.  load_corr is the correlation of CPU use with the host load
+average.  Any value which can't be computed is None.
+"""
+
+def getmetrics(user=False):
+    """Return the metrics file name for this scope
+    """
+    return os.path.join(getstatedir(user=user), 'metrics')
+
+def _layout(capacity, maxnames):
+    """Return the offset of the name table, and of each column
+    """
+    off = (_header.size+63)&~63
+    names = off
+    off += maxnames*_namesize
+    cols = {}
+    for name, code in _columns:
+        off = (off+4095)&~4095
+        cols[name] = off
+        off += capacity*struct.calcsize(code)
+    return names, cols, off
+
+class Metrics(object):
+    """A mmap()'d view of the metrics ring
+    """
+    def __init__(self, fname, write=False, capacity=_capacity, maxnames=_maxnames):
+        import mmap
+        self.fname = fname
+        if write:
+            D = os.path.dirname(fname)
+            if not os.path.isdir(D):
+                os.makedirs(D)
+            self.fd = os.open(fname, os.O_RDWR|os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size==0:
+                import fcntl
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(self.fd).st_size==0:
+                        os.ftruncate(self.fd, _layout(capacity, maxnames)[2])
+                        os.pwrite(self.fd, _header.pack(_magic, _version, capacity, maxnames, 0, 0), 0)
+                finally:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.map = mmap.mmap(self.fd, 0)
+        else:
+            self.fd = os.open(fname, os.O_RDONLY)
+            self.map = mmap.mmap(self.fd, 0, prot=mmap.PROT_READ)
+
+        magic, version, self.capacity, self.maxnames, _n, _total = _header.unpack_from(self.map, 0)
+        if magic!=_magic or version!=_version:
+            raise RuntimeError('%s is not a procServ metrics file'%fname)
+        self._names, self._cols, _end = _layout(self.capacity, self.maxnames)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, A, B, C):
+        self.close()
+
+    def names(self):
+        """Return the name table, indexed by the inst column
+        """
+        nnames = _header.unpack_from(self.map, 0)[4]
+        ret = []
+        for i in range(nnames):
+            off = self._names+i*_namesize
+            ret.append(self.map[off:off+_namesize].rstrip(b'\0').decode('utf-8', 'replace'))
+        return ret
+
+    def append(self, rows):
+        """Append rows, each a dict with an instance 'name' and column values.
+        Missing or None values are stored as NaN.
+        """
+        import fcntl
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            magic, version, cap, maxnames, nnames, total = _header.unpack_from(self.map, 0)
+            index = dict((N, i) for i, N in enumerate(self.names()))
+            for R in rows:
+                idx = index.get(R['name'])
+                if idx is None:
+                    if nnames>=maxnames:
+                        _log.warning('Metrics name table full, not recording %s', R['name'])
+                        continue
+                    idx = index[R['name']] = nnames
+                    self.map[self._names+idx*_namesize:self._names+(idx+1)*_namesize] = \
+                        R['name'].encode('utf-8')[:_namesize].ljust(_namesize, b'\0')
+                    nnames += 1
+                pos = total%cap
+                for col, code in _columns:
+                    V = idx if col=='inst' else R.get(col)
+                    struct.pack_into('<'+code, self.map, self._cols[col]+pos*struct.calcsize(code),
+                                     float('nan') if V is None else V)
+                total += 1
+            # publish the rows only once they are complete
+            _header.pack_into(self.map, 0, magic, version, cap, maxnames, nnames, total)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def columns(self):
+        """Return a dict of column name to values, oldest first.
+
+        Values are NumPy arrays if NumPy is available, otherwise lists.
+        """
+        _magic, _version, cap, _maxnames, _nnames, total = _header.unpack_from(self.map, 0)
+        N, pos = min(total, cap), total%cap
+        ret = {}
+        for col, code in _columns:
+            off = self._cols[col]
+            if numpy is not None:
+                A = numpy.frombuffer(self.map, dtype='<'+code, count=cap, offset=off)
+                ret[col] = A[:N].copy() if total<=cap else numpy.concatenate((A[pos:], A[:pos]))
+            else:
+                A = memoryview(self.map)[off:off+cap*struct.calcsize(code)].cast(code)
+                ret[col] = A[:N].tolist() if total<=cap else A[pos:].tolist()+A[:pos].tolist()
+                A.release()
+        return ret
+
+def sample(user=False):
+    """Record one sample of every running instance
+    """
+    from .cgroup import sample as cgsample
+    from .registry import scan, aliases
+    T = time.time()
+    reg = dict((E.name, E) for E in scan(user=user))
+    load = os.getloadavg()[0]
+    rows = []
+    for name, S in sorted(cgsample(user=user, aliases=aliases(user=user)).items()):
+        ent = reg.get(name)
+        rows.append({'name':name, 'time':T, 'cpu_usec':S.cpu_usec, 'mem':S.mem_current,
+                     'peak':S.mem_peak, 'pids':S.pids, 'load':load,
+                     'started':ent.started if ent is not None else None})
+    with Metrics(getmetrics(user=user), write=True) as M:
+        M.append(rows)
+    return len(rows)
+
+def _fit(n, Sx, Sy, Sxx, Sxy, Syy):
+    """Least squares slope and R^2 (or correlation coefficient) from sums.
+    Returns (slope, r2, r), any of which may be None.
+    """
+    if n<3:
+        return None, None, None
+    vx, vy, cov = n*Sxx-Sx*Sx, n*Syy-Sy*Sy, n*Sxy-Sx*Sy
+    if vx<=0:
+        return None, None, None
+    if vy<=0:
+        return cov/vx, None, None
+    r = max(-1.0, min(1.0, cov/math.sqrt(vx*vy)))
+    return cov/vx, r*r, r
+
+def _nearest(S, P):
+    # nearest rank percentile of a sorted sequence, as probe and stress do
+    return S[min(len(S)-1, int(P/100.0*len(S)))] if len(S) else None
+
+def _finite(V):
+    return V is not None and not math.isnan(V)
+
+def _analyze_python(C, names):
+    groups = {}
+    for i in range(len(C['time'])):
+        groups.setdefault(C['inst'][i], []).append(i)
+
+    ret = []
+    for g, rows in groups.items():
+        rows.sort(key=lambda i:C['time'][i])
+        T, U, M, St, L = [[C[K][i] for i in rows] for K in ('time', 'cpu_usec', 'mem', 'started', 'load')]
+
+        cpu, cl = [], []
+        restarts = 0
+        for j in range(1, len(rows)):
+            dT, dU = T[j]-T[j-1], U[j]-U[j-1]
+            if _finite(dU) and dT>0 and dU>=0:
+                cpu.append(dU*1e-4/dT)
+                if _finite(L[j]):
+                    cl.append((cpu[-1], L[j]))
+            if _finite(St[j]) and _finite(St[j-1]) and St[j]!=St[j-1]:
+                restarts += 1
+
+        mem = sorted(V for V in M if _finite(V))
+        last = St[-1]
+        pts = [((T[j]-T[0])/86400.0, M[j]) for j in range(len(rows))
+               if _finite(M[j]) and (not _finite(last) or St[j]==last)]
+
+        def sums(P):
+            return (len(P), sum(x for x, _y in P), sum(y for _x, y in P), sum(x*x for x, _y in P),
+                    sum(x*y for x, y in P), sum(y*y for _x, y in P))
+        growth, fit, _r = _fit(*sums(pts))
+        _s, _r2, corr = _fit(*sums(cl))
+        cpu.sort()
+        ret.append(Stats(name=names[g] if g<len(names) else str(g), samples=len(rows),
+                         cpu_p50=_nearest(cpu, 50), cpu_p95=_nearest(cpu, 95),
+                         mem_p50=_nearest(mem, 50), mem_p95=_nearest(mem, 95),
+                         mem_max=mem[-1] if mem else None,
+                         growth=growth, fit=fit, restarts=restarts, load_corr=corr))
+    return ret
+
+def _np_percentiles(V, G, ngroups, Ps):
+    """Nearest rank percentiles of values V per group G.  Returns one array (NaN if empty) per P
+    """
+    o = numpy.argsort(V)
+    o = o[numpy.argsort(G[o], kind='stable')]
+    V = V[o]
+    n = numpy.bincount(G, minlength=ngroups)
+    first = numpy.concatenate(([0], numpy.cumsum(n)[:-1]))
+    ret = []
+    for P in Ps:
+        idx = first+numpy.minimum(n-1, (P/100.0*n).astype(numpy.int64))
+        ret.append(numpy.where(n>0, V[numpy.clip(idx, 0, max(0, len(V)-1))] if len(V) else numpy.nan,
+                               numpy.nan))
+    return ret
+
+def _np_sums(X, Y, G, ngroups):
+    B = lambda W=None:numpy.bincount(G, weights=W, minlength=ngroups)
+    return B(), B(X), B(Y), B(X*X), B(X*Y), B(Y*Y)
+
+def _analyze_numpy(C, names):
+    np = numpy
+    o = np.lexsort((C['time'], C['inst']))
+    T, inst, U, M, St, L = [C[K][o].astype(np.float64) if K!='inst' else C[K][o]
+                            for K in ('time', 'inst', 'cpu_usec', 'mem', 'started', 'load')]
+    if not len(T):
+        return []
+
+    # number groups 0..G-1 in order of instance index
+    newgrp = np.concatenate(([True], inst[1:]!=inst[:-1]))
+    G = np.cumsum(newgrp)-1
+    ngroups = int(G[-1])+1
+    ginst = inst[newgrp]
+    same = ~newgrp
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dT = np.concatenate(([np.nan], np.diff(T)))
+        dU = np.concatenate(([np.nan], np.diff(U)))
+        ok = same & (dT>0) & (dU>=0)
+        cpu = dU*1e-4/dT
+
+        prev = np.concatenate(([np.nan], St[:-1]))
+        restarts = np.bincount(G, weights=same & np.isfinite(St) & np.isfinite(prev) & (St!=prev),
+                               minlength=ngroups)
+
+        cpu50, cpu95 = _np_percentiles(cpu[ok], G[ok], ngroups, (50, 95))
+        mok = np.isfinite(M)
+        mem50, mem95, mem100 = _np_percentiles(M[mok], G[mok], ngroups, (50, 95, 100))
+
+        # memory trend since the last restart of each instance
+        last = np.concatenate((newgrp[1:], [True]))
+        lastst = St[last][G]
+        seg = mok & ((St==lastst) | ~np.isfinite(lastst))
+        X = (T-T[newgrp][G])/86400.0
+        msums = _np_sums(X[seg], M[seg], G[seg], ngroups)
+
+        lok = ok & np.isfinite(L)
+        lsums = _np_sums(cpu[lok], L[lok], G[lok], ngroups)
+
+    nrows = np.bincount(G, minlength=ngroups)
+    val = lambda A, g:None if np.isnan(A[g]) else float(A[g])
+    ret = []
+    for g in range(ngroups):
+        growth, fit, _r = _fit(*[float(S[g]) for S in msums])
+        _s, _r2, corr = _fit(*[float(S[g]) for S in lsums])
+        i = int(ginst[g])
+        ret.append(Stats(name=names[i] if i<len(names) else str(i), samples=int(nrows[g]),
+                         cpu_p50=val(cpu50, g), cpu_p95=val(cpu95, g),
+                         mem_p50=val(mem50, g), mem_p95=val(mem95, g), mem_max=val(mem100, g),
+                         growth=growth, fit=fit, restarts=int(restarts[g]), load_corr=corr))
+    return ret
+
+def analyze(since=None, until=None, user=False, fname=None):
+    """Compute Stats for every instance sampled in [since, until].
+    Returns a list sorted by name.
+    """
+    try:
+        M = Metrics(fname or getmetrics(user=user))
+    except OSError as e:
+        if e.errno!=errno.ENOENT:
+            raise
+        return []
+    with M:
+        names, C = M.names(), M.columns()
+
+    if since is not None or until is not None:
+        lo = -float('inf') if since is None else since
+        hi = float('inf') if until is None else until
+        if numpy is not None:
+            sel = (C['time']>=lo) & (C['time']<=hi)
+            C = dict((K, V[sel]) for K, V in C.items())
+        else:
+            sel = [i for i, T in enumerate(C['time']) if lo<=T<=hi]
+            C = dict((K, [V[i] for i in sel]) for K, V in C.items())
+
+    ret = (_analyze_numpy if numpy is not None else _analyze_python)(C, names)
+    ret.sort(key=lambda S:S.name)
+    return ret
+
+def leaks(stats, top=10, min_fit=0.5, min_samples=6):
+    """Rank instances whose memory use grows steadily since their last restart.
+    Returns up to top Stats, fastest growth first.
+    """
+    L = [S for S in stats if S.growth is not None and S.growth>0 and S.fit is not None
+         and S.fit>=min_fit and S.samples>=min_samples]
+    L.sort(key=lambda S:(-S.growth*S.fit, S.name))
+    return L[:top]
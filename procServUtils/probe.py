@@ -0,0 +1,199 @@
+"""Console responsiveness probe
+
+Connects to the control port of each instance, sends a harmless line
+and times how long the process takes to answer with a prompt.  Probes
+run concurrently on one asyncio loop, with a global limit on the rate
+at which probes are started so the IOCs never see a burst of clients.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import re, time, bisect
+from collections import namedtuple
+
+# upper bucket edges in seconds, the last bucket is unbounded
+_buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+Result = namedtuple('Result', ['name', 'state', 'latency'])
+Result.__doc__ = """Outcome of one probe
+
+state is one of 'ok', 'hung' (no prompt before the threshold, or at all)
+or 'down' (can't connect).  latency is in seconds, None unless answered.
+"""
+
+class Histogram(object):
+    """Latency histogram with fixed, roughly logarithmic, buckets
+    """
+    def __init__(self):
+        self.counts = [0]*(len(_buckets)+1)
+        self.timeouts = 0
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        if latency is None:
+            self.timeouts += 1
+            return
+        self.counts[bisect.bisect_left(_buckets, latency)] += 1
+        self.n += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, P):
+        """Upper bound of the bucket holding the P-th percentile (0-100)
+        """
+        if self.n==0:
+            return None
+        want, acc = P/100.0*self.n, 0
+        for i, C in enumerate(self.counts):
+            acc += C
+            if acc>=want and C:
+                return _buckets[i] if i<len(_buckets) else self.max
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total/self.n if self.n else None
+
+    def buckets(self):
+        """Iterate (upper edge, count), the edge of the last bucket is None
+        """
+        for i, C in enumerate(self.counts):
+            yield (_buckets[i] if i<len(_buckets) else None), C
+
+def endpoint(ports):
+    """Pick a connectable endpoint from registry style port strings.
+
+    Returns ('tcp', host, port), ('unix', path) or None
+    """
+    for P in ports:
+        if P.startswith('unix:'):
+            return ('unix', P[5:])
+        if P.isdigit():
+            P = 'tcp:'+P
+        if P.startswith('tcp:'):
+            parts = P.split(':')
+            host = parts[1] if len(parts)>2 else 'localhost'
+            if host in ('0.0.0.0', ''):
+                host = 'localhost'
+            if parts[-1]!='0':
+                return ('tcp', host, int(parts[-1]))
+    return None
+
+class RateLimit(object):
+    """Space out the starts of probes to at most rate per second
+    """
+    def __init__(self, rate):
+        self.period = 1.0/rate if rate>0 else 0.0
+        self.next = 0.0
+    async def acquire(self):
+        import asyncio
+        now = time.monotonic()
+        T, self.next = self.next, max(self.next, now)+self.period
+        if T>now:
+            await asyncio.sleep(T-now)
+
+async def probe_one(ep, command=b'', prompt=rb'> *$', timeout=5.0, settle=0.1):
+    """Probe one endpoint.
+
+    Returns the time from sending command to the prompt appearing,
+    or None if no prompt appeared within timeout.
+    Raises OSError if the endpoint can't be reached.
+    """
+    import asyncio
+    match = re.compile(prompt).search
+
+    if ep[0]=='unix':
+        R, W = await asyncio.wait_for(asyncio.open_unix_connection(ep[1]), timeout)
+    else:
+        R, W = await asyncio.wait_for(asyncio.open_connection(ep[1], ep[2]), timeout)
+    try:
+        # discard the procServ banner, and any ongoing output, for a moment
+        quiet = time.monotonic()+10*settle
+        while time.monotonic()<quiet:
+            try:
+                if not await asyncio.wait_for(R.read(4096), settle):
+                    raise OSError('connection closed')
+            except asyncio.TimeoutError:
+                break
+
+        T0 = time.monotonic()
+        W.write(command+b'\r\n')
+        await W.drain()
+
+        buf = b''
+        deadline = T0+timeout
+        while True:
+            remaining = deadline-time.monotonic()
+            if remaining<=0:
+                return None
+            try:
+                data = await asyncio.wait_for(R.read(4096), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if not data:
+                raise OSError('connection closed')
+            buf = (buf+data)[-1024:]
+            if match(buf.rstrip(b'\r\n')):
+                return time.monotonic()-T0
+    finally:
+        W.close()
+
+class Prober(object):
+    """Probe a set of instances, keeping a Histogram for each.
+
+    targets is a dict of instance name to endpoint.
+    """
+    def __init__(self, targets, command=b'', prompt=rb'> *$', timeout=5.0,
+                 threshold=2.0, rate=10.0, concurrency=8):
+        self.targets = targets
+        self.command, self.prompt = command, prompt
+        self.timeout, self.threshold = timeout, threshold
+        self.rate, self.concurrency = rate, concurrency
+        self.hist = dict((name, Histogram()) for name in targets)
+        self.strikes = dict((name, 0) for name in targets)
+
+    async def _probe(self, name, limit, sem):
+        async with sem:
+            await limit.acquire()
+            try:
+                L = await probe_one(self.targets[name], self.command, self.prompt,
+                                    timeout=self.timeout)
+            except Exception as e:
+                _log.debug('%s: %s', name, e)
+                self.strikes[name] = 0
+                return Result(name, 'down', None)
+        self.hist[name].add(L)
+        if L is None or L>self.threshold:
+            self.strikes[name] += 1
+            return Result(name, 'hung', L)
+        self.strikes[name] = 0
+        return Result(name, 'ok', L)
+
+    async def round(self):
+        """Probe every target once.  Returns a list of Results
+        """
+        import asyncio
+        limit = RateLimit(self.rate)
+        sem = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*[self._probe(name, limit, sem) for name in sorted(self.targets)])
+
+    def run(self, count=1, interval=30.0, cb=None):
+        """Run count rounds (forever if 0) spaced by interval seconds,
+        calling cb with each list of Results.
+        """
+        import asyncio
+        async def loop():
+            n = 0
+            while True:
+                T0 = time.monotonic()
+                res = await self.round()
+                if cb is not None:
+                    cb(res)
+                n += 1
+                if count and n>=count:
+                    break
+                await asyncio.sleep(max(0, interval-(time.monotonic()-T0)))
+        asyncio.run(loop())
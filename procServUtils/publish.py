@@ -0,0 +1,168 @@
+"""Publish configuration changes to conserver and systemd
+
+Changes to the instance config files are queued with request() while
+holding the 'config' lock, then published with publish(), which
+regenerates the conserver config and the units and reloads systemd once
+for every change queued meanwhile.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import sys, os, errno
+
+from .conf import getconf, getrundir
+from .lock import Lock, lockfile
+
+# -----------------------------------------------------------------------------
+# Default parameters
+# -----------------------------------------------------------------------------
+systemctl       = '/bin/systemctl'
+conserver_conf  = '/etc/conserver/procs.cf'
+systemd_dir     = '/etc/systemd/system'
+
+def runsystemctl(user, *cmd):
+    import subprocess
+    subprocess.check_call([systemctl,
+                           '--user' if user else '--system']+list(cmd),
+                          shell=False)
+
+def writeconsoles(F, conf, rundir):
+    """Write conserver console entries for every instance in conf
+    """
+    opts = {
+        'rundir':rundir,
+    }
+    for name in conf.sections():
+        _log.debug('name =  %s', name)
+        opts['name'] = name
+        # Delete any existing tcp_port dict entry
+        if 'tcp_port' in opts.keys():
+            del opts['tcp_port']
+        port_string = conf.get(name, 'port')
+        _log.debug('port_string =  %s', port_string)
+        if 'tcp:' in port_string:
+            opts['tcp_port'] = port_string.split(':')[1]
+        if port_string.isdigit():
+            opts['tcp_port'] = port_string
+
+        F.write("""
+console %(name)s {
+    master localhost;
+"""%opts)
+
+        if 'tcp_port' in opts.keys():
+            F.write("""    type host;
+    host localhost;
+    port %(tcp_port)s;
+}
+"""%opts)
+        else:
+            _log.debug('writing uds port')
+            F.write("""    type uds;
+    uds %(rundir)s/ioc@%(name)s/control;
+}
+"""%opts)
+
+def writeconserver(conf, out, user=False, reload=False):
+    """Replace the conserver config file out, and restart conserver if reload
+    """
+    _log.debug('Writing %s', out)
+    tmpfile = '%s.%d.tmp'%(out, os.getpid())
+    with open(tmpfile, 'w') as F:
+        writeconsoles(F, conf, getrundir(user=user))
+
+    os.rename(tmpfile, out)
+
+    # Reloading conserver-server
+    if reload:
+        _log.debug('Reloading conserver-server')
+        runsystemctl(user, 'restart', 'conserver')
+    else:
+        sys.stdout.write('# systemctl restart conserver\n')
+
+def _statefile(user):
+    return os.path.join(getrundir(user=user), 'procServ-manage.state')
+
+def _readstate(user):
+    import json
+    try:
+        with open(_statefile(user)) as F:
+            return json.load(F)
+    except (IOError, OSError) as e:
+        if e.errno!=errno.ENOENT:
+            raise
+    except ValueError:
+        _log.warning('Ignoring corrupt %s', _statefile(user))
+    return {'requested':0, 'done':0, 'pending':[]}
+
+def _writestate(user, S):
+    import json
+    fname = _statefile(user)
+    with open('%s.%d.tmp'%(fname, os.getpid()), 'w') as F:
+        json.dump(S, F)
+    os.rename('%s.%d.tmp'%(fname, os.getpid()), fname)
+
+def request(args):
+    """Queue regeneration after a config change.
+
+    args gives user, and writeconf, writesysd, outsysd and reload for
+    this change.  Must be called with the 'config' lock held.
+    Returns the generation number which publish() waits for.
+    """
+    S = _readstate(args.user)
+    S['requested'] += 1
+    S['pending'].append({
+        'writeconf':args.writeconf,
+        'writesysd':args.writesysd,
+        'outsysd':args.outsysd,
+        'reload':args.reload,
+    })
+    _writestate(args.user, S)
+    return S['requested']
+
+def publish(args, gen):
+    """Regenerate conserver config and units, then reload systemd,
+    once for all config changes queued up to now.
+
+    Concurrent callers queue on the 'publish' lock.  The first becomes
+    leader and does the work for every change queued so far, the rest
+    then find their change already published and return.
+    """
+    with Lock(lockfile('publish', user=args.user)):
+        with Lock(lockfile('config', user=args.user)):
+            S = _readstate(args.user)
+            if S['done']>=gen:
+                _log.info('Changes already published by another process')
+                return
+            upto, pending = S['requested'], S['pending']
+            S['pending'] = []
+            _writestate(args.user, S)
+
+        _log.debug('Publish %d changes up to %d', len(pending), upto)
+        try:
+            if any(P['writeconf'] for P in pending):
+                _log.info('Trying to update conserver configuration...')
+                writeconserver(getconf(user=args.user), conserver_conf, user=args.user,
+                               reload=any(P['reload'] for P in pending))
+
+            for outsysd in sorted(set(P['outsysd'] for P in pending if P['writesysd'])):
+                _log.info('Trying to update systemd service files in %s...', outsysd)
+                from .generator import run
+                run(outdir=outsysd, user=args.user)
+
+            _log.info('Trigger systemd reload')
+            runsystemctl(args.user, 'daemon-reload')
+
+        except:
+            # leave the changes for the next leader
+            with Lock(lockfile('config', user=args.user)):
+                S = _readstate(args.user)
+                S['pending'] = pending+S['pending']
+                _writestate(args.user, S)
+            raise
+
+        with Lock(lockfile('config', user=args.user)):
+            S = _readstate(args.user)
+            S['done'] = max(S['done'], upto)
+            _writestate(args.user, S)
@@ -0,0 +1,299 @@
+"""Runtime registry of procServ instances
+
+One file per scope (system/user) in the run directory holding a fixed
+size record for each instance.  Records are kept in an open addressed
+hash table keyed by instance name, so a lookup reads one (or a few)
+records while a full scan is a single read of the whole file.
+
+Writers serialize on a separate lock file and rewrite one record in place.
+Each record starts and ends with a sequence number which the writer bumps,
+so readers never lock and simply retry a record read while it was torn.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno, struct, time, zlib
+from collections import namedtuple
+
+from .conf import getrundir, getinfofile
+from .lock import Lock
+
+# instance states
+EMPTY, RUNNING, STOPPED, FAILED = range(4)
+_states = ['', 'running', 'stopped', 'failed']
+
+# magic, version, number of slots, number of used slots
+_header = struct.Struct('<4sIII')
+# seq, state, pid, start time, name, unit, ports, seq
+_record = struct.Struct('<IIid64s96s72sI')
+assert _record.size==256, _record.size
+
+_magic = b'PSRG'
+_version = 1
+_minslots = 64
+_retries = 100
+
+Entry = namedtuple('Entry', ['name', 'unit', 'pid', 'started', 'ports', 'state'])
+Entry.__doc__ = """Runtime state of one instance
+
+pid and started are None when not known.
+ports is a tuple of strings like 'tcp:5000' or 'unix:/run/ioc@NAME/control'.
+state is one of 'running', 'stopped' or 'failed'.
+"""
+
+def getregistry(user=False):
+    """Return the registry file name for this scope
+    """
+    return os.path.join(getrundir(user=user), 'procServ.registry')
+
+def _slot(name, nslots):
+    return zlib.crc32(name) % nslots
+
+def _offset(idx):
+    # The header occupies slot -1 so that records stay aligned
+    return (idx+1)*_record.size
+
+def _decode(rec):
+    _seq, state, pid, started, name, unit, ports, _seq2 = rec
+    return Entry(
+        name=name.rstrip(b'\0').decode('utf-8'),
+        unit=unit.rstrip(b'\0').decode('utf-8'),
+        pid=pid or None,
+        started=started or None,
+        ports=tuple(ports.rstrip(b'\0').decode('utf-8').split()),
+        state=_states[state] if state<len(_states) else 'unknown',
+    )
+
+def _encode(seq, ent):
+    ports = ' '.join(ent.ports).encode('utf-8')
+    if len(ports)>72:
+        raise ValueError('ports too long for registry: %r'%ports)
+    name = ent.name.encode('utf-8')
+    if len(name)>64:
+        raise ValueError('name too long for registry: %r'%ent.name)
+    return _record.pack(seq, _states.index(ent.state), ent.pid or 0, ent.started or 0.0,
+                        name, ent.unit.encode('utf-8')[:96], ports, seq)
+
+def _unpack(buf):
+    """Decode a record, or return None if it was torn by a concurrent writer
+    """
+    rec = _record.unpack(buf)
+    if rec[0]!=rec[-1]:
+        return None
+    return rec
+
+def _readheader(fd):
+    buf = os.pread(fd, _header.size, 0)
+    if len(buf)<_header.size:
+        return 0, 0
+    magic, version, nslots, used = _header.unpack(buf)
+    if magic!=_magic or version!=_version:
+        raise RuntimeError('Not a procServ registry (version %d)'%version)
+    return nslots, used
+
+def _readslot(fd, idx):
+    for _i in range(_retries):
+        buf = os.pread(fd, _record.size, _offset(idx))
+        if len(buf)<_record.size:
+            return None
+        rec = _unpack(buf)
+        if rec is not None:
+            return rec
+        time.sleep(0)
+    raise RuntimeError('registry record %d is continuously changing'%idx)
+
+def _probe(fd, nslots, bname):
+    """Return (index, record) of the slot holding bname,
+    or (index, None) for the empty slot where it would go.
+    """
+    idx = _slot(bname, nslots)
+    for _i in range(nslots):
+        rec = _readslot(fd, idx)
+        if rec is None or rec[1]==EMPTY:
+            return idx, None
+        if rec[4].rstrip(b'\0')==bname:
+            return idx, rec
+        idx = (idx+1)%nslots
+    return None, None
+
+def _open(user=False):
+    try:
+        return os.open(getregistry(user=user), os.O_RDONLY)
+    except OSError as e:
+        if e.errno!=errno.ENOENT:
+            raise
+        return None
+
+def lookup(name, user=False):
+    """Return the Entry for the named instance, or None if never registered
+    """
+    fd = _open(user=user)
+    if fd is None:
+        return None
+    try:
+        nslots, _used = _readheader(fd)
+        if nslots==0:
+            return None
+        _idx, rec = _probe(fd, nslots, name.encode('utf-8'))
+        return None if rec is None else _decode(rec)
+    finally:
+        os.close(fd)
+
+def scan(user=False):
+    """Iterate all registered instances.
+
+    Reads the registry in a single pass without locking.
+    """
+    fd = _open(user=user)
+    if fd is None:
+        return
+    try:
+        nslots, _used = _readheader(fd)
+        size = _offset(nslots)
+        buf = os.pread(fd, size, 0)
+        for idx in range(nslots):
+            off = _offset(idx)
+            rec = _unpack(buf[off:off+_record.size])
+            if rec is None:
+                rec = _readslot(fd, idx)
+            if rec is not None and rec[1]!=EMPTY:
+                yield _decode(rec)
+    finally:
+        os.close(fd)
+
+def _create(fname, nslots, entries=()):
+    """Atomically (re)place the registry file with one of the given size
+    """
+    buf = bytearray(_offset(nslots))
+    _header.pack_into(buf, 0, _magic, _version, nslots, 0)
+    used = 0
+    for seq, ent in entries:
+        bname = ent.name.encode('utf-8')
+        idx = _slot(bname, nslots)
+        while _record.unpack_from(buf, _offset(idx))[1]!=EMPTY:
+            idx = (idx+1)%nslots
+        buf[_offset(idx):_offset(idx+1)] = _encode(seq, ent)
+        used += 1
+    _header.pack_into(buf, 0, _magic, _version, nslots, used)
+
+    with open(fname+'.tmp', 'wb') as F:
+        F.write(buf)
+    os.chmod(fname+'.tmp', 0o644)
+    os.rename(fname+'.tmp', fname)
+
+def update(name, user=False, **kws):
+    """Create or modify the registry entry for an instance.
+
+    Keyword arguments are Entry fields to replace.
+    Returns the new Entry.
+    """
+    fname = getregistry(user=user)
+    bname = name.encode('utf-8')
+
+    with Lock(fname+'.lock'):
+        if not os.path.isfile(fname):
+            _create(fname, _minslots)
+
+        fd = os.open(fname, os.O_RDWR)
+        try:
+            nslots, used = _readheader(fd)
+            idx, rec = _probe(fd, nslots, bname)
+
+            if rec is None and (used+1)*4>nslots*3:
+                # grow to keep probe sequences short
+                _log.debug('Grow registry %s to %d', fname, nslots*2)
+                old = [(0, E) for E in scan(user=user)]
+                _create(fname, nslots*2, old)
+                os.close(fd)
+                fd = os.open(fname, os.O_RDWR)
+                nslots, used = _readheader(fd)
+                idx, rec = _probe(fd, nslots, bname)
+
+            if rec is None:
+                seq = 0
+                ent = Entry(name=name, unit='ioc@%s.service'%name, pid=None,
+                            started=None, ports=(), state='stopped')
+                used += 1
+                os.pwrite(fd, _header.pack(_magic, _version, nslots, used), 0)
+            else:
+                seq = rec[0]
+                ent = _decode(rec)
+
+            ent = ent._replace(**kws)
+            os.pwrite(fd, _encode((seq+1)&0xffffffff, ent), _offset(idx))
+            return ent
+        finally:
+            os.close(fd)
+
+def readinfo(name, user=False):
+    """Parse the procServ --info-file of an instance.
+
+    Returns (pid, ports), with pid None if the file does not exist.
+    """
+    pid, ports = None, []
+    infoname = getinfofile(name, user=user)
+    try:
+        with open(infoname) as F:
+            _log.debug('Read %s', F.name)
+            for line in map(str.strip, F):
+                if line.startswith('pid:'):
+                    pid = int(line[4:])
+                elif line.startswith('tcp:') or line.startswith('unix:'):
+                    ports.append(line)
+    except Exception as e:
+        _log.debug('No info file %s', infoname)
+        if getattr(e, 'errno',0)!=errno.ENOENT:
+            _log.exception('oops')
+    return pid, ports
+
+def _confports(conf, name, user=False):
+    if conf is None:
+        from .conf import getconf
+        conf = getconf(user=user)
+    if not conf.has_section(name):
+        return []
+    port = conf.get(name, 'port')
+    if port.isdigit():
+        port = 'tcp:%s'%port
+    if not port.startswith('unix:') and port.rpartition(':')[2]=='0':
+        # dynamic, only known from the info file
+        return []
+    return [port]
+
+def record_start(conf, name, pid, user=False):
+    """Note that an instance has been started with the given PID
+
+    conf is only needed for the configured port when procServ has not
+    written its info file.  If None, it is loaded when needed.
+    """
+    _ipid, ports = readinfo(name, user=user)
+    return update(name, user=user,
+                  unit='ioc@%s.service'%name,
+                  pid=pid,
+                  started=time.time(),
+                  ports=tuple(ports or _confports(conf, name, user=user)),
+                  state='running')
+
+def record_stop(conf, name, result='success', user=False):
+    """Note that an instance has stopped.
+
+    result is the systemd $SERVICE_RESULT
+    """
+    return update(name, user=user,
+                  pid=None,
+                  state='stopped' if result=='success' else 'failed')
+
+def aliases(user=False):
+    """Return a dict of unit instance name to instance name, for running
+    instances whose process is in the unit of another name.
+
+    'manage-procs swap' leaves the new process of NAME in ioc@NAME-blue.service
+    (or -green) until ioc@NAME is next started.
+    """
+    ret = {}
+    for E in scan(user=user):
+        if E.state=='running' and E.unit!='ioc@%s.service'%E.name \
+                and E.unit.startswith('ioc@') and E.unit.endswith('.service'):
+            ret[E.unit[4:-8]] = E.name
+    return ret
@@ -0,0 +1,182 @@
+"""Render per-host bundles from a central inventory
+
+The inventory is a directory of instance config files, as would be
+found in /etc/procServ.d, describing the instances of many hosts.  Each
+instance goes to the hosts its host= matches (all hosts if it has no
+host=), and each host bundle is rendered in a separate process:
+
+    HOST/procServ.d/inventory.conf   instance config, for launch
+    HOST/systemd/ioc@NAME.service    units, with multi-user.target.wants
+    HOST/conserver/procs.cf          conserver consoles
+    HOST/SHA256SUMS                  content hash of every file above
+
+Bundles only depend on the inventory, so rendering the same inventory
+twice gives identical files.  A bundle whose content has not changed is
+left untouched.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import os, errno, hashlib
+from fnmatch import fnmatchcase
+from glob import glob
+
+from .conf import InstanceConfig, _defaults
+
+# interpreter of the target hosts for ExecStartPost=/ExecStopPost=
+PYTHON = '/usr/bin/python3'
+
+def readinventory(invdir):
+    """Return the instance configuration of an inventory directory
+    """
+    files = sorted(glob(os.path.join(invdir, '*.conf')))
+    if not files:
+        raise ValueError('No *.conf files in %s'%invdir)
+    C = InstanceConfig(_defaults)
+    C.read(files)
+    return C
+
+def _literal(host):
+    return not host.startswith('!') and not any(c in host for c in '*?[')
+
+def gethosts(conf):
+    """Return the sorted host names appearing literally in host=
+    """
+    return sorted(set(conf.get(N, 'host').strip() for N in conf.sections()
+                      if conf.has_option(N, 'host') and _literal(conf.get(N, 'host').strip())))
+
+def matches(pattern, host):
+    """Whether ConditionHost=pattern holds on host
+    """
+    pattern = pattern.strip()
+    if pattern.startswith('!'):
+        return not fnmatchcase(host, pattern[1:])
+    return fnmatchcase(host, pattern)
+
+def split(conf, hosts):
+    """Assign instances to hosts.
+
+    Returns a dict of host name to a list of (instance name, [(option, value)])
+    with values fully resolved.
+    """
+    ret = dict((H, []) for H in hosts)
+    for name in sorted(conf.sections()):
+        if not conf.getboolean(name, 'instance'):
+            continue
+        opts = sorted((K, V) for K, V in conf.items(name) if K!='instance')
+        pattern = conf.get(name, 'host') if conf.has_option(name, 'host') else None
+        for H in hosts:
+            if pattern is None or matches(pattern, H):
+                ret[H].append((name, opts))
+    return ret
+
+def _hashfile(fname):
+    H = hashlib.sha256()
+    with open(fname, 'rb') as F:
+        for blk in iter(lambda:F.read(65536), b''):
+            H.update(blk)
+    return H.hexdigest()
+
+def _readfile(fname):
+    try:
+        with open(fname) as F:
+            return F.read()
+    except (IOError, OSError) as e:
+        if e.errno!=errno.ENOENT:
+            raise
+        return None
+
+def renderhost(outdir, host, instances, user=False, python=PYTHON, rundir='/run'):
+    """Write the bundle of one host into outdir/host.
+
+    instances is a list as from split().  user selects user units,
+    python and rundir are the interpreter and run directory of the host,
+    never taken from the one rendering.
+    Returns (host, sha256 of SHA256SUMS, True if the bundle changed)
+    """
+    import shutil
+    from .generator import write_service
+    from .publish import writeconsoles
+
+    final = os.path.join(outdir, host)
+    tmpdir = os.path.join(outdir, '.%s.%d.tmp'%(host, os.getpid()))
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    conf = InstanceConfig(_defaults)
+    for name, opts in instances:
+        conf.add_section(name)
+        for K, V in opts:
+            conf.set(name, K, V.replace('%', '%%'))
+
+    try:
+        confdir = os.path.join(tmpdir, 'procServ.d')
+        sysddir = os.path.join(tmpdir, 'systemd')
+        wantsdir = os.path.join(sysddir, 'multi-user.target.wants')
+        consdir = os.path.join(tmpdir, 'conserver')
+        for D in (confdir, wantsdir, consdir):
+            os.makedirs(D)
+
+        with open(os.path.join(confdir, 'inventory.conf'), 'w') as F:
+            F.write('# Rendered for %s\n'%host)
+            for name, opts in instances:
+                F.write('\n[%s]\n'%name)
+                for K, V in opts:
+                    F.write('%s = %s\n'%(K, V.replace('%', '%%').replace('\n', '\n\t')))
+
+        for name, _opts in instances:
+            service = 'ioc@%s.service'%name
+            with open(os.path.join(sysddir, service), 'w') as F:
+                write_service(F, conf, name, user=user, python=python, rundir=rundir)
+            os.symlink(os.path.join('..', service), os.path.join(wantsdir, service))
+
+        with open(os.path.join(consdir, 'procs.cf'), 'w') as F:
+            writeconsoles(F, conf, rundir)
+
+        sums = []
+        for D, _dirs, files in os.walk(tmpdir):
+            for fname in files:
+                path = os.path.join(D, fname)
+                if not os.path.islink(path):
+                    sums.append('%s  %s\n'%(_hashfile(path), os.path.relpath(path, tmpdir)))
+        sums = ''.join(sorted(sums, key=lambda L:L[66:]))
+        with open(os.path.join(tmpdir, 'SHA256SUMS'), 'w') as F:
+            F.write(sums)
+        digest = hashlib.sha256(sums.encode('utf-8')).hexdigest()
+
+        if _readfile(os.path.join(final, 'SHA256SUMS'))==sums:
+            _log.debug('%s unchanged', host)
+            return host, digest, False
+
+        if os.path.isdir(final):
+            old = os.path.join(outdir, '.%s.%d.old'%(host, os.getpid()))
+            os.rename(final, old)
+            os.rename(tmpdir, final)
+            shutil.rmtree(old)
+        else:
+            os.rename(tmpdir, final)
+        return host, digest, True
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def render(invdir, outdir, hosts=None, user=False, jobs=None, python=PYTHON, rundir='/run'):
+    """Render a bundle for each host.
+
+    hosts defaults to every host named in the inventory.
+    System units are rendered unless user=True.
+    Returns a sorted list of (host, digest, changed).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    conf = readinventory(invdir)
+    hosts = sorted(set(hosts)) if hosts else gethosts(conf)
+    if not hosts:
+        raise ValueError('No host= in inventory %s, list the hosts to render'%invdir)
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    byhost = split(conf, hosts)
+    with ProcessPoolExecutor(max_workers=jobs) as X:
+        futs = [X.submit(renderhost, outdir, H, byhost[H], user, python, rundir) for H in hosts]
+        return sorted(F.result() for F in futs)
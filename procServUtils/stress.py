@@ -0,0 +1,231 @@
+"""Console throughput and latency stress test
+
+Starts a procServ instance through the launch path running a synthetic
+command which writes numbered, time stamped lines at a fixed rate, then
+attaches a number of readers to the control port.  Each reader measures
+throughput, end-to-end latency and lost lines, and the writer reports how
+long its writes were blocked by procServ.
+"""
+
+import logging
+_log = logging.getLogger(__name__)
+
+import sys, os, time
+
+# STRESS <seq> <monotonic time> <padding>
+_prefix = b'STRESS '
+# STRESS-END <lines sent> <seconds blocked in write> <longest write>
+_end = b'STRESS-END '
+
+# a write() taking longer than this is counted as blocked
+_blocked = 0.01
+
+def emit(rate=1000.0, size=80, duration=10.0, warmup=1.0, out=None):
+    """Write size byte lines at rate lines/second for duration seconds
+    """
+    fd = (out or sys.stdout).fileno()
+    time.sleep(warmup) # let readers connect
+
+    period = 1.0/rate
+    seq, blocked, longest = 0, 0.0, 0.0
+    T0 = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now-T0>=duration:
+            break
+        line = b'%s%d %.6f '%(_prefix, seq, now)
+        line += b'x'*max(0, size-len(line)-1)+b'\n'
+
+        os.write(fd, line)
+        dT = time.monotonic()-now
+        longest = max(longest, dT)
+        if dT>_blocked:
+            blocked += dT
+        seq += 1
+
+        delay = T0+seq*period-time.monotonic()
+        if delay>0:
+            time.sleep(delay)
+
+    os.write(fd, b'%s%d %.6f %.6f\n'%(_end, seq, blocked, longest))
+
+def _percentile(S, P):
+    if not S:
+        return None
+    return S[min(len(S)-1, int(P/100.0*len(S)))]
+
+class Reader(object):
+    """Parse the synthetic output from one control port connection
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay # pause between reads to simulate a slow client
+        self.lines = self.nbytes = self.lost = 0
+        self.latency = []
+        self.last = None
+        self.first = self.final = None
+        self.end = None
+
+    def feed(self, line):
+        now = time.monotonic()
+        self.nbytes += len(line)
+        if line.startswith(_end):
+            self.end = line.split()[1:4]
+            return
+        idx = line.find(_prefix)
+        if idx<0:
+            return
+        try:
+            seq, T = line[idx+len(_prefix):].split()[:2]
+            seq, T = int(seq), float(T)
+        except ValueError:
+            self.lost += 1 # mangled line
+            return
+        if self.last is not None and seq>self.last+1:
+            self.lost += seq-self.last-1
+        self.last = seq
+        self.lines += 1
+        self.latency.append(now-T)
+        if self.first is None:
+            self.first = now
+        self.final = now
+
+    async def run(self, host, port, deadline):
+        """Read until the end marker, or the monotonic deadline
+        """
+        import asyncio
+        R, W = await asyncio.open_connection(host, port)
+        try:
+            while self.end is None:
+                remaining = deadline-time.monotonic()
+                if remaining<=0:
+                    break
+                try:
+                    line = await asyncio.wait_for(R.readline(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                self.feed(line)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+        finally:
+            W.close()
+
+    def summary(self):
+        S = sorted(self.latency)
+        span = (self.final-self.first) if self.lines>1 else 0.0
+        return {
+            'lines':self.lines,
+            'bytes':self.nbytes,
+            'lost':self.lost,
+            'lines_per_sec':self.lines/span if span else None,
+            'bytes_per_sec':self.nbytes/span if span else None,
+            'latency_p50':_percentile(S, 50),
+            'latency_p99':_percentile(S, 99),
+            'latency_max':S[-1] if S else None,
+            'slow':self.delay>0,
+        }
+
+def _freeport():
+    import socket
+    S = socket.socket()
+    try:
+        S.bind(('localhost', 0))
+        return S.getsockname()[1]
+    finally:
+        S.close()
+
+def _version(procserv):
+    import subprocess
+    try:
+        out = subprocess.check_output([procserv, '--version'], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('utf-8', 'replace').strip().splitlines()[0]
+
+def run(rate=1000.0, size=80, duration=10.0, readers=4, slow=0, slow_delay=0.1,
+        procserv=None, opts=(), drain=5.0):
+    """Run one stress test and return a report dict
+    """
+    import asyncio, subprocess, tempfile, shutil
+    from .conf import ConfigParser, _defaults
+    from . import launch
+
+    procserv = procserv or launch.procServ
+    warmup = 1.0
+    port = _freeport()
+    tmp = tempfile.mkdtemp(prefix='procServ-stress-')
+    name = 'stress-%d'%os.getpid()
+
+    conf = ConfigParser(_defaults)
+    conf.add_section(name)
+    conf.set(name, 'chdir', tmp)
+    conf.set(name, 'port', str(port))
+    conf.set(name, 'command', ' '.join([sys.executable, '-m', __name__, 'emit',
+                                        str(rate), str(size), str(duration), str(warmup)]))
+
+    chdir, argv, env = launch.getcommand(conf, name, procserv=procserv,
+                                         info=os.path.join(tmp, 'info'),
+                                         opts=('--oneshot',)+tuple(opts))
+    # make this package importable by the synthetic command
+    pkgdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([pkgdir]+[P for P in [env.get('PYTHONPATH')] if P])
+
+    _log.info('Start: %s', ' '.join(argv))
+    P = subprocess.Popen(argv, cwd=chdir, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    R = [Reader(delay=slow_delay if i<slow else 0.0) for i in range(readers)]
+    try:
+        async def attach():
+            # wait for procServ to listen
+            deadline = time.monotonic()+warmup
+            while True:
+                try:
+                    _r, W = await asyncio.open_connection('localhost', port)
+                    W.close()
+                    break
+                except OSError:
+                    if time.monotonic()>deadline:
+                        raise
+                    await asyncio.sleep(0.05)
+            # allow a little time to drain after the writer finishes
+            deadline = time.monotonic()+warmup+duration+drain
+            await asyncio.gather(*[X.run('localhost', port, deadline) for X in R])
+        asyncio.run(attach())
+    finally:
+        if P.poll() is None:
+            P.terminate()
+        P.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    sent = blocked = longest = None
+    for X in R:
+        if X.end is not None:
+            sent, blocked, longest = int(X.end[0]), float(X.end[1]), float(X.end[2])
+            break
+
+    summaries = [X.summary() for X in R]
+    for S in summaries:
+        # lines never seen by a reader, not even as a gap
+        S['undelivered'] = None if sent is None else sent-S['lines']-S['lost']
+
+    return {
+        'procserv':procserv,
+        'version':_version(procserv),
+        'options':list(opts),
+        'rate':rate,
+        'size':size,
+        'duration':duration,
+        'readers':summaries,
+        'sent':sent,
+        'blocked':blocked,
+        'longest_write':longest,
+    }
+
+if __name__=='__main__':
+    if sys.argv[1:2]==['emit']:
+        rate, size, duration, warmup = sys.argv[2:6]
+        emit(rate=float(rate), size=int(size), duration=float(duration), warmup=float(warmup))
+    else:
+        sys.stderr.write('Usage: %s emit <rate> <size> <duration> <warmup>\n'%sys.argv[0])
+        sys.exit(1)
@@ -3,7 +3,7 @@ import logging
 _log = logging.getLogger(__name__)
 
 import sys, os, errno
-from .conf import getrundir
+from .conf import getinfofile
 
 _levels = [
     logging.WARN,
@@ -13,9 +13,9 @@ _levels = [
 
 telnet = '/usr/bin/telnet'
 
-def getargs():
+def getparser():
     from argparse import ArgumentParser
-    P = ArgumentParser()
+    P = ArgumentParser(prog='procServ-telnet')
     P.add_argument('--user', action='store_true', default=os.geteuid()!=0,
                    help='Consider user config')
     P.add_argument('--system', dest='user', action='store_false',
@@ -23,15 +23,34 @@ def getargs():
     P.add_argument('-v','--verbose', action='count', default=0)
     P.add_argument("proc", help='Name of instance to attach')
     P.add_argument('extra', nargs='*', help='extra args for telnet')
-    return P.parse_args()
+    return P
+
+def getargs():
+    return getparser().parse_args()
+
+def _exec(argv):
+    _log.debug('exec: %s', ' '.join(argv))
+    os.execv(telnet, argv)
+    sys.exit(1) # never reached
 
 def main(args):
+    from .registry import lookup
     lvl = _levels[max(0, min(args.verbose, len(_levels)-1))]
     logging.basicConfig(level=lvl)
 
-    rundir = getrundir(user=args.user)
+    ent = lookup(args.proc, user=args.user)
+    if ent is not None and ent.state=='running':
+        for P in ent.ports:
+            if not P.startswith('tcp:'):
+                continue
+            # tcp:PORT or tcp:IFACE:PORT
+            parts = P.split(':')
+            if parts[-1]=='0':
+                continue    # dynamic, see the info file
+            iface = parts[1] if len(parts)>2 else 'localhost'
+            _exec([telnet, iface, parts[-1]]+args.extra)
 
-    info = '%s/procserv-%s/info'%(rundir, args.proc)
+    info = getinfofile(args.proc, user=args.user)
     try:
         with open(info) as F:
             for L in map(str.strip, F):
@@ -40,16 +59,12 @@ def main(args):
 
                 _tcp, iface, port = L.split(':', 2)
 
-                args = [telnet, iface, port]+args.extra
-                _log.debug('exec: %s', ' '.join(args))
-
-                os.execv(telnet, args)
-                sys.exit(1) # never reached
+                _exec([telnet, iface, port]+args.extra)
 
-            sys.error('%s has no tcp control port')
+            _log.error('%s has no tcp control port', args.proc)
     except OSError as e:
         if e.errno==errno.ENOENT:
-            _log.error('%s is not an active %s procServ', args.name, 'user' if args.user else 'system')
+            _log.error('%s is not an active %s procServ', args.proc, 'user' if args.user else 'system')
         else:
             _log.exception("Can't open %s"%info)
 
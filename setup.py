@@ -11,6 +11,11 @@ setup (
     package_data    = {'procServUtils': ['*.py'],
                         'procServUtils.conf': ['*.conf']},
     scripts         = ['manage-procs',
+                        'procServ-telnet',
                         'systemd-procserv-generator-system',
                         'systemd-procserv-generator-user'],
+    data_files      = [('share/bash-completion/completions', ['completion/manage-procs', 'completion/procServ-telnet']),
+                        ('share/zsh/site-functions', ['completion/_manage-procs']),
+                        # sourced explicitly, see procServUtils/complete.py
+                        ('share/procServUtils', ['completion/procserv-systemctl.bash'])],
 )
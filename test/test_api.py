@@ -0,0 +1,39 @@
+import os, shutil, tempfile, unittest
+from unittest import mock
+
+from procServUtils.conf import getconf
+from procServUtils.api import Fleet
+
+class TestFleet(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, 'run'))
+        P = mock.patch.dict(os.environ, {'HOME':os.path.join(self.dir, 'home'),
+                                         'XDG_RUNTIME_DIR':os.path.join(self.dir, 'run')})
+        P.start()
+        self.addCleanup(P.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_add(self):
+        F = Fleet(user=True)
+        I = F.add('a', ['sh', '-c', 'date +%s'], chdir='/tmp', port_range='2000-2010', publish=False)
+        self.assertEqual('2000', I.port)
+        self.assertEqual(I, F['a'])
+        # as read back from the file
+        C = getconf(user=True)
+        self.assertEqual("sh -c 'date +%s'", C.get('a', 'command'))
+        self.assertEqual(I, Fleet(user=True, conf=C)['a'])
+
+        self.assertEqual('2001', F.add('b', ['./st.cmd'], port_range='2000-2010', publish=False).port)
+        self.assertRaises(ValueError, F.add, 'a', ['./st.cmd'], publish=False)
+        self.assertRaises(ValueError, F.add, 'c', ['./st.cmd'], port_range='2000-2001', publish=False)
+
+    def test_remove(self):
+        F = Fleet(user=True)
+        F.add('a', ['./st.cmd'], publish=False)
+        self.assertEqual(1, len(F.remove('a', publish=False)))
+        self.assertNotIn('a', F)
+        self.assertNotIn('a', Fleet(user=True))
+        self.assertRaises(ValueError, F.remove, 'a', publish=False)
@@ -0,0 +1,73 @@
+import asyncio, os, random, shutil, tempfile, unittest
+
+from procServUtils import broker
+
+class TestScrollback(unittest.TestCase):
+    def test_fill(self):
+        S = broker.Scrollback(8)
+        self.assertEqual(b'', S.get())
+        S.append(b'abc')
+        self.assertEqual(b'abc', S.get())
+        S.append(b'defgh')
+        self.assertEqual(b'abcdefgh', S.get())
+        S.append(b'ij')
+        self.assertEqual(b'cdefghij', S.get())
+        S.append(b'0123456789')
+        self.assertEqual(b'23456789', S.get())
+
+    def test_fuzz(self):
+        R = random.Random(42)
+        for size in (1, 7, 64):
+            S, ref = broker.Scrollback(size), b''
+            for _i in range(500):
+                data = bytes(R.randrange(256) for _j in range(R.randrange(2*size+2)))
+                S.append(data)
+                ref = (ref+data)[-size:]
+                self.assertEqual(ref, S.get())
+
+class TestConsole(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_share(self):
+        async def run():
+            got = []
+            async def procserv(R, W):
+                W.write(b'banner\r\n')
+                while True:
+                    line = await R.readline()
+                    if not line:
+                        break
+                    got.append(line)
+                    W.write(b'echo '+line)
+            U = await asyncio.start_server(procserv, '127.0.0.1', 0)
+            ep = ('tcp', '127.0.0.1', U.sockets[0].getsockname()[1])
+
+            C = broker.Console('a', lambda:ep)
+            task = asyncio.ensure_future(C.run())
+            path = os.path.join(self.dir, 'a')
+            S = await asyncio.start_unix_server(C.client, path)
+            try:
+                R1, W1 = await asyncio.open_unix_connection(path)
+                # the scrollback, once connected upstream
+                self.assertEqual(b'banner\r\n', await asyncio.wait_for(R1.readline(), 5))
+                R2, W2 = await asyncio.open_unix_connection(path)
+                self.assertEqual(b'banner\r\n', await asyncio.wait_for(R2.readline(), 5))
+
+                W2.write(b'hello\n')
+                self.assertEqual(b'echo hello\n', await asyncio.wait_for(R1.readline(), 5))
+                self.assertEqual(b'echo hello\n', await asyncio.wait_for(R2.readline(), 5))
+                self.assertEqual([b'hello\n'], got)
+                W1.close()
+                W2.close()
+            finally:
+                task.cancel()
+                S.close()
+                U.close()
+            return C
+
+        C = asyncio.run(run())
+        self.assertEqual(b'banner\r\necho hello\n', C.scrollback.get())
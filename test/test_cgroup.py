@@ -0,0 +1,78 @@
+import os, shutil, tempfile, unittest
+
+from procServUtils import cgroup
+
+class TestSample(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.slice = os.path.join(self.root, 'system.slice', 'system-ioc.slice')
+        os.makedirs(os.path.join(self.slice, 'other.service'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, unit, **files):
+        D = os.path.join(self.slice, unit)
+        if not os.path.isdir(D):
+            os.makedirs(D)
+        for fname, content in files.items():
+            with open(os.path.join(D, fname.replace('_', '.')), 'w') as F:
+                F.write(content)
+
+    def sample(self, T, **kws):
+        # fixed times, so rates are exact
+        return dict((N, S._replace(time=T)) for N, S in cgroup.sample(root=self.root, **kws).items())
+
+    def test_usage(self):
+        self.write('ioc@a.service',
+                   cpu_stat='usage_usec 1000000\nuser_usec 800000\nsystem_usec 200000\n',
+                   memory_current='4096\n', memory_peak='8192\n', pids_current='3\n',
+                   io_stat='8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1000 wbytes=0\n')
+        A = self.sample(10.0)
+        self.assertEqual(['a'], list(A))
+        self.assertEqual((1000000, 800000, 200000), (A['a'].cpu_usec, A['a'].user_usec, A['a'].system_usec))
+        self.assertEqual((4096, 8192, 3), (A['a'].mem_current, A['a'].mem_peak, A['a'].pids))
+        self.assertEqual((1100, 200), (A['a'].io_rbytes, A['a'].io_wbytes))
+
+        self.write('ioc@a.service',
+                   cpu_stat='usage_usec 1500000\nuser_usec 1100000\nsystem_usec 400000\n',
+                   memory_current='2048\n',
+                   io_stat='8:0 rbytes=2100 wbytes=4200 rios=1 wios=2\n8:16 rbytes=1000 wbytes=0\n')
+        B = self.sample(12.0)
+        U = cgroup.usage(A, B)['a']
+        self.assertAlmostEqual(25.0, U.cpu)     # 0.5 s of CPU in 2 s
+        self.assertAlmostEqual(1000.0, U.read)
+        self.assertAlmostEqual(2000.0, U.write)
+        self.assertEqual((2048, 8192, 3), (U.mem, U.peak, U.pids))
+
+    def test_max_and_missing(self):
+        # pids.current absent, no io.stat, and no limit
+        self.write('ioc@b.service', cpu_stat='usage_usec 10\n', memory_current='max\n')
+        S = self.sample(1.0)['b']
+        self.assertIsNone(S.mem_current)
+        self.assertIsNone(S.mem_peak)
+        self.assertIsNone(S.pids)
+        self.assertIsNone(S.user_usec)
+        self.assertEqual((None, None), (S.io_rbytes, S.io_wbytes))
+
+        U = cgroup.usage({'b':S}, {'b':S._replace(time=2.0, cpu_usec=20)})['b']
+        self.assertAlmostEqual(0.001, U.cpu)
+        self.assertIsNone(U.read)
+        self.assertIsNone(U.write)
+
+    def test_no_slice(self):
+        shutil.rmtree(self.slice)
+        self.assertEqual({}, cgroup.sample(root=self.root))
+
+    def test_usage_new_instance(self):
+        self.write('ioc@a.service', cpu_stat='usage_usec 10\n')
+        A = self.sample(1.0)
+        self.write('ioc@c.service', cpu_stat='usage_usec 10\n')
+        self.assertEqual(['a'], list(cgroup.usage(A, self.sample(2.0))))
+
+    def test_aliases(self):
+        # a swapped instance runs in the unit of its temporary name
+        self.write('ioc@a-blue.service', cpu_stat='usage_usec 10\n')
+        S = self.sample(1.0, aliases={'a-blue':'a'})
+        self.assertEqual(['a'], list(S))
+        self.assertEqual('a', S['a'].name)
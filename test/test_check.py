@@ -0,0 +1,101 @@
+import os, shutil, tempfile, unittest
+
+from procServUtils.conf import InstanceConfig, _defaults
+from procServUtils import check
+
+class TestPorts(unittest.TestCase):
+    def test_parseport(self):
+        self.assertEqual(('tcp', '0.0.0.0', 2000), check.parseport('2000'))
+        self.assertEqual(('tcp', '0.0.0.0', 2000), check.parseport('tcp:2000'))
+        self.assertEqual(('tcp', '127.0.0.1', 2000), check.parseport('tcp:127.0.0.1:2000'))
+        self.assertEqual(('unix', '/run/ioc@a/control'), check.parseport('unix:/run/ioc@a/control'))
+        self.assertIsNone(check.parseport('0'))
+        for bad in ('unix:', 'tcp:', 'abc', '70000'):
+            self.assertRaises(ValueError, check.parseport, bad)
+
+    def test_index(self):
+        C = InstanceConfig(_defaults)
+        C.read_string("""
+[a]
+port = 2000
+[b]
+port = tcp:127.0.0.1:2002
+[c]
+port = tcp:127.0.0.2:2002
+[d]
+port = unix:/run/x
+[e]
+port = unix:/run//x
+[f]
+port = 2001
+instance = 0
+[g]
+port = bad
+""")
+        idx = check.buildindex(C)
+        # different specific interfaces may share a number
+        self.assertEqual([('unix socket /run/x', ['d', 'e'])], list(idx.conflicts()))
+        self.assertEqual(2001, idx.nextport(2000, 2010))
+        self.assertIsNone(idx.nextport(2000, 2000))
+
+        C.set('c', 'port', '2002')
+        self.assertIn(('tcp port 2002', ['b', 'c']), list(check.buildindex(C).conflicts()))
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        exe = os.path.join(self.dir, 'st.cmd')
+        with open(exe, 'w') as F:
+            F.write('#!/bin/sh\n')
+        os.chmod(exe, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_check(self):
+        C = InstanceConfig(_defaults)
+        C.read_string("""
+[ok]
+command = ./st.cmd
+chdir = %(dir)s
+port = 2000
+
+[bad]
+command = ./missing
+chdir = relative
+port = tcp:99999
+host = no spaces
+
+[dup]
+command = ./st.cmd
+chdir = %(dir)s
+port = 2000
+"""%{'dir':self.dir})
+        P = check.check(C, user=True)
+        self.assertEqual([], [X for X in P if X.name=='ok' and 'also used' not in X.message])
+        self.assertEqual(['chdir=relative is not an absolute path',
+                          'host=no spaces is not a valid host name or machine ID',
+                          'port=: port 99999 out of range'],
+                         [X.message for X in P if X.name=='bad'])
+        self.assertEqual([('dup', 'error', 'tcp port 2000 also used by ok'),
+                          ('ok', 'error', 'tcp port 2000 also used by dup')],
+                         [tuple(X) for X in P if 'also used' in X.message])
+
+    def test_interpolation(self):
+        C = InstanceConfig(_defaults)
+        C.read_string("""
+[date]
+command = date +%%s
+chdir = %(dir)s
+
+[b{1..2}]
+command = ./st.cmd
+chdir = %(dir)s
+port = 20%%(idx)s
+host = ioc%%
+"""%{'dir':self.dir})
+        P = check.check(C, user=True)
+        self.assertTrue(P[-1].message.startswith('command=: '), P)
+        self.assertEqual([('b1', 'error'), ('b1', 'error'), ('b2', 'error'), ('b2', 'error'), ('date', 'error')],
+                         [(X.name, X.level) for X in P])
+        self.assertEqual(['host=', 'port='], sorted(X.message.split(':')[0] for X in P if X.name=='b1'))
@@ -0,0 +1,67 @@
+import unittest
+
+from procServUtils.conf import InstanceConfig, _defaults
+
+class TestInstanceSets(unittest.TestCase):
+    def setUp(self):
+        self.C = InstanceConfig(_defaults)
+        self.C.read_string("""
+[bpm@{01..03}]
+command = ./st.cmd
+chdir = /iocs/%(setname)s%(index)s
+port = 20%(index)s
+
+[b{8..10}x]
+command = ./b
+
+[bpm@02]
+command = ./other
+
+[plain]
+command = ./plain
+""")
+
+    def test_sections(self):
+        self.assertEqual(['bpm@01', 'bpm@03', 'b8x', 'b9x', 'b10x', 'bpm@02', 'plain'], self.C.sections())
+
+    def test_member(self):
+        C = self.C
+        self.assertEqual('/iocs/bpm@01', C.get('bpm@01', 'chdir'))
+        self.assertEqual('2003', C.get('bpm@03', 'port'))
+        self.assertEqual('nobody', C.get('bpm@03', 'user'))
+        self.assertEqual('./b', C.get('b10x', 'command'))
+        self.assertTrue(C.has_option('b9x', 'index'))
+        self.assertIn(('chdir', '/iocs/bpm@03'), C.items('bpm@03'))
+        # a plain section replaces the member
+        self.assertEqual('./other', C.get('bpm@02', 'command'))
+        self.assertEqual('0', C.get('bpm@02', 'port'))
+
+    def test_spelling(self):
+        C = self.C
+        for name in ('bpm@1', 'bpm@001', 'bpm@04', 'b08x', 'b11x', 'b9', 'bpm@{01..03}x'):
+            self.assertFalse(C.has_section(name), name)
+        self.assertTrue(C.has_section('bpm@{01..03}'))
+
+    def test_proxy(self):
+        C = self.C
+        self.assertEqual('2001', C['bpm@01']['port'])
+        self.assertIn('bpm@01', C)
+        self.assertEqual('01', dict(C['bpm@01'])['index'])
+        self.assertRaises(KeyError, C.__getitem__, 'bpm@1')
+
+    def test_change(self):
+        C = self.C
+        C.remove_section('bpm@{01..03}')
+        C.add_section('q{1..2}')
+        self.assertFalse(C.has_section('bpm@01'))
+        self.assertEqual(['b8x', 'b9x', 'b10x', 'bpm@02', 'plain', 'q1', 'q2'], C.sections())
+        C.read_string('[r{1..2}]\n')
+        self.assertTrue(C.has_section('r2'))
+
+    def test_padding(self):
+        C = InstanceConfig(_defaults)
+        C.read_string('[ioc{0..10}]\n[p{00..2}]\n')
+        self.assertEqual(['ioc%d'%i for i in range(11)]+['p00', 'p01', 'p02'], C.sections())
+        self.assertTrue(C.has_section('ioc0'))
+        self.assertFalse(C.has_section('ioc00'))
+        self.assertFalse(C.has_section('p0'))
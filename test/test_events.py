@@ -0,0 +1,66 @@
+import os, shutil, subprocess, tempfile, time, unittest
+from unittest import mock
+
+from procServUtils import registry, events
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp()
+        P = mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR':self.rundir})
+        P.start()
+        self.addCleanup(P.stop)
+        self.procs = []
+
+    def tearDown(self):
+        for P in self.procs:
+            P.kill()
+            P.wait()
+        shutil.rmtree(self.rundir)
+
+    def spawn(self):
+        P = subprocess.Popen(['sleep', '60'])
+        self.procs.append(P)
+        return P
+
+    def collect(self, W, n, timeout=5.0):
+        """Wait for n Events, returned as (name, event)
+        """
+        ret = []
+        deadline = time.monotonic()+timeout
+        while len(ret)<n and time.monotonic()<deadline:
+            ret.extend((E.name, E.event) for E in W.wait(0.1))
+        return ret
+
+    def test_lifecycle(self):
+        P = self.spawn()
+        with events.Watcher(user=True, grace=0.2) as W:
+            registry.update('a', user=True, pid=P.pid, state='running')
+            self.assertEqual([('a', 'started')], self.collect(W, 1))
+
+            D = os.path.join(self.rundir, 'ioc@a')
+            os.mkdir(D)
+            self.assertEqual([], W.wait(0.2)) # watch the new directory
+            with open(os.path.join(D, 'info'), 'w') as F:
+                F.write('pid:%d\ntcp:0.0.0.0:4000\n'%P.pid)
+            E = W.wait(2.0)
+            self.assertEqual([('a', 'port', ('tcp:0.0.0.0:4000',))],
+                             [(X.name, X.event, X.ports) for X in E])
+
+            # gone without systemd recording a stop
+            P.kill()
+            P.wait()
+            self.assertEqual([('a', 'exited'), ('a', 'crashed')], self.collect(W, 2))
+            # the registry still says running, which is not a new start
+            registry.update('a', user=True, state='running')
+            self.assertEqual([], self.collect(W, 1, timeout=0.3))
+
+    def test_stop(self):
+        P = self.spawn()
+        registry.update('b', user=True, pid=P.pid, state='running')
+        with events.Watcher(user=True) as W:
+            registry.record_stop(None, 'b', user=True)
+            self.assertEqual([('b', 'stopped')], self.collect(W, 1))
+            registry.update('b', user=True, pid=P.pid, state='running')
+            self.assertEqual([('b', 'started')], self.collect(W, 1))
+            registry.record_stop(None, 'b', result='exit-code', user=True)
+            self.assertEqual([('b', 'crashed')], self.collect(W, 1))
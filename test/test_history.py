@@ -0,0 +1,52 @@
+import os, shutil, tempfile, unittest
+from unittest import mock
+
+from procServUtils import history
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.statedir = tempfile.mkdtemp()
+        P = mock.patch.dict(os.environ, {'XDG_STATE_HOME':self.statedir})
+        P.start()
+        self.addCleanup(P.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.statedir)
+
+    def append(self, *events):
+        with history.History(history.gethistory(user=True), write=True) as H:
+            for T, name, event in events:
+                H.append(name, event, pid=1, T=T)
+
+    def test_empty(self):
+        self.assertEqual([], list(history.transitions(user=True)))
+        self.assertIsNone(history.availability('a', user=True))
+
+    def test_ring(self):
+        fname = os.path.join(self.statedir, 'ring')
+        with history.History(fname, write=True, capacity=4) as H:
+            for i in range(6):
+                H.append('a', history.START, pid=i+1, T=float(i))
+        self.assertEqual(history._header.size+4*history._record.size, os.path.getsize(fname))
+        with history.History(fname) as H:
+            self.assertEqual([3, 4, 5, 6], [T.pid for T in H])
+
+    def test_transitions(self):
+        self.append((1.0, 'a', history.START), (2.0, 'b', history.START), (3.0, 'a', history.CRASH))
+        self.assertEqual([(1.0, 'start'), (3.0, 'crash')],
+                         [(T.time, T.event) for T in history.transitions('a', user=True)])
+        self.assertEqual(3, len(list(history.transitions(user=True))))
+
+    def test_availability(self):
+        self.append((100.0, 'a', history.START), (150.0, 'a', history.CRASH),
+                    (160.0, 'a', history.START), (200.0, 'a', history.STOP))
+        A = history.availability('a', now=210.0, user=True)
+        self.assertEqual((100.0, 210.0, 2, 1, 1), (A.begin, A.end, A.starts, A.restarts, A.crashes))
+        self.assertAlmostEqual(90.0/110.0, A.uptime)
+        self.assertAlmostEqual(90.0, A.mtbf)
+
+        # running since before the interval
+        A = history.availability('a', since=170.0, now=210.0, user=True)
+        self.assertEqual((170.0, 0, 0), (A.begin, A.starts, A.crashes))
+        self.assertAlmostEqual(30.0/40.0, A.uptime)
+        self.assertIsNone(A.mtbf)
@@ -0,0 +1,44 @@
+"""Import time budget of the commands run often: manage-procs and the
+systemd generators, which run at every boot and daemon-reload.
+"""
+
+import sys, subprocess, unittest
+
+# milliseconds, best of a few runs
+BUDGET = 50.0
+
+def importtime(stmt, toplevel=False):
+    """Return a dict of module name to cumulative import time in us,
+    for modules imported by stmt and not already at startup.
+    With toplevel=True, only those imported by stmt itself.
+    """
+    def run(code):
+        P = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                           stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        ret = {}
+        for L in P.stderr.splitlines():
+            if not L.startswith('import time:'):
+                continue
+            _self, cumul, name = L[12:].split('|')
+            if cumul.strip().isdigit() and (not toplevel or not name.startswith('  ')):
+                ret[name.strip()] = int(cumul)
+        return ret
+    startup = run('pass')
+    return dict((K, V) for K, V in run(stmt).items() if K not in startup)
+
+class TestImportTime(unittest.TestCase):
+    def test_manage(self):
+        T = importtime('import procServUtils.manage, procServUtils.generator')
+        for M in ('pkg_resources', 'argparse', 'asyncio', 'subprocess', 'socket',
+                  'concurrent.futures', 'hashlib', 'mmap', 'numpy'):
+            self.assertNotIn(M, T)
+
+    def test_generator(self):
+        T = importtime('import procServUtils.generator')
+        # only needed on errors
+        self.assertNotIn('logging', T)
+
+    def test_budget(self):
+        stmt = 'import procServUtils.manage, procServUtils.generator'
+        best = min(sum(importtime(stmt, toplevel=True).values()) for _i in range(3))
+        self.assertLess(best/1000.0, BUDGET)
@@ -0,0 +1,68 @@
+import os, shutil, tempfile, unittest
+from unittest import mock
+
+from procServUtils import metrics
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'metrics')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def fill(self, **kws):
+        # a: 1% CPU, memory growing 100 bytes per 5 minutes
+        # b: idle, constant memory, restarted half way
+        rows = []
+        for j in range(10):
+            T = 1000.0+300*j
+            rows.append({'name':'a', 'time':T, 'cpu_usec':3e6*j, 'mem':1000.0+100*j,
+                         'peak':2000.0, 'pids':2, 'started':900.0, 'load':0.5})
+            rows.append({'name':'b', 'time':T, 'cpu_usec':5.0, 'mem':500.0,
+                         'started':900.0 if j<5 else 2400.0, 'load':None})
+        with metrics.Metrics(self.fname, write=True, **kws) as M:
+            M.append(rows)
+
+    def check(self, S):
+        a, b = S
+        self.assertEqual(('a', 10, 0), (a.name, a.samples, a.restarts))
+        self.assertAlmostEqual(1.0, a.cpu_p50)
+        self.assertAlmostEqual(1.0, a.cpu_p95)
+        self.assertEqual((1500.0, 1900.0, 1900.0), (a.mem_p50, a.mem_p95, a.mem_max))
+        self.assertAlmostEqual(100*86400/300.0, a.growth)
+        self.assertAlmostEqual(1.0, a.fit)
+        self.assertIsNone(a.load_corr)  # constant load
+
+        self.assertEqual(('b', 10, 1), (b.name, b.samples, b.restarts))
+        self.assertEqual(0.0, b.cpu_p95)
+        self.assertEqual(0.0, b.growth)
+        self.assertIsNone(b.fit)
+        self.assertEqual([a], metrics.leaks(S))
+
+    def test_python(self):
+        self.fill()
+        with mock.patch.object(metrics, 'numpy', None):
+            self.check(metrics.analyze(fname=self.fname))
+            # only the second half
+            a, b = metrics.analyze(since=2500.0, fname=self.fname)
+            self.assertEqual((5, 5, 0), (a.samples, b.samples, b.restarts))
+
+    @unittest.skipIf(metrics.numpy is None, 'NumPy not available')
+    def test_numpy(self):
+        self.fill()
+        S = metrics.analyze(fname=self.fname)
+        self.check(S)
+        with mock.patch.object(metrics, 'numpy', None):
+            self.assertEqual(S, metrics.analyze(fname=self.fname))
+
+    def test_ring(self):
+        self.fill(capacity=8, maxnames=1)
+        with metrics.Metrics(self.fname) as M:
+            # no room for b in the name table
+            self.assertEqual(['a'], M.names())
+            C = M.columns()
+        self.assertEqual([1000.0+300*j for j in range(2, 10)], list(C['time']))
+
+    def test_missing(self):
+        self.assertEqual([], metrics.analyze(fname=self.fname))
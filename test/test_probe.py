@@ -0,0 +1,86 @@
+import asyncio, time, unittest
+
+from procServUtils import probe
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        H = probe.Histogram()
+        self.assertIsNone(H.percentile(50))
+        self.assertIsNone(H.mean)
+
+    def test_percentile(self):
+        H = probe.Histogram()
+        for L in [0.0005]*90+[0.015]*9+[7.0]:
+            H.add(L)
+        H.add(None)
+        self.assertEqual((100, 1, 7.0), (H.n, H.timeouts, H.max))
+        self.assertEqual(0.001, H.percentile(50))
+        self.assertEqual(0.001, H.percentile(90))
+        self.assertEqual(0.02, H.percentile(95))
+        self.assertEqual(0.02, H.percentile(99))
+        # beyond the last edge, the largest seen
+        self.assertEqual(7.0, H.percentile(100))
+        self.assertAlmostEqual((0.045+0.135+7.0)/100, H.mean)
+        B = list(H.buckets())
+        self.assertEqual((0.001, 90), B[0])
+        self.assertEqual((None, 1), B[-1])
+        self.assertEqual(100, sum(C for _E, C in B))
+
+class TestEndpoint(unittest.TestCase):
+    def test_endpoint(self):
+        self.assertEqual(('tcp', 'localhost', 2000), probe.endpoint(['2000']))
+        self.assertEqual(('tcp', 'localhost', 2000), probe.endpoint(['tcp:0.0.0.0:2000']))
+        self.assertEqual(('tcp', '10.0.0.1', 2000), probe.endpoint(['tcp:10.0.0.1:2000']))
+        self.assertEqual(('unix', '/run/ioc@a/control'), probe.endpoint(['unix:/run/ioc@a/control']))
+        # dynamic ports are skipped
+        self.assertEqual(('tcp', 'localhost', 2001), probe.endpoint(['tcp:0', 'tcp:2001']))
+        self.assertIsNone(probe.endpoint(['tcp:0']))
+        self.assertIsNone(probe.endpoint([]))
+
+class TestRateLimit(unittest.TestCase):
+    def test_rate(self):
+        async def starts(rate, n):
+            L = probe.RateLimit(rate)
+            T = []
+            for _i in range(n):
+                await L.acquire()
+                T.append(time.monotonic())
+            return T
+        T = asyncio.run(starts(50.0, 5))
+        self.assertGreaterEqual(T[-1]-T[0], 4*0.02*0.9)
+        # no limit
+        T = asyncio.run(starts(0, 5))
+        self.assertLess(T[-1]-T[0], 0.05)
+
+class TestProbe(unittest.TestCase):
+    def test_round(self):
+        async def console(R, W):
+            W.write(b'@@@ Welcome to procServ\r\n')
+            while True:
+                line = await R.readline()
+                if not line:
+                    break
+                W.write(b'\r\nepics> ')
+                await W.drain()
+            W.close()
+
+        async def run():
+            S = await asyncio.start_server(console, '127.0.0.1', 0)
+            port = S.sockets[0].getsockname()[1]
+            # a port nothing listens on
+            L = await asyncio.start_server(console, '127.0.0.1', 0)
+            dead = L.sockets[0].getsockname()[1]
+            L.close()
+            await L.wait_closed()
+            P = probe.Prober({'up':('tcp', '127.0.0.1', port), 'down':('tcp', '127.0.0.1', dead)},
+                             timeout=1.0, rate=0)
+            try:
+                return P, await P.round()
+            finally:
+                S.close()
+                await S.wait_closed()
+
+        P, R = asyncio.run(run())
+        self.assertEqual([('down', 'down'), ('up', 'ok')], [(X.name, X.state) for X in R])
+        self.assertIsNotNone(R[1].latency)
+        self.assertEqual((1, 0), (P.hist['up'].n, P.hist['down'].n))
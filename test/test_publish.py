@@ -0,0 +1,70 @@
+import os, shutil, tempfile, unittest
+from argparse import Namespace
+from unittest import mock
+
+from procServUtils import publish
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, 'run'))
+        P = mock.patch.dict(os.environ, {'HOME':os.path.join(self.dir, 'home'),
+                                         'XDG_RUNTIME_DIR':os.path.join(self.dir, 'run')})
+        P.start()
+        self.addCleanup(P.stop)
+        self.cf = os.path.join(self.dir, 'procs.cf')
+        P = mock.patch.object(publish, 'conserver_conf', self.cf)
+        P.start()
+        self.addCleanup(P.stop)
+        self.calls = []
+        P = mock.patch.object(publish, 'runsystemctl', lambda user, *cmd:self.calls.append(cmd))
+        P.start()
+        self.addCleanup(P.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def args(self, outsysd='sysd', **kws):
+        opts = dict(user=True, writeconf=True, writesysd=True, reload=False,
+                    outsysd=os.path.join(self.dir, outsysd))
+        opts.update(kws)
+        return Namespace(**opts)
+
+    def test_coalesce(self):
+        A, B = self.args(), self.args('other', writeconf=False, reload=True)
+        self.assertEqual(1, publish.request(A))
+        self.assertEqual(2, publish.request(B))
+        publish.publish(A, 1)
+        # one leader published both changes
+        self.assertEqual([('restart', 'conserver'), ('daemon-reload',)], self.calls)
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, 'sysd')))
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, 'other')))
+        self.assertTrue(os.path.isfile(self.cf))
+        self.assertEqual({'requested':2, 'done':2, 'pending':[]}, publish._readstate(True))
+
+        publish.publish(B, 2)
+        self.assertEqual(2, len(self.calls))
+
+    def test_options(self):
+        publish.request(self.args(writesysd=False, reload=True))
+        publish.publish(self.args(), 1)
+        self.assertEqual([('restart', 'conserver'), ('daemon-reload',)], self.calls)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'sysd')))
+
+    def test_failure(self):
+        A = self.args()
+        publish.request(A)
+        publish.request(A)
+        def fail(user, *cmd):
+            raise OSError('no systemctl')
+        with mock.patch.object(publish, 'runsystemctl', fail):
+            self.assertRaises(OSError, publish.publish, A, 1)
+        # left for the next leader, along with changes queued meanwhile
+        publish.request(self.args('other'))
+        S = publish._readstate(True)
+        self.assertEqual((3, 0, 3), (S['requested'], S['done'], len(S['pending'])))
+
+        publish.publish(A, 3)
+        self.assertEqual([('daemon-reload',)], self.calls)
+        self.assertEqual({'requested':3, 'done':3, 'pending':[]}, publish._readstate(True))
+        self.assertTrue(os.path.isdir(os.path.join(self.dir, 'other')))
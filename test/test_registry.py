@@ -0,0 +1,66 @@
+import os, shutil, tempfile, unittest
+from unittest import mock
+
+from procServUtils import registry
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp()
+        P = mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR':self.rundir})
+        P.start()
+        self.addCleanup(P.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.rundir)
+
+    def test_empty(self):
+        self.assertIsNone(registry.lookup('a', user=True))
+        self.assertEqual([], list(registry.scan(user=True)))
+
+    def test_update(self):
+        E = registry.update('a', user=True, pid=42, ports=('tcp:2000',), state='running')
+        self.assertEqual(registry.Entry('a', 'ioc@a.service', 42, None, ('tcp:2000',), 'running'), E)
+        self.assertEqual(E, registry.lookup('a', user=True))
+        # only the given fields change
+        E = registry.update('a', user=True, pid=None, state='stopped')
+        self.assertEqual(registry.Entry('a', 'ioc@a.service', None, None, ('tcp:2000',), 'stopped'), E)
+        self.assertEqual(E, registry.lookup('a', user=True))
+        self.assertIsNone(registry.lookup('b', user=True))
+
+    def test_grow(self):
+        names = ['ioc%d'%i for i in range(200)]
+        for i, N in enumerate(names):
+            registry.update(N, user=True, pid=i+1, state='running')
+        self.assertEqual(sorted(names), sorted(E.name for E in registry.scan(user=True)))
+        for i, N in enumerate(names):
+            self.assertEqual(i+1, registry.lookup(N, user=True).pid)
+
+    def test_record(self):
+        D = os.path.join(self.rundir, 'ioc@a')
+        os.makedirs(D)
+        with open(os.path.join(D, 'info'), 'w') as F:
+            F.write('pid:42\ntcp:127.0.0.1:2000\n')
+        E = registry.record_start(None, 'a', 42, user=True)
+        self.assertEqual((42, ('tcp:127.0.0.1:2000',), 'running'), (E.pid, E.ports, E.state))
+        self.assertIsNotNone(E.started)
+
+        E = registry.record_stop(None, 'a', result='exit-code', user=True)
+        self.assertEqual((None, 'failed'), (E.pid, E.state))
+        E = registry.record_stop(None, 'a', user=True)
+        self.assertEqual('stopped', E.state)
+
+    def test_aliases(self):
+        registry.update('a', user=True, unit='ioc@a-blue.service', pid=1, state='running')
+        registry.update('b', user=True, pid=2, state='running')
+        registry.update('c', user=True, unit='ioc@c-green.service', state='stopped')
+        self.assertEqual({'a-blue':'a'}, registry.aliases(user=True))
+
+    def test_dynamic_port(self):
+        from procServUtils.conf import InstanceConfig, _defaults
+        C = InstanceConfig(_defaults)
+        C.read_string('[a]\n[b]\nport = 2000\n[c]\nport = tcp:127.0.0.1:0\n[d]\nport = unix:/run/d\n')
+        # no info file yet
+        self.assertEqual((), registry.record_start(C, 'a', 1, user=True).ports)
+        self.assertEqual(('tcp:2000',), registry.record_start(C, 'b', 1, user=True).ports)
+        self.assertEqual((), registry.record_start(C, 'c', 1, user=True).ports)
+        self.assertEqual(('unix:/run/d',), registry.record_start(C, 'd', 1, user=True).ports)
@@ -0,0 +1,74 @@
+import os, shutil, tempfile, unittest
+
+from procServUtils import render
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.inv = os.path.join(self.dir, 'inv')
+        self.out = os.path.join(self.dir, 'out')
+        os.makedirs(self.inv)
+        with open(os.path.join(self.inv, 'a.conf'), 'w') as F:
+            F.write("""
+[bpm{1..2}]
+command = ./st.cmd
+chdir = /iocs/bpm%(index)s
+port = 200%(index)s
+host = ioc-a
+
+[other]
+command = ./st.cmd
+port = tcp:3000
+host = ioc-b
+
+[everywhere]
+command = ./st.cmd
+""")
+        with open(os.path.join(self.inv, 'b.conf'), 'w') as F:
+            F.write("""
+[notb]
+command = ./st.cmd
+host = !ioc-b
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, *path):
+        with open(os.path.join(self.out, *path)) as F:
+            return F.read()
+
+    def test_split(self):
+        C = render.readinventory(self.inv)
+        self.assertEqual(['ioc-a', 'ioc-b'], render.gethosts(C))
+        S = render.split(C, ['ioc-a', 'ioc-b'])
+        self.assertEqual(['bpm1', 'bpm2', 'everywhere', 'notb'], [N for N, _O in S['ioc-a']])
+        self.assertEqual(['everywhere', 'other'], [N for N, _O in S['ioc-b']])
+        self.assertIn(('chdir', '/iocs/bpm2'), dict(S['ioc-a'])['bpm2'])
+
+    def test_render(self):
+        R = render.render(self.inv, self.out, jobs=2)
+        self.assertEqual(['ioc-a', 'ioc-b'], [H for H, _D, _C in R])
+        self.assertTrue(all(C for _H, _D, C in R))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.out, 'ioc-b', 'systemd'))),
+                         ['ioc@everywhere.service', 'ioc@other.service', 'multi-user.target.wants'])
+
+        unit = self.read('ioc-a', 'systemd', 'ioc@bpm1.service')
+        self.assertIn('--info-file=/run/ioc@bpm1/info', unit)
+        self.assertIn('ExecStartPost=-+/usr/bin/python3 -m procServUtils.launch --system', unit)
+        self.assertIn('User=nobody', unit)
+        self.assertIn('ConditionHost=ioc-a', unit)
+        self.assertIn('--port=3000', self.read('ioc-b', 'systemd', 'ioc@other.service'))
+        self.assertIn('console bpm2 {', self.read('ioc-a', 'conserver', 'procs.cf'))
+
+        # same inventory, same bundles
+        self.assertEqual([(H, D, False) for H, D, _C in R], render.render(self.inv, self.out))
+
+    def test_target(self):
+        render.render(self.inv, self.out, hosts=['ioc-c'], user=True,
+                      python='/opt/py/bin/python3', rundir='/run/user/1000')
+        self.assertEqual(['ioc-c'], os.listdir(self.out))
+        unit = self.read('ioc-c', 'systemd', 'ioc@notb.service')
+        self.assertIn('--info-file=/run/user/1000/ioc@notb/info', unit)
+        self.assertIn('ExecStartPost=-+/opt/py/bin/python3 -m procServUtils.launch --user', unit)
+        self.assertNotIn('User=', unit)
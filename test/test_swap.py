@@ -0,0 +1,59 @@
+import os, shutil, tempfile, unittest
+from argparse import Namespace
+from unittest import mock
+
+from procServUtils.conf import getconf
+from procServUtils import manage
+
+class TestSwapNames(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(('ioc@a.service', 'a-blue'), manage._swapnames('a', None))
+        self.assertEqual(('ioc@a.service', 'a-blue'), manage._swapnames('a', 'ioc@a.service'))
+        self.assertEqual(('ioc@a-blue.service', 'a-green'), manage._swapnames('a', 'ioc@a-blue.service'))
+        self.assertEqual(('ioc@a-green.service', 'a-blue'), manage._swapnames('a', 'ioc@a-green.service'))
+
+class TestSetOpts(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        P = mock.patch.dict(os.environ, {'HOME':self.home})
+        P.start()
+        self.addCleanup(P.stop)
+        self.confdir = os.path.join(self.home, '.config', 'procServ.d')
+        os.makedirs(self.confdir)
+        with open(os.path.join(self.confdir, 'a.conf'), 'w') as F:
+            F.write("""
+[a]
+command = ./st.cmd
+port = 2000
+
+[other]
+command = ./other
+""")
+        with open(os.path.join(self.confdir, 'set.conf'), 'w') as F:
+            F.write("""
+[b{1..2}]
+command = ./b
+chdir = /iocs/b%(index)s
+""")
+        self.args = Namespace(user=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def test_section(self):
+        manage._setopts(self.args, 'a', getconf(user=True),
+                        {'command':'sh -c "date +%s"', 'port':'2001', 'swapped':'a-blue'})
+        C = getconf(user=True)
+        self.assertEqual('sh -c "date +%s"', C.get('a', 'command'))
+        self.assertEqual(('2001', 'a-blue'), (C.get('a', 'port'), C.get('a', 'swapped')))
+        self.assertEqual('./other', C.get('other', 'command'))
+        self.assertEqual(['a.conf', 'set.conf'], sorted(os.listdir(self.confdir)))
+
+    def test_member(self):
+        # a set member gets a section of its own, resolved from the set
+        manage._setopts(self.args, 'b2', getconf(user=True), {'port':'2002'})
+        C = getconf(user=True)
+        self.assertEqual(('./b', '/iocs/b2', '2002'),
+                         (C.get('b2', 'command'), C.get('b2', 'chdir'), C.get('b2', 'port')))
+        self.assertEqual('0', C.get('b1', 'port'))
+        self.assertTrue(os.path.isfile(os.path.join(self.confdir, 'b2.conf')))